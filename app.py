@@ -1,16 +1,36 @@
 from __future__ import annotations
 
+import atexit
+import csv
+import hashlib
+import http.client
+import itertools
 import json
 import os
+import queue
 import re
+import secrets
+import socket
+import sqlite3
+import threading
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from dataclasses import dataclass
 from math import cos, pi, sin
-from urllib.error import HTTPError, URLError
-from urllib.request import Request, urlopen
-from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+from urllib.request import getproxies, proxy_bypass
+from typing import Callable, Dict, Iterator, List, Tuple
 
-from flask import Flask, redirect, render_template, request, session, url_for
+import click
+from flask import Flask, jsonify, redirect, render_template, request, session, url_for
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+
+try:
+    import numpy as np
+except ImportError:  # Opcional: `flask score-bulk` usa Python puro sin NumPy.
+    np = None
 
 
 def _load_dotenv(path: str = ".env") -> None:
@@ -187,6 +207,8 @@ QUESTIONS: List[Question] = [
     ),
 ]
 
+CATEGORY_ORDER: List[str] = list(dict.fromkeys(q.category for q in QUESTIONS))
+
 SCALE: List[Tuple[int, str]] = [
     (1, "No"),
     (2, "Más no que sí"),
@@ -207,6 +229,171 @@ def create_app() -> Flask:
     app.config["OPENAI_BASE_URL"] = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
     app.config["OPENAI_TIMEOUT_SECONDS"] = int(os.getenv("OPENAI_TIMEOUT_SECONDS", "10"))
     app.config["OPENAI_API_MODE"] = os.getenv("OPENAI_API_MODE", "auto").strip().lower() or "auto"
+    app.config["OPENAI_MAX_WORKERS"] = int(os.getenv("OPENAI_MAX_WORKERS", "8"))
+    app.config["OPENAI_DEADLINE_SECONDS"] = float(
+        os.getenv("OPENAI_DEADLINE_SECONDS", str(app.config["OPENAI_TIMEOUT_SECONDS"]))
+    )
+    app.config["OPENAI_POOL_SIZE"] = int(os.getenv("OPENAI_POOL_SIZE", "4"))
+    _HTTP_POOL.max_idle_per_host = app.config["OPENAI_POOL_SIZE"]
+    app.config["STATE_DB_PATH"] = os.getenv("STATE_DB_PATH", os.path.join(app.instance_path, "state.sqlite3"))
+    app.config["OPENAI_MODE_CACHE_TTL_SECONDS"] = int(os.getenv("OPENAI_MODE_CACHE_TTL_SECONDS", "3600"))
+    _API_MODES.path = app.config["STATE_DB_PATH"]
+    _API_MODES.ttl_seconds = app.config["OPENAI_MODE_CACHE_TTL_SECONDS"]
+    app.config["AI_SINGLE_FLIGHT"] = os.getenv("AI_SINGLE_FLIGHT", "shared").strip().lower() or "shared"
+    app.config["AI_SINGLE_FLIGHT_WAIT_SECONDS"] = float(
+        os.getenv("AI_SINGLE_FLIGHT_WAIT_SECONDS", str(2 * app.config["OPENAI_TIMEOUT_SECONDS"]))
+    )
+    _SINGLE_FLIGHT.mode = app.config["AI_SINGLE_FLIGHT"]
+    _SINGLE_FLIGHT.wait_seconds = app.config["AI_SINGLE_FLIGHT_WAIT_SECONDS"]
+    _SINGLE_FLIGHT.locks.path = app.config["STATE_DB_PATH"]
+    app.config["OPENAI_BREAKER_ENABLED"] = _env_flag("OPENAI_BREAKER_ENABLED") is not False
+    app.config["OPENAI_BREAKER_FAILURE_RATE"] = float(os.getenv("OPENAI_BREAKER_FAILURE_RATE", "0.5"))
+    app.config["OPENAI_BREAKER_MIN_CALLS"] = int(os.getenv("OPENAI_BREAKER_MIN_CALLS", "5"))
+    app.config["OPENAI_BREAKER_WINDOW_SECONDS"] = float(os.getenv("OPENAI_BREAKER_WINDOW_SECONDS", "60"))
+    app.config["OPENAI_BREAKER_COOLDOWN_SECONDS"] = float(os.getenv("OPENAI_BREAKER_COOLDOWN_SECONDS", "30"))
+    _BREAKER.path = app.config["STATE_DB_PATH"]
+    _BREAKER.enabled = app.config["OPENAI_BREAKER_ENABLED"]
+    _BREAKER.failure_rate = app.config["OPENAI_BREAKER_FAILURE_RATE"]
+    _BREAKER.min_calls = app.config["OPENAI_BREAKER_MIN_CALLS"]
+    _BREAKER.window_seconds = app.config["OPENAI_BREAKER_WINDOW_SECONDS"]
+    _BREAKER.cooldown_seconds = app.config["OPENAI_BREAKER_COOLDOWN_SECONDS"]
+    _BREAKER.probe_seconds = 2 * app.config["OPENAI_TIMEOUT_SECONDS"]
+    app.config["OPENAI_MAX_CONCURRENT"] = int(os.getenv("OPENAI_MAX_CONCURRENT", "0"))
+    app.config["OPENAI_RATE_LIMIT_RPM"] = float(os.getenv("OPENAI_RATE_LIMIT_RPM", "0"))
+    app.config["OPENAI_RATE_LIMIT_BURST"] = int(os.getenv("OPENAI_RATE_LIMIT_BURST", "10"))
+    app.config["OPENAI_SLOT_WAIT_SECONDS"] = float(os.getenv("OPENAI_SLOT_WAIT_SECONDS", "0.5"))
+    _LIMITER.path = app.config["STATE_DB_PATH"]
+    _LIMITER.max_concurrent = app.config["OPENAI_MAX_CONCURRENT"]
+    _LIMITER.rate_per_minute = app.config["OPENAI_RATE_LIMIT_RPM"]
+    _LIMITER.burst = app.config["OPENAI_RATE_LIMIT_BURST"]
+    _LIMITER.wait_seconds = app.config["OPENAI_SLOT_WAIT_SECONDS"]
+    _LIMITER.lease_seconds = 2 * app.config["OPENAI_TIMEOUT_SECONDS"]
+    app.config["OPENAI_HEDGE"] = bool(_env_flag("OPENAI_HEDGE"))
+    app.config["OPENAI_HEDGE_PERCENTILE"] = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95"))
+    app.config["OPENAI_HEDGE_MIN_DELAY_SECONDS"] = float(os.getenv("OPENAI_HEDGE_MIN_DELAY_SECONDS", "1.0"))
+    app.config["OPENAI_HEDGE_BUDGET_PCT"] = float(os.getenv("OPENAI_HEDGE_BUDGET_PCT", "10"))
+    _HEDGER.enabled = app.config["OPENAI_HEDGE"]
+    _HEDGER.percentile = app.config["OPENAI_HEDGE_PERCENTILE"]
+    _HEDGER.min_delay_seconds = app.config["OPENAI_HEDGE_MIN_DELAY_SECONDS"]
+    _HEDGER.budget_ratio = app.config["OPENAI_HEDGE_BUDGET_PCT"] / 100.0
+    # Cada tarea puede usar su propio modelo, timeout, temperatura y tope de salida.
+    # La interpretación (1–2 frases) admite un modelo más rápido y un tope corto;
+    # la página espera a ambas llamadas, así que acortarla acorta la ruta crítica.
+    for task, prefix, max_tokens in (
+        ("interpretation", "OPENAI_INTERP", "200"),
+        ("insights", "OPENAI_INSIGHTS", "1600"),
+    ):
+        app.config[f"{prefix}_MODEL"] = os.getenv(f"{prefix}_MODEL", "").strip() or app.config["OPENAI_MODEL"]
+        app.config[f"{prefix}_TIMEOUT_SECONDS"] = int(
+            os.getenv(f"{prefix}_TIMEOUT_SECONDS", str(app.config["OPENAI_TIMEOUT_SECONDS"]))
+        )
+        app.config[f"{prefix}_TEMPERATURE"] = float(os.getenv(f"{prefix}_TEMPERATURE", "0.3"))
+        app.config[f"{prefix}_MAX_OUTPUT_TOKENS"] = int(os.getenv(f"{prefix}_MAX_OUTPUT_TOKENS", max_tokens))
+        _OPENAI_TASKS[task] = _TaskSettings(
+            model=app.config[f"{prefix}_MODEL"],
+            timeout_seconds=app.config[f"{prefix}_TIMEOUT_SECONDS"],
+            temperature=app.config[f"{prefix}_TEMPERATURE"],
+            max_output_tokens=app.config[f"{prefix}_MAX_OUTPUT_TOKENS"],
+        )
+    slowest = max(settings.timeout_seconds for settings in _OPENAI_TASKS.values())
+    _BREAKER.probe_seconds = 2 * max(app.config["OPENAI_TIMEOUT_SECONDS"], slowest)
+    _LIMITER.lease_seconds = 2 * max(app.config["OPENAI_TIMEOUT_SECONDS"], slowest)
+    # Un trabajo puede hacer plan y fallback a chat/completions: el lease cubre ambos.
+    _JOBS.lease_seconds = 4 * max(app.config["OPENAI_TIMEOUT_SECONDS"], slowest) + 10
+    app.config["AI_CACHE_BACKEND"] = os.getenv("AI_CACHE_BACKEND", "tiered").strip().lower() or "tiered"
+    app.config["AI_CACHE_PATH"] = os.getenv("AI_CACHE_PATH", os.path.join(app.instance_path, "ai_cache.sqlite3"))
+    app.config["AI_CACHE_TTL_SECONDS"] = int(os.getenv("AI_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+    app.config["AI_CACHE_MAX_ENTRIES"] = int(os.getenv("AI_CACHE_MAX_ENTRIES", "1024"))
+    app.config["AI_CACHE_DB_MAX_ENTRIES"] = int(os.getenv("AI_CACHE_DB_MAX_ENTRIES", "50000"))
+    app.config["AI_SESSION_MAX_REFS"] = int(os.getenv("AI_SESSION_MAX_REFS", "5"))
+    app.config["AI_ASYNC_RESULTS"] = bool(_env_flag("AI_ASYNC_RESULTS"))
+    # La cola implica el modo asíncrono: la página no espera a OpenAI.
+    app.config["AI_JOB_QUEUE"] = bool(_env_flag("AI_JOB_QUEUE"))
+    app.config["AI_ASYNC_RESULTS"] = app.config["AI_ASYNC_RESULTS"] or app.config["AI_JOB_QUEUE"]
+    if app.config["AI_ASYNC_RESULTS"] and app.config["AI_CACHE_BACKEND"] not in _SHARED_AI_CACHE_BACKENDS:
+        # El plan se genera en otro hilo/proceso y la página lo consulta en el
+        # caché: con un caché por proceso la consulta puede caer en otro worker.
+        app.logger.warning(
+            "AI_ASYNC_RESULTS/AI_JOB_QUEUE requieren AI_CACHE_BACKEND=tiered o sqlite (es %s); se desactivan.",
+            app.config["AI_CACHE_BACKEND"],
+        )
+        app.config["AI_ASYNC_RESULTS"] = app.config["AI_JOB_QUEUE"] = False
+    app.config["AI_JOB_DB_PATH"] = os.getenv("AI_JOB_DB_PATH", os.path.join(app.instance_path, "ai_jobs.sqlite3"))
+    app.config["AI_JOB_MAX_ATTEMPTS"] = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+    app.config["AI_JOB_RETRY_SECONDS"] = float(os.getenv("AI_JOB_RETRY_SECONDS", "2"))
+    app.config["AI_JOB_WEB_PRIORITY"] = int(os.getenv("AI_JOB_WEB_PRIORITY", "10"))
+    app.config["AI_JOB_WAIT_SECONDS"] = float(os.getenv("AI_JOB_WAIT_SECONDS", "60"))
+    _JOBS.path = app.config["AI_JOB_DB_PATH"]
+    _JOBS.max_attempts = max(1, app.config["AI_JOB_MAX_ATTEMPTS"])
+    _JOBS.retry_seconds = app.config["AI_JOB_RETRY_SECONDS"]
+    app.config["OPENAI_STREAM"] = bool(_env_flag("OPENAI_STREAM"))
+    app.config["OPENAI_COMBINED_PROMPT"] = bool(_env_flag("OPENAI_COMBINED_PROMPT"))
+    app.config["AI_CACHE_PCT_BAND"] = int(os.getenv("AI_CACHE_PCT_BAND", "1"))
+    app.config["AI_CACHE_TOP_QUESTIONS"] = max(1, min(5, int(os.getenv("AI_CACHE_TOP_QUESTIONS", "5"))))
+    app.config["AI_CACHE_STATS_GRANULARITIES"] = _parse_granularities(
+        os.getenv("AI_CACHE_STATS_GRANULARITIES", "")
+    )
+    _GRANULARITY.path = app.config["STATE_DB_PATH"]
+    _GRANULARITY.pct_band = app.config["AI_CACHE_PCT_BAND"]
+    _GRANULARITY.top_questions = app.config["AI_CACHE_TOP_QUESTIONS"]
+    # La granularidad activa siempre se mide; una lista vacía desactiva las métricas.
+    _GRANULARITY.stats_granularities = (
+        sorted(
+            set(app.config["AI_CACHE_STATS_GRANULARITIES"])
+            | {(max(1, _GRANULARITY.pct_band), _GRANULARITY.top_questions)}
+        )
+        if app.config["AI_CACHE_STATS_GRANULARITIES"]
+        else []
+    )
+    _GRANULARITY.ttl_seconds = app.config["AI_CACHE_TTL_SECONDS"]
+    app.config["AI_PAYLOAD_MODE"] = os.getenv("AI_PAYLOAD_MODE", "full").strip().lower() or "full"
+    if app.config["AI_PAYLOAD_MODE"] not in _SCORING_STATIC_KEYS:
+        app.config["AI_PAYLOAD_MODE"] = "full"
+    app.config["OPENAI_PROMPT_TOKEN_BUDGET"] = int(os.getenv("OPENAI_PROMPT_TOKEN_BUDGET", "0"))
+    _PROMPT_BUDGET.path = app.config["STATE_DB_PATH"]
+    _PROMPT_BUDGET.budget_tokens = app.config["OPENAI_PROMPT_TOKEN_BUDGET"]
+    app.config["AI_CACHE_SEED_PATH"] = os.getenv(
+        "AI_CACHE_SEED_PATH", os.path.join(app.instance_path, "ai_prewarm.jsonl")
+    )
+    app.config["SUBMISSION_LOG_DIR"] = os.getenv(
+        "SUBMISSION_LOG_DIR", os.path.join(app.instance_path, "submissions")
+    ).strip()
+    app.config["SUBMISSION_LOG_SEGMENT_MAX_MB"] = float(os.getenv("SUBMISSION_LOG_SEGMENT_MAX_MB", "64"))
+    app.config["SUBMISSION_LOG_BATCH_SIZE"] = int(os.getenv("SUBMISSION_LOG_BATCH_SIZE", "500"))
+    app.config["SUBMISSION_LOG_FLUSH_SECONDS"] = float(os.getenv("SUBMISSION_LOG_FLUSH_SECONDS", "1.0"))
+    app.config["SUBMISSION_LOG_QUEUE_SIZE"] = int(os.getenv("SUBMISSION_LOG_QUEUE_SIZE", "10000"))
+    _SUBMISSIONS.directory = app.config["SUBMISSION_LOG_DIR"]
+    _SUBMISSIONS.segment_max_bytes = int(app.config["SUBMISSION_LOG_SEGMENT_MAX_MB"] * 1024 * 1024)
+    _SUBMISSIONS.batch_size = max(1, app.config["SUBMISSION_LOG_BATCH_SIZE"])
+    _SUBMISSIONS.flush_seconds = app.config["SUBMISSION_LOG_FLUSH_SECONDS"]
+    _SUBMISSIONS.queue_size = app.config["SUBMISSION_LOG_QUEUE_SIZE"]
+    app.config["COHORT_BENCHMARK"] = _env_flag("COHORT_BENCHMARK") is not False
+    app.config["COHORT_MIN_SAMPLES"] = int(os.getenv("COHORT_MIN_SAMPLES", "30"))
+    app.config["COHORT_CACHE_SECONDS"] = float(os.getenv("COHORT_CACHE_SECONDS", "30"))
+    _COHORT.path = app.config["STATE_DB_PATH"] if app.config["COHORT_BENCHMARK"] else ""
+    _COHORT.min_samples = app.config["COHORT_MIN_SAMPLES"]
+    _COHORT.cache_seconds = app.config["COHORT_CACHE_SECONDS"]
+    _SUBMISSIONS.cohort = _COHORT
+    # Las métricas de granularidad sólo interesan si hay IA; las escribe el hilo de la bitácora.
+    _SUBMISSIONS.granularity = _GRANULARITY if app.config["OPENAI_API_KEY"] else None
+    app.config["AI_BATCH_STORE_PATH"] = os.getenv(
+        "AI_BATCH_STORE_PATH", os.path.join(app.instance_path, "ai_batch.sqlite3")
+    ).strip()
+    _AI_STORE.path = app.config["AI_BATCH_STORE_PATH"]
+    app.extensions["ai_cache"] = _build_ai_cache(app.config)
+    _load_ai_cache_seed(app.extensions["ai_cache"], app.config["AI_CACHE_SEED_PATH"])
+    app.config["SESSION_BACKEND"] = os.getenv("SESSION_BACKEND", "cookie").strip().lower() or "cookie"
+    app.config["SESSION_DB_PATH"] = os.getenv("SESSION_DB_PATH", os.path.join(app.instance_path, "sessions.sqlite3"))
+    app.config["SESSION_TTL_SECONDS"] = int(
+        os.getenv("SESSION_TTL_SECONDS", str(int(app.permanent_session_lifetime.total_seconds())))
+    )
+    app.config["SESSION_CLEANUP_INTERVAL_SECONDS"] = int(os.getenv("SESSION_CLEANUP_INTERVAL_SECONDS", "600"))
+    if app.config["SESSION_BACKEND"] == "sqlite":
+        app.session_interface = _SQLiteSessionInterface(
+            _SQLiteSessionStore(app.config["SESSION_DB_PATH"]),
+            ttl_seconds=app.config["SESSION_TTL_SECONDS"],
+            cleanup_interval_seconds=app.config["SESSION_CLEANUP_INTERVAL_SECONDS"],
+        )
 
     @app.get("/")
     def index():
@@ -230,19 +417,159 @@ def create_app() -> Flask:
             return redirect(url_for("cuestionario"))
 
         session["last_answers"] = answers
+        _SUBMISSIONS.record(answers)
         total, total_pct, by_category = _compute_scores(answers)
         radar = _build_radar(by_category)
-        ai, ai_error, ai_error_detail = _maybe_ai_result(
-            api_key=app.config["OPENAI_API_KEY"],
-            base_url=app.config["OPENAI_BASE_URL"],
-            model=app.config["OPENAI_MODEL"],
-            api_mode=app.config["OPENAI_API_MODE"],
-            timeout_seconds=app.config["OPENAI_TIMEOUT_SECONDS"],
-            total_pct=total_pct,
-            by_category=by_category,
-            answers=answers,
-            debug=bool(app.debug),
-        )
+        cohort = _COHORT.percentiles(total=total, by_category=by_category) if _COHORT.path else None
+
+        ai_cache = app.extensions["ai_cache"]
+        remembered = None
+        if app.config["OPENAI_API_KEY"] and app.config["AI_ASYNC_RESULTS"]:
+            # Sólo el modo asíncrono consulta la referencia desde el navegador.
+            remembered = _remember_ai_ref(
+                ai_cache,
+                total_pct=total_pct,
+                by_category=by_category,
+                answers=answers,
+                max_refs=app.config["AI_SESSION_MAX_REFS"],
+                payload_mode=app.config["AI_PAYLOAD_MODE"],
+            )
+
+        # Ambas llamadas a OpenAI corren en paralelo con un único deadline compartido:
+        # la latencia de la página es la de la llamada más lenta, no la suma.
+        # El deadline viaja hasta las solicitudes HTTP, así que cada etapa
+        # (incluido el fallback a chat/completions) sólo usa el tiempo que queda.
+        # El caché de resultados es compartido por todos los usuarios (y, con el
+        # backend SQLite, por todos los workers), así que los hilos no tocan la sesión.
+        deadline = _Deadline(app.config["OPENAI_DEADLINE_SECONDS"])
+        common = {
+            "api_key": app.config["OPENAI_API_KEY"],
+            "base_url": app.config["OPENAI_BASE_URL"],
+            "model": app.config["OPENAI_MODEL"],
+            "api_mode": app.config["OPENAI_API_MODE"],
+            "timeout_seconds": app.config["OPENAI_TIMEOUT_SECONDS"],
+            "deadline": deadline,
+            "by_category": by_category,
+            "cache": ai_cache,
+            "debug": bool(app.debug),
+        }
+        # Sólo el plan (y el prompt combinado) dependen del modo del payload.
+        payload_mode = app.config["AI_PAYLOAD_MODE"]
+        executor = _ai_executor(app.config["OPENAI_MAX_WORKERS"])
+
+        if remembered is not None:
+            # Modo asíncrono: la parte determinista se responde de inmediato y el
+            # navegador consulta `resultado_ia` hasta que el bloque de IA esté listo.
+            ref, entry = remembered
+            status = _ai_ref_status(ai_cache, entry, debug=bool(app.debug))
+            if status["status"] != "ready":
+                # Con AI_JOB_QUEUE el trabajo va a la cola persistente y lo corre
+                # `flask ai-worker`; si no (o si la cola no responde), un hilo de
+                # este mismo proceso.
+                def dispatch(kind: str, job: Callable[..., None], **kwargs) -> None:
+                    if app.config["AI_JOB_QUEUE"]:
+                        try:
+                            _JOBS.enqueue(
+                                kind,
+                                {"entry": entry, "answers": answers, "stream": app.config["OPENAI_STREAM"]},
+                                dedup_key=str(entry["interpretation" if kind == "interpretation" else "ai"]),
+                                priority=app.config["AI_JOB_WEB_PRIORITY"],
+                            )
+                            return
+                        except sqlite3.Error as e:
+                            app.logger.warning(
+                                "No se pudo encolar el trabajo de IA %s (%s); se corre en este proceso.", kind, e
+                            )
+                    executor.submit(job, total_pct=total_pct, **kwargs, **common)
+
+                # El prompt combinado sólo conviene si faltan ambas partes; si una
+                # ya está en caché, se pide únicamente la que falta.
+                if app.config["OPENAI_COMBINED_PROMPT"] and status["ai"] is None and status["interpretation_ai"] is None:
+                    ai_cache.delete(f"ai_error_v1:{entry['ai']}")
+                    ai_cache.delete(f"ai_error_v1:{entry['interpretation']}")
+                    dispatch(
+                        "combined",
+                        _combined_job,
+                        entry=entry,
+                        stream=app.config["OPENAI_STREAM"],
+                        answers=answers,
+                        payload_mode=payload_mode,
+                    )
+                else:
+                    if status["ai"] is None:
+                        ai_cache.delete(f"ai_error_v1:{entry['ai']}")
+                        dispatch(
+                            "ai",
+                            _ai_result_job,
+                            cache_key=entry["ai"],
+                            stream=app.config["OPENAI_STREAM"],
+                            answers=answers,
+                            payload_mode=payload_mode,
+                        )
+                    if status["interpretation_ai"] is None:
+                        ai_cache.delete(f"ai_error_v1:{entry['interpretation']}")
+                        dispatch("interpretation", _interpretation_job, cache_key=entry["interpretation"])
+                return render_template(
+                    "result.html",
+                    questions=QUESTIONS,
+                    answers=answers,
+                    total=total,
+                    total_pct=total_pct,
+                    by_category=by_category,
+                    radar=radar,
+                    cohort=cohort,
+                    ai=None,
+                    ai_pending=True,
+                    ai_ref=ref,
+                    ai_poll_timeout_ms=int(
+                        (
+                            app.config["AI_JOB_WAIT_SECONDS"]
+                            if app.config["AI_JOB_QUEUE"]
+                            else app.config["OPENAI_DEADLINE_SECONDS"] + 5
+                        )
+                        * 1000
+                    ),
+                    ai_enabled=True,
+                    interpretation=_interpretation_static(total_pct),
+                )
+            return render_template(
+                "result.html",
+                questions=QUESTIONS,
+                answers=answers,
+                total=total,
+                total_pct=total_pct,
+                by_category=by_category,
+                radar=radar,
+                cohort=cohort,
+                ai=status["ai"],
+                ai_error=status["ai_error"],
+                ai_error_detail=status["ai_error_detail"],
+                ai_enabled=True,
+                interpretation=status["interpretation"],
+            )
+
+        timed_out = (None, "El análisis con IA tardó demasiado. Inténtalo de nuevo en unos momentos.", None)
+        if app.config["OPENAI_COMBINED_PROMPT"]:
+            combined_future = executor.submit(
+                _maybe_ai_combined, total_pct=total_pct, answers=answers, payload_mode=payload_mode, **common
+            )
+            wait([combined_future], timeout=deadline.remaining())
+            (ai, ai_error, ai_error_detail), (interpretation, interp_error) = _future_result(
+                combined_future, (timed_out, (_interpretation_static(total_pct), None))
+            )
+        else:
+            ai_future = executor.submit(
+                _maybe_ai_result, total_pct=total_pct, answers=answers, payload_mode=payload_mode, **common
+            )
+            interp_future = executor.submit(_interpretation, total_pct, **common)
+            wait([ai_future, interp_future], timeout=deadline.remaining())
+
+            ai, ai_error, ai_error_detail = _future_result(ai_future, timed_out)
+            interpretation, interp_error = _future_result(
+                interp_future, (_interpretation_static(total_pct), None)
+            )
+        if interp_error and app.debug:
+            session["flash_error"] = interp_error
 
         return render_template(
             "result.html",
@@ -252,109 +579,617 @@ def create_app() -> Flask:
             total_pct=total_pct,
             by_category=by_category,
             radar=radar,
+            cohort=cohort,
             ai=ai,
             ai_error=ai_error,
             ai_error_detail=ai_error_detail,
             ai_enabled=bool(app.config["OPENAI_API_KEY"]),
-            interpretation=_interpretation(
-                total_pct,
-                by_category=by_category,
-                api_key=app.config["OPENAI_API_KEY"],
-                base_url=app.config["OPENAI_BASE_URL"],
-                model=app.config["OPENAI_MODEL"],
-                api_mode=app.config["OPENAI_API_MODE"],
-                timeout_seconds=app.config["OPENAI_TIMEOUT_SECONDS"],
-                debug=bool(app.debug),
-            ),
+            interpretation=interpretation,
         )
 
+    @app.get("/resultado/ia/<ref>")
+    def resultado_ia(ref: str):
+        if ref not in session.get("ai_refs", []):
+            return jsonify({"status": "unknown"}), 404
+        entry = app.extensions["ai_cache"].get(f"ai_ref_v2:{ref}")
+        if not isinstance(entry, dict):
+            return jsonify({"status": "unknown"}), 404
+        return jsonify(_ai_ref_status(app.extensions["ai_cache"], entry, debug=bool(app.debug)))
+
     @app.get("/reset")
     def reset():
         session.pop("last_answers", None)
         session.pop("flash_error", None)
         return redirect(url_for("index"))
 
+    @app.before_request
+    def drop_legacy_ai_session_entries():
+        # Cookies anteriores guardaban cada resultado de IA completo en la sesión.
+        legacy = [k for k in session.keys() if k.startswith(_LEGACY_SESSION_AI_PREFIXES)]
+        for key in legacy:
+            session.pop(key, None)
+
     @app.context_processor
     def inject_flash_error():
         flash_error = session.pop("flash_error", None)
         return {"flash_error": flash_error}
 
-    return app
+    @app.cli.command("ai-prewarm", help="Precalcula plan e interpretación de IA para los perfiles más comunes.")
+    @click.option(
+        "--source",
+        type=click.Choice(["grid", "submissions", "sessions"]),
+        default="grid",
+        show_default=True,
+        help=(
+            "grid: perfiles generados por categoría; submissions: respuestas más frecuentes de la bitácora de "
+            "envíos; sessions: últimas respuestas guardadas (SESSION_BACKEND=sqlite)."
+        ),
+    )
+    @click.option("--levels", default="1,2,3,4,5", show_default=True, help="Valores (1–5) a combinar en modo grid.")
+    @click.option("--limit", default=100, show_default=True, help="Máximo de perfiles a generar (0 = todos).")
+    @click.option("--concurrency", type=int, default=None, help="Llamadas simultáneas (default: OPENAI_MAX_WORKERS).")
+    def ai_prewarm(source: str, levels: str, limit: int, concurrency: int | None) -> None:
+        if not app.config["OPENAI_API_KEY"]:
+            raise click.ClickException("Define OPENAI_API_KEY para generar contenido con IA.")
+        if source == "submissions":
+            if not _SUBMISSIONS.directory:
+                raise click.ClickException("La bitácora de envíos está desactivada (SUBMISSION_LOG_DIR vacío).")
+            profiles = _prewarm_profiles_from_submissions(_SUBMISSIONS)
+        elif source == "sessions":
+            if app.config["SESSION_BACKEND"] != "sqlite":
+                raise click.ClickException(
+                    "--source sessions requiere SESSION_BACKEND=sqlite; usa --source submissions."
+                )
+            profiles = _prewarm_profiles_from_sessions(app.config["SESSION_DB_PATH"])
+        else:
+            try:
+                grid_levels = sorted({int(v) for v in levels.split(",") if v.strip()})
+            except ValueError:
+                raise click.BadParameter("usa enteros separados por coma, p. ej. 1,3,5", param_hint="--levels")
+            if not grid_levels or not set(grid_levels) <= {1, 2, 3, 4, 5}:
+                raise click.BadParameter("los valores deben estar entre 1 y 5", param_hint="--levels")
+            profiles = _prewarm_profiles_grid(grid_levels)
+        if limit > 0:
+            profiles = profiles[:limit]
+
+        stats = _prewarm_ai_cache(
+            app.extensions["ai_cache"],
+            profiles,
+            seed_path=app.config["AI_CACHE_SEED_PATH"],
+            concurrency=concurrency or app.config["OPENAI_MAX_WORKERS"],
+            combined=app.config["OPENAI_COMBINED_PROMPT"],
+            api_key=app.config["OPENAI_API_KEY"],
+            base_url=app.config["OPENAI_BASE_URL"],
+            model=app.config["OPENAI_MODEL"],
+            api_mode=app.config["OPENAI_API_MODE"],
+            timeout_seconds=app.config["OPENAI_TIMEOUT_SECONDS"],
+            payload_mode=app.config["AI_PAYLOAD_MODE"],
+            on_progress=lambda done, total: click.echo(f"  {done}/{total}", err=True) if done % 10 == 0 else None,
+        )
+        click.echo(
+            f"Perfiles: {stats['profiles']} · ya en caché: {stats['cached']} · generados: {stats['generated']} "
+            f"· con error: {stats['failed']}"
+        )
+        click.echo(f"Semilla: {app.config['AI_CACHE_SEED_PATH']} ({stats['seed_entries']} entradas)")
 
+    @app.cli.command("bench-hash", help="Compara el hash de llaves de caché actual con el FNV-1a en Python anterior.")
+    @click.option("--iterations", default=2000, show_default=True)
+    def bench_hash(iterations: int) -> None:
+        def fnv1a_32(obj: object) -> str:
+            # Implementación anterior de `_stable_hash`, sólo como referencia.
+            s = json.dumps(obj, sort_keys=True, ensure_ascii=False)
+            h = 2166136261
+            for ch in s:
+                h ^= ord(ch)
+                h = (h * 16777619) & 0xFFFFFFFF
+            return hex(h)[2:]
 
-def _parse_answers(form) -> Dict[str, int] | str:
-    answers: Dict[str, int] = {}
-    for q in QUESTIONS:
-        raw = form.get(q.id)
-        if raw is None:
-            return "Faltan respuestas: contesta todas las preguntas antes de continuar."
+        answers = {q.id: (i % 5) + 1 for i, q in enumerate(QUESTIONS)}
+        _, total_pct, by_category = _compute_scores(answers)
+        payload = _ai_result_payload(
+            total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=app.config["AI_PAYLOAD_MODE"]
+        )
+        size = len(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        click.echo(f"Payload del plan: {size} bytes, {iterations} iteraciones")
+        timings = {}
+        for name, fn in (("fnv1a_32 (anterior)", fnv1a_32), ("blake2b-128 (actual)", _stable_hash)):
+            started = time.perf_counter()
+            for _ in range(iterations):
+                fn(payload)
+            timings[name] = (time.perf_counter() - started) / iterations
+            click.echo(f"  {name:<22}{timings[name] * 1e6:>10.1f} µs/hash")
+        old, new = timings.values()
+        click.echo(f"  aceleración: {old / new:.1f}×")
+
+    @app.cli.command("prompt-stats", help="Tamaño de los prompts (bytes y tokens estimados) y de las llamadas enviadas.")
+    @click.option("--iterations", default=2000, show_default=True)
+    @click.option("--reset", is_flag=True, help="Borra el registro de llamadas.")
+    def prompt_stats(iterations: int, reset: bool) -> None:
+        if reset:
+            _PROMPT_BUDGET.reset()
+            click.echo("Registro borrado.")
+            return
+        answers = {q.id: (i % 5) + 1 for i, q in enumerate(QUESTIONS)}
+        _, total_pct, by_category = _compute_scores(answers)
+        click.echo(f"{'plantilla':<22}{'digest':>18}{'fija (B)':>10}{'total (B)':>11}{'tokens≈':>9}")
+        rows: List[Tuple[str, _PromptTemplate, Tuple[str, str]]] = []
+        for mode in _SCORING_STATIC_KEYS:
+            payload = _ai_result_payload(
+                total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=mode
+            )
+            for with_message, name in ((False, "plan"), (True, "combinado")):
+                rows.append(
+                    (
+                        f"{name} ({mode})",
+                        _INSIGHTS_PROMPTS[(mode, with_message)],
+                        _insights_prompt(payload, with_message=with_message, payload_mode=mode),
+                    )
+                )
+        level = _interpretation_level(total_pct)
+        rows.append(
+            (
+                "interpretación",
+                _INTERPRETATION_PROMPT,
+                _interpretation_prompt(
+                    _interpretation_payload(total_pct=total_pct, level=level, by_category=by_category)
+                ),
+            )
+        )
+        for name, template, (system, user) in rows:
+            size = len(system.encode("utf-8")) + len(user.encode("utf-8"))
+            tokens = _estimate_tokens(system) + _estimate_tokens(user)
+            click.echo(f"{name:<22}{template.digest:>18}{template.static_bytes:>10}{size:>11}{tokens:>9}")
+        mode = app.config["AI_PAYLOAD_MODE"]
+        payload = _ai_result_payload(
+            total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=mode
+        )
+        started = time.perf_counter()
+        for _ in range(iterations):
+            _insights_prompt(payload, payload_mode=mode)
+        click.echo(f"Armar el prompt del plan: {(time.perf_counter() - started) / iterations * 1e6:.1f} µs")
+
+        recorded = _PROMPT_BUDGET.stats()
+        if recorded:
+            budget = _PROMPT_BUDGET.budget_tokens
+            click.echo("")
+            click.echo(f"Llamadas enviadas (presupuesto: {budget or 'sin límite'} tokens)")
+            click.echo(f"{'prompt':<22}{'llamadas':>9}{'promedio≈':>11}{'máximo≈':>9}{'excedidas':>11}")
+            for name, calls, tokens_total, tokens_max, over_budget in recorded:
+                click.echo(f"{name:<22}{calls:>9}{tokens_total / calls:>11.0f}{tokens_max:>9}{over_budget:>11}")
+
+    @app.cli.command("ai-cache-stats", help="Tasa de acierto del caché de IA simulada para cada granularidad.")
+    @click.option("--reset", is_flag=True, help="Borra las métricas acumuladas.")
+    def ai_cache_stats(reset: bool) -> None:
+        if reset:
+            _GRANULARITY.reset()
+            click.echo("Métricas borradas.")
+            return
+        rows = _GRANULARITY.stats()
+        if not rows:
+            click.echo(
+                "Sin métricas todavía (se registran en segundo plano con OPENAI_API_KEY y "
+                "AI_CACHE_STATS_GRANULARITIES configuradas)."
+            )
+            return
+        click.echo(f"{'tipo':<16}{'banda:preguntas':>16}{'envíos':>9}{'aciertos':>10}{'tasa':>8}")
+        for kind, granularity, hits, misses in rows:
+            total = hits + misses
+            active = " *" if granularity == _GRANULARITY.active else ""
+            click.echo(f"{kind:<16}{granularity:>16}{total:>9}{hits:>10}{hits / total:>8.1%}{active}")
+        click.echo("* granularidad activa (AI_CACHE_PCT_BAND:AI_CACHE_TOP_QUESTIONS)")
+
+    @app.cli.command("submissions-stats", help="Segmentos de la bitácora de envíos, con filas y tamaño.")
+    def submissions_stats() -> None:
+        paths = _SUBMISSIONS.segments()
+        if not paths:
+            click.echo("Sin envíos registrados (SUBMISSION_LOG_DIR vacío o sin segmentos).")
+            return
+        click.echo(f"{'segmento':<28}{'filas':>10}{'KiB':>10}")
+        for path in paths:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                rows = conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+            finally:
+                conn.close()
+            size = sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+            click.echo(f"{os.path.basename(path):<28}{rows:>10}{size / 1024:>10.1f}")
+
+    @app.cli.command("score-bulk", help="Puntúa un CSV/JSONL de respuestas (una fila por empresa) en lotes.")
+    @click.argument("source", type=click.File("r", encoding="utf-8-sig"))
+    @click.option("--output", type=click.File("w", encoding="utf-8"), default="-", show_default=True)
+    @click.option("--input-format", type=click.Choice(["auto", "csv", "jsonl"]), default="auto", show_default=True)
+    @click.option("--output-format", type=click.Choice(["auto", "csv", "jsonl"]), default="auto", show_default=True)
+    @click.option("--id-column", default="id", show_default=True, help="Columna que se copia tal cual a la salida.")
+    @click.option("--batch-size", default=10000, show_default=True)
+    @click.option("--engine", type=click.Choice(["auto", "numpy", "python"]), default="auto", show_default=True)
+    def score_bulk(
+        source, output, input_format: str, output_format: str, id_column: str, batch_size: int, engine: str
+    ) -> None:
+        if engine == "auto":
+            engine = "numpy" if np is not None else "python"
+        elif engine == "numpy" and np is None:
+            raise click.UsageError("NumPy no está instalado; usa --engine python.")
+        input_format, output_format = _bulk_format(source, input_format), _bulk_format(output, output_format)
+        header = ["line", "id", "total", "total_pct", "level"] + CATEGORY_ORDER
+        writer = csv.writer(output) if output_format == "csv" else None
+        if writer is not None:
+            writer.writerow(header)
+
+        started = time.monotonic()
+        scored = invalid = 0
+        batch: List[Tuple[int, str, List[int]]] = []
+
+        def flush() -> None:
+            totals, pcts, points = _score_matrix([values for _, _, values in batch], engine=engine)
+            for (line_no, row_id, _), total, pct, per_category in zip(batch, totals, pcts, points):
+                out = [line_no, row_id, total, pct, _LEVEL_BY_PCT[pct]] + per_category
+                if writer is not None:
+                    writer.writerow(out)
+                else:
+                    output.write(json.dumps(dict(zip(header, out)), ensure_ascii=False) + "\n")
+            batch.clear()
+
+        for line_no, row in _bulk_rows(source, fmt=input_format):
+            answers = _parse_answers(row) if isinstance(row, dict) else row
+            if isinstance(answers, str):
+                invalid += 1
+                if invalid <= 20:
+                    click.echo(f"línea {line_no}: {answers}", err=True)
+                continue
+            batch.append((line_no, str(row.get(id_column, "")), [answers[q.id] for q in QUESTIONS]))
+            if len(batch) >= max(1, batch_size):
+                scored += len(batch)
+                flush()
+        if batch:
+            scored += len(batch)
+            flush()
+        click.echo(
+            f"{scored} filas puntuadas, {invalid} inválidas, {time.monotonic() - started:.2f}s (motor: {engine}).",
+            err=True,
+        )
+
+    @app.cli.command("ai-batch", help="Genera offline el plan de IA de un CSV/JSONL de respuestas (Batch API o pool).")
+    @click.argument("source", type=click.File("r", encoding="utf-8-sig"), required=False)
+    @click.option("--input-format", type=click.Choice(["auto", "csv", "jsonl"]), default="auto", show_default=True)
+    @click.option(
+        "--mode",
+        type=click.Choice(["auto", "batch", "pool"]),
+        default="auto",
+        show_default=True,
+        help="auto: Batch API si el proveedor la ofrece; si no, pool de llamadas normales.",
+    )
+    @click.option("--concurrency", type=int, default=None, help="Llamadas simultáneas en modo pool (default: OPENAI_MAX_WORKERS).")
+    @click.option("--chunk-size", default=1000, show_default=True, help="Solicitudes por lote / por ronda del pool.")
+    @click.option("--poll-seconds", default=30.0, show_default=True)
+    @click.option("--wait/--no-wait", default=True, show_default=True, help="Esperar a que terminen los lotes enviados.")
+    @click.option("--max-attempts", default=3, show_default=True, help="Intentos por plan antes de darlo por fallido.")
+    def ai_batch(
+        source,
+        input_format: str,
+        mode: str,
+        concurrency: int | None,
+        chunk_size: int,
+        poll_seconds: float,
+        wait: bool,
+        max_attempts: int,
+    ) -> None:
+        if not app.config["OPENAI_API_KEY"]:
+            raise click.ClickException("Define OPENAI_API_KEY para generar contenido con IA.")
+        if not _AI_STORE.path:
+            raise click.ClickException("AI_BATCH_STORE_PATH está vacío.")
+        if app.config["AI_CACHE_BACKEND"] not in _SHARED_AI_CACHE_BACKENDS:
+            raise click.ClickException(
+                "Los planes se publican en el caché de IA: usa AI_CACHE_BACKEND=tiered o sqlite."
+            )
+        payload_mode = app.config["AI_PAYLOAD_MODE"]
+        if source is not None:
+            rows = invalid = added = 0
+            chunk: Dict[str, Dict[str, object]] = {}
+            for _, row in _bulk_rows(source, fmt=_bulk_format(source, input_format)):
+                answers = _parse_answers(row) if isinstance(row, dict) else row
+                if isinstance(answers, str):
+                    invalid += 1
+                    continue
+                rows += 1
+                _, total_pct, by_category = _compute_scores(answers)
+                payload = _ai_result_payload(
+                    total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=payload_mode
+                )
+                chunk[_ai_result_cache_key(payload, payload_mode=payload_mode)] = payload
+                if len(chunk) >= 5000:
+                    added += _AI_STORE.enqueue(chunk)
+                    chunk = {}
+            if chunk:
+                added += _AI_STORE.enqueue(chunk)
+            click.echo(f"{rows} filas válidas ({invalid} inválidas): {added} planes nuevos por generar.")
+        _AI_STORE.retry_failed(max(1, max_attempts))
         try:
-            value = int(raw)
-        except ValueError:
-            return "Respuestas inválidas: vuelve a intentarlo."
-        if value not in {1, 2, 3, 4, 5}:
-            return "Respuestas fuera de rango: vuelve a intentarlo."
-        answers[q.id] = value
-    return answers
+            used = _run_ai_batch(
+                _AI_STORE,
+                cache=app.extensions["ai_cache"],
+                mode=mode,
+                api_key=app.config["OPENAI_API_KEY"],
+                base_url=app.config["OPENAI_BASE_URL"],
+                model=app.config["OPENAI_MODEL"],
+                api_mode=app.config["OPENAI_API_MODE"],
+                timeout_seconds=app.config["OPENAI_TIMEOUT_SECONDS"],
+                concurrency=concurrency or app.config["OPENAI_MAX_WORKERS"],
+                chunk_size=max(1, chunk_size),
+                poll_seconds=poll_seconds,
+                wait_for_batches=wait,
+                payload_mode=payload_mode,
+                on_progress=lambda message: click.echo(f"  {message}", err=True),
+            )
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        counts = _AI_STORE.counts()
+        click.echo(f"Modo: {used} · " + " · ".join(f"{status}: {n}" for status, n in sorted(counts.items())))
 
+    @app.cli.command("ai-worker", help="Procesa la cola de trabajos de IA (AI_JOB_QUEUE) en este proceso.")
+    @click.option("--concurrency", type=int, default=None, help="Trabajos simultáneos (default: OPENAI_MAX_WORKERS).")
+    @click.option("--poll-seconds", default=0.5, show_default=True, help="Espera cuando la cola está vacía.")
+    @click.option("--burst", is_flag=True, help="Termina cuando ya no hay trabajos listos.")
+    def ai_worker(concurrency: int | None, poll_seconds: float, burst: bool) -> None:
+        if not app.config["OPENAI_API_KEY"]:
+            raise click.ClickException("Define OPENAI_API_KEY para generar contenido con IA.")
+        cache = app.extensions["ai_cache"]
+        common = {
+            "api_key": app.config["OPENAI_API_KEY"],
+            "base_url": app.config["OPENAI_BASE_URL"],
+            "model": app.config["OPENAI_MODEL"],
+            "api_mode": app.config["OPENAI_API_MODE"],
+            "timeout_seconds": app.config["OPENAI_TIMEOUT_SECONDS"],
+            "debug": bool(app.debug),
+        }
 
-def _compute_scores(answers: Dict[str, int]) -> Tuple[int, int, Dict[str, Dict[str, int]]]:
-    values = list(answers.values())
-    total_points = sum(values)  # 20..100
-    total_pct = round((total_points / (len(values) * 5)) * 100)
+        def work() -> None:
+            while True:
+                try:
+                    claimed = _JOBS.claim()
+                except sqlite3.Error:
+                    claimed = None
+                if claimed is None:
+                    if burst:
+                        return
+                    time.sleep(poll_seconds)
+                    continue
+                job_id, kind, args, attempts = claimed
+                last = attempts >= _JOBS.max_attempts
+                try:
+                    ok = _run_ai_job(
+                        kind, args, cache=cache, report_errors=last, payload_mode=app.config["AI_PAYLOAD_MODE"], **common
+                    )
+                    error = "" if ok else "Sin resultado en el caché."
+                except Exception as e:
+                    ok, error = False, f"{type(e).__name__}: {e}"
+                if ok:
+                    _JOBS.complete(job_id)
+                    click.echo(f"  {kind} #{job_id}: listo (intento {attempts})", err=True)
+                else:
+                    retry = _JOBS.fail(job_id, attempts, error)
+                    click.echo(f"  {kind} #{job_id}: {'se reintentará' if retry else 'falló'} ({error})", err=True)
 
-    by_category: Dict[str, List[int]] = {}
-    for q in QUESTIONS:
-        by_category.setdefault(q.category, []).append(answers[q.id])
+        workers = max(1, concurrency or app.config["OPENAI_MAX_WORKERS"])
+        click.echo(f"Worker de IA: {workers} hilos sobre {_JOBS.path}")
+        _JOBS.purge(24 * 3600)
+        threads = [threading.Thread(target=work, name=f"ai-worker-{i}", daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            # Los trabajos en curso se vuelven a tomar al vencer su lease.
+            pass
 
-    by_category_summary: Dict[str, Dict[str, int]] = {}
-    for category, nums in by_category.items():
-        points = sum(nums)
-        pct = round((points / (len(nums) * 5)) * 100)
-        by_category_summary[category] = {"points": points, "pct": pct, "max": len(nums) * 5}
+    @app.cli.command("ai-enqueue", help="Encola en segundo plano el plan de IA de un CSV/JSONL de respuestas.")
+    @click.argument("source", type=click.File("r", encoding="utf-8-sig"))
+    @click.option("--input-format", type=click.Choice(["auto", "csv", "jsonl"]), default="auto", show_default=True)
+    @click.option("--priority", default=0, show_default=True, help="Mayor = antes (la web usa AI_JOB_WEB_PRIORITY).")
+    def ai_enqueue(source, input_format: str, priority: int) -> None:
+        cache = app.extensions["ai_cache"]
+        queued = skipped = 0
+        for _, row in _bulk_rows(source, fmt=_bulk_format(source, input_format)):
+            answers = _parse_answers(row) if isinstance(row, dict) else row
+            if isinstance(answers, str):
+                skipped += 1
+                continue
+            _, total_pct, by_category = _compute_scores(answers)
+            entry = _ai_ref_entry(
+                total_pct=total_pct,
+                by_category=by_category,
+                answers=answers,
+                payload_mode=app.config["AI_PAYLOAD_MODE"],
+            )
+            args = {"entry": entry, "answers": answers, "stream": False}
+            for kind, key in (("ai", entry["ai"]), ("interpretation", entry["interpretation"])):
+                if cache.get(str(key)) is None:
+                    _JOBS.enqueue(kind, args, dedup_key=str(key), priority=priority)
+                    queued += 1
+        click.echo(f"{queued} trabajos enviados a la cola; los repetidos se combinan ({skipped} filas inválidas).")
 
-    return total_points, total_pct, by_category_summary
+    @app.cli.command("ai-jobs", help="Estado de la cola de trabajos de IA.")
+    def ai_jobs() -> None:
+        stats = _JOBS.stats()
+        if not stats:
+            click.echo("Cola vacía.")
+            return
+        click.echo(f"{'estado':<10}{'trabajos':>10}{'más antiguo':>14}")
+        for status, (n, age) in sorted(stats.items()):
+            click.echo(f"{status:<10}{n:>10}{(f'{age:.0f}s' if age is not None else '-'):>14}")
 
+    @app.cli.command("cohort-rebuild", help="Recalcula los histogramas de percentiles desde la bitácora de envíos.")
+    def cohort_rebuild() -> None:
+        if not _COHORT.path:
+            click.echo("COHORT_BENCHMARK está desactivado.")
+            return
+        n = _COHORT.rebuild(_SUBMISSIONS.iter_rows())
+        click.echo(f"Histogramas recalculados con {n} envíos.")
 
-def _interpretation_level(total_pct: int) -> str:
-    if total_pct >= 80:
-        return "Alto"
-    if total_pct >= 60:
-        return "Medio"
-    return "Bajo"
+    @app.cli.command("submissions-export", help="Exporta la bitácora de envíos como JSONL (una fila por envío).")
+    @click.option("--output", type=click.File("w", encoding="utf-8"), default="-", show_default=True)
+    def submissions_export(output) -> None:
+        for created_at, answers in _SUBMISSIONS.iter_rows():
+            output.write(json.dumps({"created_at": created_at, **answers}, separators=(",", ":")) + "\n")
 
+    return app
 
-def _interpretation_static(total_pct: int) -> Dict[str, str]:
+
+_AI_EXECUTOR: ThreadPoolExecutor | None = None
+_AI_EXECUTOR_LOCK = threading.Lock()
+
+
+def _ai_executor(max_workers: int) -> ThreadPoolExecutor:
+    # Pool acotado por proceso (se crea perezosamente para que cada worker de
+    # gunicorn tenga el suyo tras el fork).
+    global _AI_EXECUTOR
+    with _AI_EXECUTOR_LOCK:
+        if _AI_EXECUTOR is None:
+            _AI_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="openai")
+        return _AI_EXECUTOR
+
+
+_LEGACY_SESSION_AI_PREFIXES = ("ai_v5:", "ai_interp_v1:")
+
+
+def _remember_ai_ref(
+    cache: _AICache,
+    *,
+    total_pct: int,
+    by_category: Dict[str, Dict[str, int]],
+    answers: Dict[str, int],
+    max_refs: int,
+    payload_mode: str = "full",
+) -> Tuple[str, Dict[str, object]] | None:
+    # La sesión sólo guarda referencias cortas (a lo más `max_refs`, las más
+    # recientes); el detalle vive del lado del servidor, en el caché de IA.
+    if max_refs <= 0:
+        return None
+    entry = _ai_ref_entry(total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=payload_mode)
+    ref = _stable_hash(entry)
+    cache.set(f"ai_ref_v2:{ref}", entry)
+
+    refs = [r for r in session.get("ai_refs", []) if isinstance(r, str) and r != ref]
+    session["ai_refs"] = (refs + [ref])[-max_refs:]
+    return ref, entry
+
+
+def _ai_ref_entry(
+    *, total_pct: int, by_category: Dict[str, Dict[str, int]], answers: Dict[str, int], payload_mode: str = "full"
+) -> Dict[str, object]:
     level = _interpretation_level(total_pct)
-    if level == "Alto":
-        message = (
-            "Tu empresa muestra bases sólidas. Prioriza mantener disciplina de seguimiento y mejorar con datos."
+    return {
+        "total_pct": int(total_pct),
+        "ai": _ai_result_cache_key(
+            _ai_result_payload(
+                total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=payload_mode
+            ),
+            payload_mode=payload_mode,
+        ),
+        "interpretation": _interpretation_cache_key(
+            _interpretation_payload(total_pct=total_pct, level=level, by_category=by_category)
+        ),
+    }
+
+
+_AI_ERROR_TTL_SECONDS = 120
+
+
+def _ai_ref_status(cache: _AICache, entry: Dict[str, object], *, debug: bool) -> Dict[str, object]:
+    # Estado del bloque de IA de una referencia: listo cuando cada parte tiene
+    # resultado o un error registrado por su tarea en segundo plano.
+    static = _interpretation_static(int(entry.get("total_pct", 0)))
+    ai = cache.get(str(entry["ai"]))
+    ai = ai if isinstance(ai, dict) else None
+    msg = cache.get(str(entry["interpretation"]))
+    msg = msg.strip() if isinstance(msg, str) and msg.strip() else None
+    ai_failure = None if ai else cache.get(f"ai_error_v1:{entry['ai']}")
+    interp_failure = None if msg else cache.get(f"ai_error_v1:{entry['interpretation']}")
+
+    ai_failure = ai_failure if isinstance(ai_failure, dict) else None
+    done = (ai is not None or ai_failure is not None) and (msg is not None or interp_failure is not None)
+    partial = None
+    if ai is None and ai_failure is None:
+        partial = cache.get(f"ai_partial_v1:{entry['ai']}")
+    return {
+        "status": "ready" if done else "pending",
+        "ai": ai,
+        "partial": partial if isinstance(partial, dict) else None,
+        "ai_error": ai_failure.get("error") if ai_failure else None,
+        "ai_error_detail": ai_failure.get("detail") if (ai_failure and debug) else None,
+        "interpretation_ai": msg,
+        "interpretation": {"level": static["level"], "message": msg or static["message"]},
+    }
+
+
+def _partial_field_writer(cache: _AICache, cache_key: str) -> Callable[[str, object], None]:
+    # Los campos ya completos del stream quedan visibles para `resultado_ia`.
+    partial: Dict[str, object] = {}
+
+    def on_field(key: str, value: object) -> None:
+        if key not in _AI_OUTPUT_FIELDS:
+            return
+        if isinstance(value, str) and value.strip():
+            partial[key] = value.strip()
+        elif isinstance(value, list):
+            partial[key] = [v.strip() for v in value if isinstance(v, str) and v.strip()][:3]
+        else:
+            return
+        cache.set(f"ai_partial_v1:{cache_key}", dict(partial), ttl_seconds=_AI_ERROR_TTL_SECONDS)
+
+    return on_field
+
+
+def _ai_result_job(
+    *, cache_key: str, cache: _AICache, stream: bool = False, report_errors: bool = True, **kwargs
+) -> None:
+    on_field = _partial_field_writer(cache, cache_key) if stream else None
+    try:
+        ai, public, detail = _maybe_ai_result(cache=cache, on_field=on_field, **kwargs)
+    except Exception as e:
+        ai, public, detail = None, "No se pudo generar el plan con IA en este momento.", f"{type(e).__name__}: {e}"
+    if ai is None and report_errors:
+        cache.set(
+            f"ai_error_v1:{cache_key}",
+            {"error": public or "No se pudo generar el plan con IA en este momento.", "detail": detail},
+            ttl_seconds=_AI_ERROR_TTL_SECONDS,
         )
-    elif level == "Medio":
-        message = (
-            "Hay avances, pero existen brechas. Enfócate en 2–3 áreas con menor puntaje para crear un plan trimestral."
+
+
+def _combined_job(
+    *, entry: Dict[str, object], cache: _AICache, stream: bool = False, report_errors: bool = True, **kwargs
+) -> None:
+    on_field = _partial_field_writer(cache, str(entry["ai"])) if stream else None
+    try:
+        (ai, public, detail), _ = _maybe_ai_combined(cache=cache, on_field=on_field, **kwargs)
+    except Exception as e:
+        ai, public, detail = None, None, f"{type(e).__name__}: {e}"
+    if not report_errors:
+        return
+    public = public or "No se pudo generar el plan con IA en este momento."
+    if ai is None:
+        cache.set(f"ai_error_v1:{entry['ai']}", {"error": public, "detail": detail}, ttl_seconds=_AI_ERROR_TTL_SECONDS)
+    if cache.get(str(entry["interpretation"])) is None:
+        cache.set(
+            f"ai_error_v1:{entry['interpretation']}", {"error": public, "detail": None}, ttl_seconds=_AI_ERROR_TTL_SECONDS
         )
-    else:
-        message = "Hay oportunidades importantes. Empieza por clarificar estrategia, ordenar finanzas y definir procesos mínimos."
-    return {"level": level, "message": message}
 
 
-def _interpretation(
-    total_pct: int,
+def _interpretation_job(
     *,
-    by_category: Dict[str, Dict[str, int]] | None = None,
+    cache_key: str,
+    cache: _AICache,
+    total_pct: int,
+    by_category: Dict[str, Dict[str, int]],
     api_key: str,
     base_url: str,
     model: str,
     api_mode: str,
     timeout_seconds: int,
+    deadline: _Deadline | None = None,
     debug: bool,
-) -> Dict[str, str]:
-    static = _interpretation_static(total_pct)
-    if not api_key:
-        return static
-
-    by_category = by_category or {}
+    report_errors: bool = True,
+) -> None:
     try:
         msg, err = _maybe_ai_interpretation_message(
             api_key=api_key,
@@ -362,216 +1197,2518 @@ def _interpretation(
             model=model,
             api_mode=api_mode,
             timeout_seconds=timeout_seconds,
+            deadline=deadline,
             total_pct=total_pct,
-            level=static["level"],
+            level=_interpretation_level(total_pct),
             by_category=by_category,
+            cache=cache,
         )
     except Exception as e:
-        if debug:
-            session["flash_error"] = f"No se pudo generar interpretación con IA ({type(e).__name__})."
-        return static
+        msg, err = None, type(e).__name__
+    if not msg and report_errors:
+        cache.set(f"ai_error_v1:{cache_key}", {"error": err, "detail": None}, ttl_seconds=_AI_ERROR_TTL_SECONDS)
 
-    if msg:
-        return {"level": static["level"], "message": msg}
-    if err and debug:
-        session["flash_error"] = f"No se pudo generar interpretación con IA ({err})."
-    return static
 
+class _Deadline:
+    # Límite absoluto (reloj monotónico) de un request de resultados.
+    def __init__(self, seconds: float) -> None:
+        self.expires_at = time.monotonic() + seconds
 
-def _maybe_ai_interpretation_message(
-    *,
-    api_key: str,
-    base_url: str,
-    model: str,
-    api_mode: str,
-    timeout_seconds: int,
-    total_pct: int,
-    level: str,
-    by_category: Dict[str, Dict[str, int]],
-) -> Tuple[str | None, str | None]:
-    payload = {
-        "total_pct": int(total_pct),
-        "level": str(level),
-        "by_category": {k: {"pct": int(v.get("pct", 0))} for k, v in by_category.items()},
-    }
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
 
-    cache_key = f"ai_interp_v1:{_stable_hash(payload)}"
-    cached = session.get(cache_key)
-    if isinstance(cached, str) and cached.strip():
-        return cached.strip(), None
+    def timeout(self, seconds: float) -> float:
+        return min(float(seconds), self.remaining())
 
-    system = (
-        "Eres un consultor de Consilium. "
-        "Escribes interpretaciones ejecutivas breves, claras y accionables. "
-        "Responde en español. No inventes datos."
-    )
-    user = (
-        "Genera una interpretación ejecutiva (1–2 frases) del prediagnóstico. "
-        "Debe sonar consultiva y concreta, sin alarmismo, sin promesas, y sin pasos. "
-        "No menciones 'IA'.\n\n"
-        "Devuelve SOLO un JSON válido (sin markdown) con esta forma exacta:\n"
-        '{ "message": string }\n\n'
-        "Contexto:\n"
-        f"- Índice global: {int(total_pct)}%\n"
-        f"- Nivel: {level}\n"
-        f"- Porcentaje por área (si existe): {json.dumps(payload['by_category'], ensure_ascii=False)}\n"
-    )
 
-    raw_text, err = _openai_text(
-        api_key=api_key,
-        base_url=base_url,
-        model=model,
-        api_mode=api_mode,
-        system=system,
-        user=user,
-        timeout_seconds=timeout_seconds,
-    )
-    if not raw_text:
-        return None, (err or "Sin contenido de salida desde OpenAI.")
+# Por debajo de este margen ya no se intenta una solicitud nueva (p. ej. el
+# fallback a chat/completions): no alcanzaría a responder.
+_DEADLINE_MIN_ATTEMPT_SECONDS = 0.5
 
-    parsed = _extract_json_object(raw_text)
-    if not isinstance(parsed, dict):
-        return None, "No se pudo parsear JSON desde la respuesta del modelo."
+_DEADLINE_EXCEEDED = "Se agotó el tiempo disponible para la llamada a OpenAI."
 
-    msg = parsed.get("message")
-    msg = msg.strip() if isinstance(msg, str) else ""
-    if not msg:
-        return None, "La respuesta JSON no incluye 'message'."
 
-    session[cache_key] = msg
-    return msg, None
+def _future_result(future: Future, default):
+    # Resultado de una tarea ya esperada; si no terminó a tiempo o falló, el default.
+    if not future.done():
+        return default
+    try:
+        return future.result()
+    except Exception:
+        return default
 
 
-def _maybe_ai_result(
-    *,
-    api_key: str,
-    base_url: str,
-    model: str,
-    api_mode: str,
-    timeout_seconds: int,
-    total_pct: int,
-    by_category: Dict[str, Dict[str, int]],
-    answers: Dict[str, int],
-    debug: bool,
-) -> Tuple[Dict[str, object] | None, str | None, str | None]:
-    if not api_key:
-        return None, None, None
+class _AICache:
+    # Interfaz de caché de resultados de IA. Las claves son las de `_stable_hash`
+    # (p. ej. "ai_v6:<hash>") y los valores deben ser serializables a JSON.
+    def get(self, key: str) -> object | None:
+        return None
 
-    categories_ranked = sorted(
-        (
-            {
-                "category": k,
-                "points": int(v["points"]),
-                "pct": int(v["pct"]),
-                "max": int(v["max"]),
-            }
-            for k, v in by_category.items()
-        ),
-        key=lambda x: x["pct"],
-    )
+    def set(self, key: str, value: object, *, ttl_seconds: int | None = None) -> None:
+        return None
 
-    questions_payload: List[Dict[str, object]] = []
-    for q in QUESTIONS:
-        questions_payload.append(
-            {
-                "id": q.id,
-                "category": q.category,
-                "text": q.text,
-                "value": int(answers.get(q.id, 0)),
-            }
-        )
-    weakest_questions_full = sorted(questions_payload, key=lambda x: x["value"])[:5]
-    strongest_questions_full = sorted(questions_payload, key=lambda x: x["value"], reverse=True)[:5]
+    def delete(self, key: str) -> None:
+        return None
 
-    def drop_value(items: List[Dict[str, object]]) -> List[Dict[str, object]]:
-        out: List[Dict[str, object]] = []
-        for it in items:
-            out.append({"id": it.get("id", ""), "category": it.get("category", ""), "text": it.get("text", "")})
-        return out
 
-    weakest_questions = drop_value(weakest_questions_full)
+class _MemoryAICache(_AICache):
+    # LRU + TTL en memoria del proceso.
+    def __init__(self, *, max_entries: int, ttl_seconds: int) -> None:
+        self._max_entries = max(1, max_entries)
+        self._ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, Tuple[float, object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> object | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: object, *, ttl_seconds: int | None = None) -> None:
+        ttl = self._ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+@contextmanager
+def _sqlite_transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    # Las conexiones están en autocommit (`isolation_level=None`), así que
+    # `with conn:` no abre transacción: BEGIN IMMEDIATE explícito, COMMIT al
+    # salir del bloque (también con `return`) y ROLLBACK si algo lanza.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+
+class _SQLiteStore:
+    # Base para estado compartido entre workers de gunicorn: un archivo SQLite en
+    # modo WAL y una conexión por hilo (y por proceso, para sobrevivir al fork).
+    _schema = ""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if self._schema:
+            conn.executescript(self._schema)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with _sqlite_transaction(self._conn()) as conn:
+            yield conn
+
+
+class _APIModeMemo(_SQLiteStore):
+    # Modo de API negociado por (base URL, modelo): copia en memoria del proceso
+    # respaldada por SQLite para que todos los workers lo compartan.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS api_modes (
+        base_url TEXT NOT NULL,
+        model TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (base_url, model)
+    );
+    """
+
+    def __init__(self, path: str, *, ttl_seconds: int) -> None:
+        super().__init__(path)
+        self.ttl_seconds = ttl_seconds
+        self._memory: Dict[Tuple[str, str], Tuple[str, float]] = {}
+
+    def get(self, base_url: str, model: str) -> str | None:
+        key = (base_url.rstrip("/"), model)
+        now = time.time()
+        hit = self._memory.get(key)
+        if hit is not None and hit[1] > now:
+            return hit[0]
+        try:
+            row = self._conn().execute(
+                "SELECT mode, expires_at FROM api_modes WHERE base_url = ? AND model = ? AND expires_at > ?",
+                (key[0], key[1], now),
+            ).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self._memory.pop(key, None)
+            return None
+        self._memory[key] = (row[0], row[1])
+        return row[0]
+
+    def set(self, base_url: str, model: str, mode: str) -> None:
+        key = (base_url.rstrip("/"), model)
+        expires_at = time.time() + self.ttl_seconds
+        self._memory[key] = (mode, expires_at)
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO api_modes (base_url, model, mode, expires_at) VALUES (?, ?, ?, ?)",
+                (key[0], key[1], mode, expires_at),
+            )
+        except sqlite3.Error:
+            pass
+
+
+_API_MODES = _APIModeMemo("", ttl_seconds=3600)
+
+
+class _SQLiteLocks(_SQLiteStore):
+    # Candados con vencimiento compartidos entre procesos.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS locks (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    """
+
+    def acquire(self, name: str, owner: str, *, ttl_seconds: float) -> bool:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM locks WHERE name = ? AND expires_at <= ?", (name, now))
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)", (name, owner, now + ttl_seconds)
+        )
+        return cur.rowcount == 1
+
+    def release(self, name: str, owner: str) -> None:
+        self._conn().execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def held(self, name: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM locks WHERE name = ? AND expires_at > ?", (name, time.time())
+        ).fetchone()
+        return row is not None
+
+
+class _InFlightCall:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: object = None
+        self.error: BaseException | None = None
+
+
+class _SingleFlight:
+    # Coalesce llamadas idénticas en curso (misma clave de `_stable_hash`): la
+    # primera hace la llamada y las concurrentes del mismo proceso esperan su
+    # resultado. En modo "shared", un candado en SQLite hace que los demás
+    # workers esperen a que el resultado aparezca en el caché compartido.
+    def __init__(self, locks: _SQLiteLocks, *, mode: str, wait_seconds: float) -> None:
+        self.locks = locks
+        self.mode = mode
+        self.wait_seconds = wait_seconds
+        self._calls: Dict[str, _InFlightCall] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], object],
+        *,
+        cached: Callable[[], object | None],
+        deadline: _Deadline | None = None,
+    ):
+        if self.mode == "off":
+            return fn()
+        wait_seconds = deadline.timeout(self.wait_seconds) if deadline is not None else self.wait_seconds
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _InFlightCall()
+
+        if not leader:
+            if call.done.wait(wait_seconds):
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            return fn()
+
+        try:
+            call.result = self._run_shared(key, fn, cached, wait_seconds) if self.mode == "shared" else fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.done.set()
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def _run_shared(
+        self, key: str, fn: Callable[[], object], cached: Callable[[], object | None], wait_seconds: float
+    ):
+        owner = f"{os.getpid()}:{threading.get_ident()}:{secrets.token_hex(4)}"
+        name = f"single_flight:{key}"
+        try:
+            acquired = self.locks.acquire(name, owner, ttl_seconds=self.wait_seconds)
+        except sqlite3.Error:
+            return fn()
+        if acquired:
+            try:
+                return fn()
+            finally:
+                try:
+                    self.locks.release(name, owner)
+                except sqlite3.Error:
+                    pass
+
+        # Otro worker ya está generando: esperar a que lo deje en el caché.
+        give_up_at = time.monotonic() + wait_seconds
+        while time.monotonic() < give_up_at:
+            time.sleep(0.1)
+            hit = cached()
+            if hit is not None:
+                return hit
+            try:
+                if not self.locks.held(name):
+                    break
+            except sqlite3.Error:
+                break
+        hit = cached()
+        return hit if hit is not None else fn()
+
+
+_SINGLE_FLIGHT = _SingleFlight(_SQLiteLocks(""), mode="shared", wait_seconds=20.0)
+
+
+_BREAKER_SCOPE = threading.local()
+
+
+class _CircuitBreaker(_SQLiteStore):
+    # Circuit breaker por host de OpenAI, compartido entre workers vía SQLite.
+    # closed: todo pasa y se cuentan errores en una ventana; open: se rechaza
+    # de inmediato; tras el enfriamiento, una sola llamada de prueba (half_open)
+    # decide si se vuelve a closed u open. El `probe_until` reclamado identifica
+    # a la prueba: el hilo que la reclamó lo guarda y sólo su resultado saca al
+    # breaker de half_open (las llamadas que ya estaban en curso no cuentan).
+    _schema = """
+    CREATE TABLE IF NOT EXISTS circuit_breakers (
+        name TEXT PRIMARY KEY,
+        state TEXT NOT NULL,
+        window_start REAL NOT NULL,
+        calls INTEGER NOT NULL,
+        failures INTEGER NOT NULL,
+        opened_at REAL NOT NULL,
+        probe_until REAL NOT NULL
+    );
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        enabled: bool,
+        failure_rate: float,
+        min_calls: int,
+        window_seconds: float,
+        cooldown_seconds: float,
+        probe_seconds: float,
+    ) -> None:
+        super().__init__(path)
+        self.enabled = enabled
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.probe_seconds = probe_seconds
+
+    def allow(self, name: str) -> bool:
+        if not self.enabled:
+            return True
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT state, opened_at, probe_until FROM circuit_breakers WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None or row[0] == "closed":
+                return True
+            state, opened_at, probe_until = row
+            if state == "open" and now - opened_at < self.cooldown_seconds:
+                return False
+            if state == "half_open" and probe_until > now:
+                return False
+            # Reclamar la llamada de prueba; sólo un proceso lo logra.
+            token = now + self.probe_seconds
+            cur = conn.execute(
+                "UPDATE circuit_breakers SET state = 'half_open', probe_until = ? "
+                "WHERE name = ? AND state = ? AND opened_at = ? AND probe_until = ?",
+                (token, name, state, opened_at, probe_until),
+            )
+            if cur.rowcount != 1:
+                return False
+            if not hasattr(_BREAKER_SCOPE, "probes"):
+                _BREAKER_SCOPE.probes = {}
+            _BREAKER_SCOPE.probes[name] = token
+            return True
+        except sqlite3.Error:
+            return True
+
+    def record(self, name: str, *, ok: bool) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        probe = getattr(_BREAKER_SCOPE, "probes", {}).pop(name, None)
+        try:
+            with self._transaction() as conn:
+                self._record(conn, name, ok, now, probe)
+        except sqlite3.Error:
+            return
+
+    def _record(self, conn: sqlite3.Connection, name: str, ok: bool, now: float, probe: float | None) -> None:
+        row = conn.execute(
+            "SELECT state, window_start, calls, failures, probe_until FROM circuit_breakers WHERE name = ?", (name,)
+        ).fetchone()
+        state, window_start, calls, failures, probe_until = row if row is not None else ("closed", now, 0, 0, 0.0)
+
+        if state == "half_open":
+            if probe != probe_until:
+                return
+            if ok:
+                state, window_start, calls, failures = "closed", now, 0, 0
+            else:
+                conn.execute(
+                    "UPDATE circuit_breakers SET state = 'open', opened_at = ?, probe_until = 0 WHERE name = ?",
+                    (now, name),
+                )
+                return
+        elif state == "open":
+            return
+        else:
+            if now - window_start > self.window_seconds:
+                window_start, calls, failures = now, 0, 0
+            calls += 1
+            failures += 0 if ok else 1
+
+        opened_at = 0.0
+        if state == "closed" and calls >= self.min_calls and failures / calls >= self.failure_rate:
+            state, opened_at = "open", now
+        conn.execute(
+            "INSERT OR REPLACE INTO circuit_breakers "
+            "(name, state, window_start, calls, failures, opened_at, probe_until) VALUES (?, ?, ?, ?, ?, ?, 0)",
+            (name, state, window_start, calls, failures, opened_at),
+        )
+
+
+_BREAKER = _CircuitBreaker(
+    "",
+    enabled=True,
+    failure_rate=0.5,
+    min_calls=5,
+    window_seconds=60.0,
+    cooldown_seconds=30.0,
+    probe_seconds=20.0,
+)
+
+
+class _UpstreamLimiter(_SQLiteStore):
+    # Límite global (entre workers) de llamadas simultáneas a OpenAI más un
+    # token bucket de solicitudes por minuto. Cada slot es un lease con
+    # vencimiento para que un proceso caído no lo retenga para siempre.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS upstream_slots (
+        owner TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS token_buckets (
+        name TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        max_concurrent: int,
+        rate_per_minute: float,
+        burst: int,
+        wait_seconds: float,
+        lease_seconds: float,
+    ) -> None:
+        super().__init__(path)
+        self.max_concurrent = max_concurrent
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.wait_seconds = wait_seconds
+        self.lease_seconds = lease_seconds
+
+    def acquire(self) -> str | None:
+        # "" = sin límites configurados; None = no hubo lugar a tiempo.
+        if self.max_concurrent <= 0 and self.rate_per_minute <= 0:
+            return ""
+        owner = f"{os.getpid()}:{threading.get_ident()}:{secrets.token_hex(4)}"
+        give_up_at = time.monotonic() + self.wait_seconds
+        while True:
+            try:
+                if self._try_acquire(owner):
+                    return owner
+            except sqlite3.Error:
+                return ""
+            if time.monotonic() >= give_up_at:
+                return None
+            time.sleep(0.05)
+
+    def release(self, owner: str | None) -> None:
+        if not owner:
+            return
+        try:
+            self._conn().execute("DELETE FROM upstream_slots WHERE owner = ?", (owner,))
+        except sqlite3.Error:
+            pass
+
+    def _try_acquire(self, owner: str) -> bool:
+        now = time.time()
+        # Sin cupo sólo se confirma la limpieza de los leases vencidos.
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM upstream_slots WHERE expires_at <= ?", (now,))
+            if self.max_concurrent > 0:
+                (in_use,) = conn.execute("SELECT COUNT(*) FROM upstream_slots").fetchone()
+                if in_use >= self.max_concurrent:
+                    return False
+            if self.rate_per_minute > 0:
+                row = conn.execute("SELECT tokens, updated_at FROM token_buckets WHERE name = 'openai'").fetchone()
+                tokens, updated_at = row if row is not None else (float(self.burst), now)
+                tokens = min(float(self.burst), tokens + (now - updated_at) * self.rate_per_minute / 60.0)
+                if tokens < 1.0:
+                    return False
+                conn.execute(
+                    "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES ('openai', ?, ?)",
+                    (tokens - 1.0, now),
+                )
+            conn.execute(
+                "INSERT INTO upstream_slots (owner, expires_at) VALUES (?, ?)", (owner, now + self.lease_seconds)
+            )
+            return True
+
+
+_LIMITER = _UpstreamLimiter(
+    "",
+    max_concurrent=0,
+    rate_per_minute=0.0,
+    burst=10,
+    wait_seconds=0.5,
+    lease_seconds=20.0,
+)
+
+_LIMITER_REJECTED = "Demasiadas solicitudes a OpenAI en este momento; se muestra el resultado estándar."
+
+
+class _JobQueue(_SQLiteStore):
+    # Cola persistente de generación de IA: los workers web sólo encolan y leen
+    # el caché; `flask ai-worker` (otro proceso) corre los trabajos. Un trabajo
+    # por llave de caché (dedup), primero el de mayor prioridad, con reintentos
+    # y espera exponencial. Si un worker muere a media llamada, su trabajo se
+    # vuelve a tomar cuando vence el lease.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS ai_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dedup_key TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL,
+        args TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL,
+        lease_until REAL,
+        error TEXT,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ai_jobs_ready ON ai_jobs (status, priority DESC, id);
+    """
+
+    def __init__(self, path: str, *, max_attempts: int, retry_seconds: float, lease_seconds: float) -> None:
+        super().__init__(path)
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.lease_seconds = lease_seconds
+
+    def enqueue(self, kind: str, args: Dict[str, object], *, dedup_key: str, priority: int = 0) -> None:
+        # Si ya existe: sube la prioridad; si había terminado, vuelve a la cola.
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO ai_jobs (dedup_key, kind, args, priority, status, available_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?) "
+            "ON CONFLICT (dedup_key) DO UPDATE SET "
+            "priority = MAX(priority, excluded.priority), "
+            "args = CASE WHEN status IN ('done', 'failed') THEN excluded.args ELSE args END, "
+            "attempts = CASE WHEN status IN ('done', 'failed') THEN 0 ELSE attempts END, "
+            "available_at = CASE WHEN status IN ('done', 'failed') THEN excluded.available_at ELSE available_at END, "
+            "status = CASE WHEN status IN ('done', 'failed') THEN 'queued' ELSE status END, "
+            "updated_at = excluded.updated_at",
+            (f"{kind}:{dedup_key}", kind, json.dumps(args, ensure_ascii=False), priority, now, now),
+        )
+
+    def claim(self) -> Tuple[int, str, Dict[str, object], int] | None:
+        now = time.time()
+        with self._transaction() as conn:
+            # Un trabajo cuyo lease venció en su último intento (p. ej. porque
+            # tumba al worker) se da por fallido en lugar de reintentarse siempre.
+            conn.execute(
+                "UPDATE ai_jobs SET status = 'failed', lease_until = NULL, error = ?, updated_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                ("El worker no terminó el trabajo antes de que venciera el lease.", now, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, kind, args, attempts FROM ai_jobs "
+                "WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY priority DESC, id LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE ai_jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (now + self.lease_seconds, now, row[0]),
+                )
+        if row is None:
+            return None
+        job_id, kind, args, attempts = row
+        return job_id, kind, json.loads(args), attempts + 1
+
+    def complete(self, job_id: int) -> None:
+        self._conn().execute(
+            "UPDATE ai_jobs SET status = 'done', lease_until = NULL, error = NULL, updated_at = ? WHERE id = ?",
+            (time.time(), job_id),
+        )
+
+    def fail(self, job_id: int, attempts: int, error: str) -> bool:
+        # Devuelve True si el trabajo se reintentará.
+        now = time.time()
+        retry = attempts < self.max_attempts
+        self._conn().execute(
+            "UPDATE ai_jobs SET status = ?, available_at = ?, lease_until = NULL, error = ?, updated_at = ? "
+            "WHERE id = ?",
+            (
+                "queued" if retry else "failed",
+                now + self.retry_seconds * 2 ** (attempts - 1),
+                error[:600],
+                now,
+                job_id,
+            ),
+        )
+        return retry
+
+    def purge(self, older_than_seconds: float) -> None:
+        self._conn().execute(
+            "DELETE FROM ai_jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - older_than_seconds,),
+        )
+
+    def stats(self) -> Dict[str, Tuple[int, float | None]]:
+        # Por estado: cuántos y hace cuánto se actualizó el más antiguo.
+        rows = self._conn().execute(
+            "SELECT status, COUNT(*), MIN(updated_at) FROM ai_jobs GROUP BY status"
+        ).fetchall()
+        now = time.time()
+        return {status: (n, now - oldest if oldest else None) for status, n, oldest in rows}
+
+
+_JOBS = _JobQueue("", max_attempts=3, retry_seconds=2.0, lease_seconds=60.0)
+
+
+def _run_ai_job(
+    kind: str, args: Dict[str, object], *, cache: _AICache, report_errors: bool, payload_mode: str = "full", **common
+) -> bool:
+    # Corre un trabajo de la cola con la configuración del worker; devuelve si
+    # su resultado quedó en el caché. Con `report_errors=False` (queda otro
+    # intento) la falla no se publica en `ai_error_v1:`: la página sigue
+    # esperando en lugar de mostrar el error.
+    entry = args["entry"]
+    answers = {str(k): int(v) for k, v in dict(args["answers"]).items()}
+    _, total_pct, by_category = _compute_scores(answers)
+    kwargs = dict(common, cache=cache, total_pct=total_pct, by_category=by_category, report_errors=report_errors)
+    if kind == "combined":
+        _combined_job(
+            entry=entry, stream=bool(args.get("stream")), answers=answers, payload_mode=payload_mode, **kwargs
+        )
+    elif kind == "ai":
+        _ai_result_job(
+            cache_key=str(entry["ai"]),
+            stream=bool(args.get("stream")),
+            answers=answers,
+            payload_mode=payload_mode,
+            **kwargs,
+        )
+    elif kind == "interpretation":
+        _interpretation_job(cache_key=str(entry["interpretation"]), **kwargs)
+    else:
+        raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+    has_ai = isinstance(cache.get(str(entry["ai"])), dict)
+    has_msg = isinstance(cache.get(str(entry["interpretation"])), str)
+    return {"combined": has_ai and has_msg, "ai": has_ai, "interpretation": has_msg}[kind]
+
+
+class _SQLiteAICache(_SQLiteStore, _AICache):
+    _schema = """
+    CREATE TABLE IF NOT EXISTS ai_cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ai_cache_expires_at ON ai_cache (expires_at);
+    """
+
+    def __init__(self, path: str, *, max_entries: int, ttl_seconds: int) -> None:
+        super().__init__(path)
+        self._max_entries = max(1, max_entries)
+        self._ttl_seconds = ttl_seconds
+        self._writes = 0
+
+    def get(self, key: str) -> object | None:
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key: str) -> Tuple[object, float] | None:
+        # (valor, expires_at), para que el nivel en memoria no viva más que la fila.
+        try:
+            row = self._conn().execute(
+                "SELECT value, expires_at FROM ai_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            return None
+        try:
+            return json.loads(row[0]), row[1]
+        except ValueError:
+            return None
+
+    def set(self, key: str, value: object, *, ttl_seconds: int | None = None) -> None:
+        now = time.time()
+        ttl = self._ttl_seconds if ttl_seconds is None else ttl_seconds
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl),
+            )
+            self._writes += 1
+            if self._writes % 100 == 1:
+                self._evict(conn, now)
+        except sqlite3.Error:
+            return
+
+    def delete(self, key: str) -> None:
+        try:
+            self._conn().execute("DELETE FROM ai_cache WHERE key = ?", (key,))
+        except sqlite3.Error:
+            return
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        # Expirados primero; después, los que vencen antes si se excede el tope.
+        conn.execute("DELETE FROM ai_cache WHERE expires_at <= ?", (now,))
+        conn.execute(
+            "DELETE FROM ai_cache WHERE key IN ("
+            " SELECT key FROM ai_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?"
+            ")",
+            (self._max_entries,),
+        )
+
+
+class _TieredAICache(_AICache):
+    # Memoria local delante de SQLite compartido: los aciertos en SQLite se
+    # promueven a memoria para no volver a leer disco, con el TTL que le queda a
+    # la fila (hasta `promote_max_seconds`). Las llaves que cambian o se borran
+    # desde otro worker (errores, avance parcial, referencias) no se promueven:
+    # una copia local las dejaría congeladas.
+    _VOLATILE_PREFIXES = ("ai_error_v1:", "ai_partial_v1:", "ai_ref_v2:")
+
+    def __init__(self, front: _AICache, back: _SQLiteAICache, *, promote_max_seconds: int) -> None:
+        self._front = front
+        self._back = back
+        self._promote_max_seconds = promote_max_seconds
+
+    def get(self, key: str) -> object | None:
+        volatile = key.startswith(self._VOLATILE_PREFIXES)
+        if not volatile:
+            value = self._front.get(key)
+            if value is not None:
+                return value
+        entry = self._back.get_entry(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        remaining = min(int(expires_at - time.time()), self._promote_max_seconds)
+        if not volatile and remaining > 0:
+            self._front.set(key, value, ttl_seconds=remaining)
+        return value
+
+    def set(self, key: str, value: object, *, ttl_seconds: int | None = None) -> None:
+        if not key.startswith(self._VOLATILE_PREFIXES):
+            self._front.set(key, value, ttl_seconds=ttl_seconds)
+        self._back.set(key, value, ttl_seconds=ttl_seconds)
+
+    def delete(self, key: str) -> None:
+        self._front.delete(key)
+        self._back.delete(key)
+
+
+# Backends que ven todos los procesos (workers web, `ai-worker`, comandos CLI).
+_SHARED_AI_CACHE_BACKENDS = {"sqlite", "tiered"}
+
+
+def _build_ai_cache(config) -> _AICache:
+    backend = config["AI_CACHE_BACKEND"]
+    ttl = config["AI_CACHE_TTL_SECONDS"]
+    if backend == "none":
+        return _AICache()
+    memory = _MemoryAICache(max_entries=config["AI_CACHE_MAX_ENTRIES"], ttl_seconds=ttl)
+    if backend == "memory":
+        return memory
+    sqlite_cache = _SQLiteAICache(config["AI_CACHE_PATH"], max_entries=config["AI_CACHE_DB_MAX_ENTRIES"], ttl_seconds=ttl)
+    if backend == "sqlite":
+        return sqlite_cache
+    return _TieredAICache(memory, sqlite_cache, promote_max_seconds=ttl)
+
+
+class _SQLiteSessionStore(_SQLiteStore):
+    _schema = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        sid TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+    """
+
+    def load(self, sid: str) -> Tuple[Dict[str, object], float] | None:
+        row = self._conn().execute(
+            "SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?", (sid, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            data = session_json_serializer.loads(row[0])
+        except ValueError:
+            return None
+        return (data, row[1]) if isinstance(data, dict) else None
+
+    def save(self, sid: str, data: Dict[str, object], expires_at: float) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+            (sid, session_json_serializer.dumps(data), expires_at),
+        )
+
+    def delete(self, sid: str) -> None:
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def purge_expired(self) -> int:
+        return self._conn().execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+class _ServerSideSession(SecureCookieSession):
+    def __init__(self, initial=None, *, sid: str, expires_at: float = 0.0) -> None:
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+
+
+class _SQLiteSessionInterface(SessionInterface):
+    # La cookie sólo lleva un identificador opaco; los datos viven en SQLite,
+    # compartido por los workers. Un hilo por proceso purga sesiones vencidas.
+    _sid_re = re.compile(r"^[A-Za-z0-9_-]{43}$")
+
+    def __init__(self, store: _SQLiteSessionStore, *, ttl_seconds: int, cleanup_interval_seconds: int) -> None:
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.cleanup_interval_seconds = cleanup_interval_seconds
+        self._cleanup_pid: int | None = None
+        self._cleanup_lock = threading.Lock()
+
+    def open_session(self, app: Flask, request) -> _ServerSideSession:
+        self._ensure_cleanup_thread()
+        sid = request.cookies.get(self.get_cookie_name(app), "")
+        if self._sid_re.match(sid):
+            try:
+                loaded = self.store.load(sid)
+            except sqlite3.Error:
+                loaded = None
+            if loaded is not None:
+                data, expires_at = loaded
+                return _ServerSideSession(data, sid=sid, expires_at=expires_at)
+        return _ServerSideSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app: Flask, session: _ServerSideSession, response) -> None:
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.modified:
+                try:
+                    self.store.delete(session.sid)
+                except sqlite3.Error as e:
+                    app.logger.warning("No se pudo borrar la sesión en SQLite: %s", e)
+                response.delete_cookie(
+                    name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly
+                )
+                response.vary.add("Cookie")
+            return
+
+        # Sólo se escribe si cambió o si ya consumió la mitad de su vigencia.
+        now = time.time()
+        if session.modified or session.expires_at - now < self.ttl_seconds / 2:
+            # Si SQLite falla (bloqueado, disco lleno) la respuesta sale igual;
+            # sólo se pierde este cambio de la sesión.
+            try:
+                self.store.save(session.sid, dict(session), now + self.ttl_seconds)
+            except sqlite3.Error as e:
+                app.logger.warning("No se pudo guardar la sesión en SQLite: %s", e)
+
+        if not self.should_set_cookie(app, session):
+            return
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite,
+        )
+        response.vary.add("Cookie")
+
+    def _ensure_cleanup_thread(self) -> None:
+        if self._cleanup_pid == os.getpid() or self.cleanup_interval_seconds <= 0:
+            return
+        with self._cleanup_lock:
+            if self._cleanup_pid == os.getpid():
+                return
+            self._cleanup_pid = os.getpid()
+            threading.Thread(target=self._cleanup_loop, name="session-cleanup", daemon=True).start()
+
+    def _cleanup_loop(self) -> None:
+        while True:
+            try:
+                self.store.purge_expired()
+            except sqlite3.Error:
+                pass
+            time.sleep(self.cleanup_interval_seconds)
+
+
+def _prewarm_profiles_grid(levels: List[int]) -> List[Dict[str, int]]:
+    # Todas las respuestas de una categoría con el mismo valor; los perfiles
+    # más parejos (menor diferencia entre categorías) van primero.
+    categories = list(dict.fromkeys(q.category for q in QUESTIONS))
+    combos = sorted(itertools.product(levels, repeat=len(categories)), key=lambda c: (max(c) - min(c), c))
+    return [
+        {q.id: combo[categories.index(q.category)] for q in QUESTIONS}
+        for combo in combos
+    ]
+
+
+def _prewarm_profiles_from_sessions(path: str) -> List[Dict[str, int]]:
+    # Últimas respuestas guardadas en sesiones del lado del servidor, de la
+    # más frecuente a la menos frecuente.
+    counts: Dict[Tuple[int, ...], int] = {}
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute("SELECT data FROM sessions WHERE expires_at > ?", (time.time(),)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return []
+    for (raw,) in rows:
+        try:
+            data = session_json_serializer.loads(raw)
+        except ValueError:
+            continue
+        answers = data.get("last_answers") if isinstance(data, dict) else None
+        if not isinstance(answers, dict) or isinstance(_parse_answers(answers), str):
+            continue
+        values = tuple(int(answers[q.id]) for q in QUESTIONS)
+        counts[values] = counts.get(values, 0) + 1
+    ranked = sorted(counts.items(), key=lambda item: -item[1])
+    return [{q.id: values[i] for i, q in enumerate(QUESTIONS)} for values, _ in ranked]
+
+
+def _prewarm_profiles_from_submissions(log: _SubmissionLog) -> List[Dict[str, int]]:
+    # Respuestas registradas en la bitácora de envíos, de la más frecuente a la
+    # menos frecuente; no depende del backend de sesiones.
+    counts: Dict[Tuple[int, ...], int] = {}
+    for _, answers in log.iter_rows():
+        if any(answers.get(q.id) not in {1, 2, 3, 4, 5} for q in QUESTIONS):
+            continue
+        values = tuple(answers[q.id] for q in QUESTIONS)
+        counts[values] = counts.get(values, 0) + 1
+    ranked = sorted(counts.items(), key=lambda item: -item[1])
+    return [{q.id: values[i] for i, q in enumerate(QUESTIONS)} for values, _ in ranked]
+
+
+def _prewarm_ai_cache(
+    cache: _AICache,
+    profiles: List[Dict[str, int]],
+    *,
+    seed_path: str,
+    concurrency: int,
+    combined: bool,
+    api_key: str,
+    base_url: str,
+    model: str,
+    api_mode: str,
+    timeout_seconds: int,
+    payload_mode: str = "full",
+    on_progress: Callable[[int, int], None] | None = None,
+) -> Dict[str, int]:
+    # Genera (o reutiliza del caché) plan e interpretación de cada perfil y
+    # deja todas las entradas en el archivo semilla que se carga al arrancar.
+    jobs: Dict[str, Tuple[Dict[str, int], str]] = {}
+    for answers in profiles:
+        total, total_pct, by_category = _compute_scores(answers)
+        ai_key = _ai_result_cache_key(
+            _ai_result_payload(
+                total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=payload_mode
+            ),
+            payload_mode=payload_mode,
+        )
+        interp_key = _interpretation_cache_key(
+            _interpretation_payload(
+                total_pct=total_pct, level=_interpretation_level(total_pct), by_category=by_category
+            )
+        )
+        jobs.setdefault(ai_key, (answers, interp_key))
+
+    stats = {"profiles": len(jobs), "cached": 0, "generated": 0, "failed": 0, "seed_entries": 0}
+    stats_lock = threading.Lock()
+    common = {
+        "api_key": api_key,
+        "base_url": base_url,
+        "model": model,
+        "api_mode": api_mode,
+        "timeout_seconds": timeout_seconds,
+        "cache": cache,
+        "debug": True,
+    }
+
+    def warm(ai_key: str, answers: Dict[str, int], interp_key: str) -> None:
+        if isinstance(cache.get(ai_key), dict) and isinstance(cache.get(interp_key), str):
+            outcome = "cached"
+        else:
+            total, total_pct, by_category = _compute_scores(answers)
+            if combined:
+                (ai, _, _), _ = _maybe_ai_combined(
+                    total_pct=total_pct, answers=answers, by_category=by_category, payload_mode=payload_mode, **common
+                )
+            else:
+                ai, _, _ = _maybe_ai_result(
+                    total_pct=total_pct, answers=answers, by_category=by_category, payload_mode=payload_mode, **common
+                )
+                _interpretation(total_pct, by_category=by_category, **common)
+            ok = ai is not None and isinstance(cache.get(interp_key), str)
+            outcome = "generated" if ok else "failed"
+        with stats_lock:
+            stats[outcome] += 1
+
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(warm, key, answers, interp_key) for key, (answers, interp_key) in jobs.items()]
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                with stats_lock:
+                    stats["failed"] += 1
+            done += 1
+            if on_progress is not None:
+                on_progress(done, len(futures))
+
+    entries: Dict[str, object] = {}
+    for ai_key, (_, interp_key) in jobs.items():
+        for key in (ai_key, interp_key):
+            value = cache.get(key)
+            if value is not None:
+                entries[key] = value
+    stats["seed_entries"] = _write_ai_cache_seed(seed_path, entries, cache)
+    return stats
+
+
+# Qué semilla se cargó (tamaño y mtime del archivo) y con qué llaves. Vive en
+# el caché compartido, así que sólo el primer proceso tras un cambio la lee.
+_AI_SEED_STATE_KEY = "ai_seed_v1:state"
+
+
+def _load_ai_cache_seed(cache: _AICache, path: str) -> int:
+    # Archivo JSONL ({"key", "value"} por línea) generado por `flask ai-prewarm`.
+    # Sólo se cargan las entradas que aún no están en el caché, y se borran las
+    # que cargó una semilla anterior y ya no vienen en esta.
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0
+    marker = f"{stat.st_size}:{stat.st_mtime_ns}"
+    state = cache.get(_AI_SEED_STATE_KEY)
+    if isinstance(state, dict) and state.get("marker") == marker:
+        return 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return 0
+    keys: List[str] = []
+    loaded = 0
+    for line in lines:
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(item, dict) or not isinstance(item.get("key"), str) or item.get("value") is None:
+            continue
+        keys.append(item["key"])
+        if cache.get(item["key"]) is None:
+            cache.set(item["key"], item["value"])
+            loaded += 1
+    previous = state.get("keys") if isinstance(state, dict) else None
+    for key in set(previous if isinstance(previous, list) else ()) - set(keys):
+        cache.delete(key)
+    cache.set(_AI_SEED_STATE_KEY, {"marker": marker, "keys": keys})
+    return loaded
+
+
+def _write_ai_cache_seed(path: str, entries: Dict[str, object], cache: _AICache) -> int:
+    # Se conservan las entradas previas del archivo que siguen en el caché (las
+    # vencidas o de versiones anteriores de la llave se descartan); escritura atómica.
+    merged: Dict[str, object] = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(item, dict) and isinstance(item.get("key"), str):
+                    value = cache.get(item["key"])
+                    if value is not None:
+                        merged[item["key"]] = value
+    except OSError:
+        pass
+    merged.update(entries)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for key, value in merged.items():
+            f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return len(merged)
+
+
+class _AIBatchStore(_SQLiteStore):
+    # Planes de IA generados offline con `flask ai-batch`, que `_maybe_ai_result`
+    # consulta cuando no están en el caché (no vencen ni se desalojan). También
+    # guarda el estado para reanudar: un item por payload distinto (llave =
+    # llave de caché) y los lotes enviados al Batch API hasta descargarlos.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS ai_results (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS ai_batch_items (
+        key TEXT PRIMARY KEY,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        batch_id TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS ai_batch_items_status ON ai_batch_items (status, batch_id);
+    CREATE TABLE IF NOT EXISTS ai_batches (
+        batch_id TEXT PRIMARY KEY,
+        status TEXT NOT NULL,
+        created_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    """
+
+    def results(self) -> Iterator[Tuple[str, Dict[str, object]]]:
+        for key, raw in self._conn().execute("SELECT key, value FROM ai_results"):
+            try:
+                value = json.loads(raw)
+            except ValueError:
+                continue
+            if isinstance(value, dict):
+                yield key, value
+
+    def put(self, key: str, value: Dict[str, object]) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_results (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time()),
+            )
+            conn.execute("UPDATE ai_batch_items SET status = 'done', error = NULL WHERE key = ?", (key,))
+
+    def enqueue(self, items: Dict[str, Dict[str, object]]) -> int:
+        # Dedup por llave: se ignoran las ya encoladas o ya generadas.
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO ai_batch_items (key, payload, status) "
+                "SELECT ?, ?, 'pending' WHERE NOT EXISTS (SELECT 1 FROM ai_results WHERE key = ?)",
+                [(key, json.dumps(payload, ensure_ascii=False), key) for key, payload in items.items()],
+            )
+            added = conn.total_changes - before
+        return added
+
+    def pending(self, limit: int) -> List[Tuple[str, Dict[str, object]]]:
+        rows = self._conn().execute(
+            "SELECT key, payload FROM ai_batch_items WHERE status = 'pending' LIMIT ?", (limit,)
+        ).fetchall()
+        return [(key, json.loads(payload)) for key, payload in rows]
+
+    def submit(self, keys: List[str], batch_id: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_batches (batch_id, status, created_at) VALUES (?, 'submitted', ?)",
+                (batch_id, time.time()),
+            )
+            conn.executemany(
+                "UPDATE ai_batch_items SET status = 'submitted', batch_id = ? WHERE key = ?",
+                [(batch_id, key) for key in keys],
+            )
+
+    def fail(self, key: str, error: str) -> None:
+        self._conn().execute(
+            "UPDATE ai_batch_items SET status = 'failed', attempts = attempts + 1, error = ? WHERE key = ?",
+            (error[:600], key),
+        )
+
+    def open_batches(self) -> List[str]:
+        rows = self._conn().execute("SELECT batch_id FROM ai_batches WHERE status = 'submitted' ORDER BY created_at")
+        return [batch_id for (batch_id,) in rows.fetchall()]
+
+    def close_batch(self, batch_id: str, status: str) -> None:
+        # Lo que el lote no devolvió cuenta como intento fallido.
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE ai_batch_items SET status = 'failed', attempts = attempts + 1, error = ? "
+                "WHERE batch_id = ? AND status = 'submitted'",
+                (f"Sin resultado en el lote {batch_id} ({status}).", batch_id),
+            )
+            conn.execute("UPDATE ai_batches SET status = ? WHERE batch_id = ?", (status, batch_id))
+
+    def retry_failed(self, max_attempts: int) -> int:
+        cur = self._conn().execute(
+            "UPDATE ai_batch_items SET status = 'pending', batch_id = NULL WHERE status = 'failed' AND attempts < ?",
+            (max_attempts,),
+        )
+        return cur.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM ai_batch_items GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+
+_AI_STORE = _AIBatchStore("")
+_AI_BATCH_TERMINAL = {"completed", "failed", "expired", "cancelled"}
+
+
+def _openai_api_call(
+    method: str,
+    path: str,
+    *,
+    base_url: str,
+    api_key: str,
+    timeout_seconds: float,
+    data: bytes | None = None,
+    content_type: str = "application/json",
+) -> Tuple[bytes | None, str | None]:
+    # Llamadas auxiliares (archivos y lotes) de `flask ai-batch`; corren fuera
+    # de los requests, así que no pasan por el limitador ni el circuit breaker.
+    headers = {"Authorization": f"Bearer {api_key}"}
+    if data is not None:
+        headers["Content-Type"] = content_type
+    try:
+        status, raw = _HTTP_POOL.request(
+            method, base_url.rstrip("/") + path, headers=headers, data=data, timeout=timeout_seconds
+        )
+    except (OSError, http.client.HTTPException) as e:
+        return None, f"Error de red/timeout hacia OpenAI: {e}"
+    if status >= 400:
+        return None, _openai_parse_json_body(status, raw)[1]
+    return raw, None
+
+
+def _openai_api_json(method: str, path: str, **kwargs) -> Tuple[Dict[str, object] | None, str | None]:
+    raw, err = _openai_api_call(method, path, **kwargs)
+    if raw is None:
+        return None, err
+    return _openai_parse_json_body(200, raw)
+
+
+def _ai_batch_output(line: Dict[str, object]) -> Tuple[Dict[str, object] | None, str | None]:
+    # Una línea del archivo de salida del Batch API -> plan normalizado.
+    response = line.get("response") if isinstance(line.get("response"), dict) else {}
+    body = response.get("body") if isinstance(response.get("body"), dict) else {}
+    if line.get("error") or int(response.get("status_code") or 0) >= 400:
+        return None, json.dumps(line.get("error") or body, ensure_ascii=False)[:600]
+    if "choices" in body:
+        text, err = _chat_completion_text(body)
+    else:
+        text, err = _responses_output_text(body), None
+    if not text:
+        return None, err or "Sin contenido de salida desde OpenAI."
+    return _parse_ai_insights(text)
+
+
+def _run_ai_batch(
+    store: _AIBatchStore,
+    *,
+    cache: _AICache,
+    mode: str,
+    api_key: str,
+    base_url: str,
+    model: str,
+    api_mode: str,
+    timeout_seconds: int,
+    concurrency: int,
+    chunk_size: int,
+    poll_seconds: float,
+    wait_for_batches: bool,
+    payload_mode: str = "full",
+    on_progress: Callable[[str], None] | None = None,
+) -> str:
+    # Genera los planes pendientes del store. En modo batch sube un archivo
+    # JSONL por bloque y crea un lote (Batch API); si el proveedor no lo ofrece
+    # y el modo es auto, usa un pool acotado de llamadas normales. Todo queda en
+    # el store, así que interrumpir y volver a correr retoma donde iba.
+    # Cada plan se publica en el caché de IA compartido, de donde lo lee la
+    # página; al arrancar se vuelven a publicar los ya generados (por si el
+    # caché los venció o desalojó). Devuelve el modo que terminó usándose.
+    progress = on_progress or (lambda message: None)
+    for key, ai in store.results():
+        cache.set(key, ai)
+    settings = _task_settings("insights", model=model, timeout_seconds=timeout_seconds)
+    chat = (api_mode or "auto").strip().lower() == "chat_completions"
+    endpoint = urlsplit(base_url).path.rstrip("/") + ("/chat/completions" if chat else "/responses")
+    api = {"base_url": base_url, "api_key": api_key, "timeout_seconds": max(30, timeout_seconds)}
+
+    def collect(batch_id: str) -> bool:
+        batch, err = _openai_api_json("GET", f"/batches/{batch_id}", **api)
+        if batch is None:
+            progress(f"lote {batch_id}: {err}")
+            return False
+        status = str(batch.get("status") or "")
+        if status not in _AI_BATCH_TERMINAL:
+            return False
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            if not file_id:
+                continue
+            raw, err = _openai_api_call("GET", f"/files/{file_id}/content", **api)
+            if raw is None:
+                # Se vuelve a intentar la descarga en la siguiente corrida.
+                progress(f"lote {batch_id}: {err}")
+                return False
+            for text in raw.decode("utf-8").splitlines():
+                try:
+                    line = json.loads(text)
+                except ValueError:
+                    continue
+                key = line.get("custom_id") if isinstance(line, dict) else None
+                if not isinstance(key, str):
+                    continue
+                ai, err = _ai_batch_output(line)
+                if ai is not None:
+                    store.put(key, ai)
+                    cache.set(key, ai)
+                else:
+                    store.fail(key, err or "Respuesta inválida.")
+        store.close_batch(batch_id, status)
+        progress(f"lote {batch_id}: {status}")
+        return True
+
+    for batch_id in store.open_batches():
+        collect(batch_id)
+
+    if mode != "pool":
+        while True:
+            items = store.pending(chunk_size)
+            if not items:
+                break
+            lines = []
+            for key, payload in items:
+                system, user = _insights_prompt(payload, payload_mode=payload_mode)
+                body = (_chat_body if chat else _responses_body)(
+                    model=settings.model,
+                    system=system,
+                    user=user,
+                    temperature=settings.temperature,
+                    max_output_tokens=settings.max_output_tokens,
+                )
+                request_line = {"custom_id": key, "method": "POST", "url": endpoint, "body": body}
+                lines.append(json.dumps(request_line, ensure_ascii=False).encode("utf-8"))
+            boundary = secrets.token_hex(16)
+            data = (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="purpose"\r\n\r\nbatch\r\n'
+                f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="ai_batch.jsonl"\r\n'
+                "Content-Type: application/jsonl\r\n\r\n"
+            ).encode("utf-8") + b"\n".join(lines) + f"\r\n--{boundary}--\r\n".encode("utf-8")
+            uploaded, err = _openai_api_json(
+                "POST", "/files", data=data, content_type=f"multipart/form-data; boundary={boundary}", **api
+            )
+            batch = None
+            if uploaded is not None:
+                batch, err = _openai_api_json(
+                    "POST",
+                    "/batches",
+                    data=json.dumps(
+                        {"input_file_id": uploaded.get("id"), "endpoint": endpoint, "completion_window": "24h"}
+                    ).encode("utf-8"),
+                    **api,
+                )
+            if batch is None or not batch.get("id"):
+                if mode == "auto" and str(err).startswith(("HTTP 404", "HTTP 405", "HTTP 501")):
+                    progress("El proveedor no ofrece Batch API; se usa el pool de llamadas.")
+                    mode = "pool"
+                    break
+                raise RuntimeError(err or "No se pudo crear el lote.")
+            store.submit([key for key, _ in items], str(batch["id"]))
+            progress(f"lote {batch['id']}: {len(items)} solicitudes enviadas")
+
+        while wait_for_batches:
+            open_batches = store.open_batches()
+            if not open_batches:
+                break
+            time.sleep(poll_seconds)
+            for batch_id in open_batches:
+                collect(batch_id)
+
+    if mode == "pool":
+
+        def generate(key: str, payload: Dict[str, object]) -> None:
+            try:
+                ai, err = _generate_ai_insights(
+                    api_key=api_key,
+                    base_url=base_url,
+                    model=model,
+                    api_mode=api_mode,
+                    timeout_seconds=timeout_seconds,
+                    scoring_payload=payload,
+                    payload_mode=payload_mode,
+                )
+                if ai is not None:
+                    store.put(key, ai)
+                    cache.set(key, ai)
+                    return
+            except Exception as e:
+                err = f"{type(e).__name__}: {e}"
+            store.fail(key, err or "Sin contenido de salida desde OpenAI.")
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            while True:
+                items = store.pending(chunk_size)
+                if not items:
+                    break
+                list(pool.map(lambda item: generate(*item), items))
+                done += len(items)
+                progress(f"pool: {done} planes procesados")
+    return mode
+
+
+def _parse_answers(form) -> Dict[str, int] | str:
+    answers: Dict[str, int] = {}
+    for q in QUESTIONS:
+        raw = form.get(q.id)
+        if raw is None:
+            return "Faltan respuestas: contesta todas las preguntas antes de continuar."
+        # Texto (formulario, CSV) o entero (JSONL); `True`, `4.7` o `[3]` no son respuestas.
+        if isinstance(raw, bool) or not isinstance(raw, (int, str)):
+            return "Respuestas inválidas: vuelve a intentarlo."
+        try:
+            value = int(raw)
+        except (TypeError, ValueError):
+            return "Respuestas inválidas: vuelve a intentarlo."
+        if value not in {1, 2, 3, 4, 5}:
+            return "Respuestas fuera de rango: vuelve a intentarlo."
+        answers[q.id] = value
+    return answers
+
+
+def _compute_scores(answers: Dict[str, int]) -> Tuple[int, int, Dict[str, Dict[str, int]]]:
+    values = list(answers.values())
+    total_points = sum(values)  # 20..100
+    total_pct = round((total_points / (len(values) * 5)) * 100)
+
+    by_category: Dict[str, List[int]] = {}
+    for q in QUESTIONS:
+        by_category.setdefault(q.category, []).append(answers[q.id])
+
+    by_category_summary: Dict[str, Dict[str, int]] = {}
+    for category, nums in by_category.items():
+        points = sum(nums)
+        pct = round((points / (len(nums) * 5)) * 100)
+        by_category_summary[category] = {"points": points, "pct": pct, "max": len(nums) * 5}
+
+    return total_points, total_pct, by_category_summary
+
+
+class _CohortHistogram(_SQLiteStore):
+    # Percentiles contra todos los envíos anteriores. Los dominios son enteros
+    # pequeños (puntos por área 5–25, total 25–125), así que basta un conteo por
+    # valor. El hilo de `_SubmissionLog` suma cada lote; el request sólo lee una
+    # copia en memoria con acumulados, que se refresca cada `cache_seconds`.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS cohort_histogram (
+        dimension TEXT NOT NULL,
+        value INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (dimension, value)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str, *, min_samples: int, cache_seconds: float) -> None:
+        super().__init__(path)
+        self.min_samples = min_samples
+        self.cache_seconds = cache_seconds
+        self._snapshot: Dict[str, Tuple[List[int], int]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, rows: List[Tuple[int, bytes]]) -> None:
+        counts: Dict[Tuple[str, int], int] = {}
+        for _, packed in rows:
+            answers = dict(zip((q.id for q in QUESTIONS), packed))
+            total, _, by_category = _compute_scores(answers)
+            for dimension, value in [("total", total)] + [(k, v["points"]) for k, v in by_category.items()]:
+                counts[(dimension, value)] = counts.get((dimension, value), 0) + 1
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO cohort_histogram (dimension, value, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (dimension, value) DO UPDATE SET count = count + excluded.count",
+                [(dimension, value, n) for (dimension, value), n in counts.items()],
+            )
+
+    def percentiles(self, *, total: int, by_category: Dict[str, Dict[str, int]]) -> Dict[str, object] | None:
+        # Percentil = % de envíos con menor puntaje, contando los empates a la mitad.
+        snapshot = self._load()
+        _, samples = snapshot.get("total", ([], 0))
+        if samples < max(1, self.min_samples):
+            return None
+
+        def rank(dimension: str, value: int) -> int | None:
+            below, n = snapshot.get(dimension, ([], 0))
+            if not n:
+                return None
+            value = min(value, len(below) - 1)
+            tied = below[value + 1] - below[value] if value + 1 < len(below) else 0
+            return round(100 * (below[value] + tied / 2) / n)
+
+        return {
+            "samples": samples,
+            "total": rank("total", total),
+            "by_category": {k: rank(k, v["points"]) for k, v in by_category.items()},
+        }
+
+    def rebuild(self, rows) -> int:
+        # Recalcula todo desde la bitácora (sólo desde la CLI, nunca en un request).
+        self.reset()
+        batch: List[Tuple[int, bytes]] = []
+        n = 0
+        for created_at, answers in rows:
+            batch.append((created_at, bytes(answers[q.id] for q in QUESTIONS)))
+            if len(batch) >= 5000:
+                self.add(batch)
+                n, batch = n + len(batch), []
+        if batch:
+            self.add(batch)
+        return n + len(batch)
+
+    def reset(self) -> None:
+        self._conn().execute("DELETE FROM cohort_histogram")
+        self._loaded_at = 0.0
+
+    def _load(self) -> Dict[str, Tuple[List[int], int]]:
+        if time.monotonic() - self._loaded_at < self.cache_seconds:
+            return self._snapshot
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.cache_seconds:
+                return self._snapshot
+            try:
+                rows = self._conn().execute("SELECT dimension, value, count FROM cohort_histogram").fetchall()
+            except sqlite3.Error:
+                return self._snapshot
+            per_dimension: Dict[str, Dict[int, int]] = {}
+            for dimension, value, count in rows:
+                per_dimension.setdefault(dimension, {})[int(value)] = int(count)
+            snapshot: Dict[str, Tuple[List[int], int]] = {}
+            for dimension, counts in per_dimension.items():
+                # below[v] = envíos con valor menor que v.
+                below = [0] * (max(counts) + 2)
+                for v in range(1, len(below)):
+                    below[v] = below[v - 1] + counts.get(v - 1, 0)
+                snapshot[dimension] = (below, below[-1])
+            self._snapshot, self._loaded_at = snapshot, time.monotonic()
+            return snapshot
+
+
+_COHORT = _CohortHistogram("", min_samples=30, cache_seconds=30.0)
+
+
+class _SubmissionLog:
+    # Bitácora de envíos válidos: sólo se agregan filas, en segmentos SQLite
+    # (`submissions-000001.sqlite3`, ...) que rotan por tamaño. Cada fila guarda
+    # el timestamp y las 25 respuestas empaquetadas como bytes (un byte por
+    # pregunta, en el orden guardado en `meta`). El request sólo encola; un hilo
+    # por proceso escribe por lotes (y suma cada lote a `cohort`), así que nunca
+    # espera al disco. Si la cola se llena, el envío se descarta y se cuenta en `dropped`.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS submissions (
+        created_at INTEGER NOT NULL,
+        answers BLOB NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """
+    _segment_re = re.compile(r"^submissions-(\d{6})\.sqlite3$")
+
+    def __init__(
+        self, directory: str, *, segment_max_bytes: int, batch_size: int, flush_seconds: float, queue_size: int
+    ) -> None:
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.cohort: _CohortHistogram | None = None
+        self.granularity: _ProfileGranularity | None = None
+        self._queue: queue.Queue | None = None
+        self._writer_pid: int | None = None
+        self._writer_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return (
+            bool(self.directory)
+            or (self.cohort is not None and bool(self.cohort.path))
+            or (self.granularity is not None and self.granularity.enabled)
+        )
+
+    def record(self, answers: Dict[str, int]) -> None:
+        if not self.enabled:
+            return
+        self._ensure_writer()
+        row = (int(time.time()), bytes(answers[q.id] for q in QUESTIONS))
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout_seconds: float = 5.0) -> bool:
+        # Espera a que el hilo escritor vacíe la cola (al salir o desde la CLI).
+        if self._queue is None or self._writer_pid != os.getpid():
+            return True
+        give_up_at = time.monotonic() + timeout_seconds
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= give_up_at:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def segments(self) -> List[str]:
+        try:
+            names = sorted(n for n in os.listdir(self.directory) if self._segment_re.match(n))
+        except OSError:
+            return []
+        return [os.path.join(self.directory, n) for n in names]
+
+    def iter_rows(self):
+        # (created_at, respuestas) de todos los segmentos, del más antiguo al más nuevo.
+        for path in self.segments():
+            try:
+                conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            except sqlite3.Error:
+                continue
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'questions'").fetchone()
+                ids = row[0].split(",") if row else [q.id for q in QUESTIONS]
+                for created_at, packed in conn.execute("SELECT created_at, answers FROM submissions ORDER BY rowid"):
+                    yield int(created_at), dict(zip(ids, packed))
+            except sqlite3.Error:
+                continue
+            finally:
+                conn.close()
+
+    def _ensure_writer(self) -> None:
+        if self._writer_pid == os.getpid():
+            return
+        with self._writer_lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=max(1, self.queue_size))
+            self._writer_pid = os.getpid()
+            threading.Thread(target=self._writer_loop, args=(self._queue,), name="submission-log", daemon=True).start()
+
+    def _writer_loop(self, pending: queue.Queue) -> None:
+        conn: sqlite3.Connection | None = None
+        seq = 0
+        while True:
+            batch = [pending.get()]
+            flush_at = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = flush_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                if self.directory:
+                    conn, seq = self._write_segment(conn, seq, batch)
+                if self.cohort is not None and self.cohort.path:
+                    try:
+                        self.cohort.add(batch)
+                    except sqlite3.Error:
+                        pass
+                if self.granularity is not None and self.granularity.enabled:
+                    self.granularity.add(batch)
+            finally:
+                for _ in batch:
+                    pending.task_done()
+
+    def _write_segment(
+        self, conn: sqlite3.Connection | None, seq: int, batch: List[Tuple[int, bytes]]
+    ) -> Tuple[sqlite3.Connection | None, int]:
+        try:
+            if conn is None:
+                conn, seq = self._open_segment(seq)
+            with _sqlite_transaction(conn):
+                conn.executemany("INSERT INTO submissions (created_at, answers) VALUES (?, ?)", batch)
+            page_count, page_size = (
+                conn.execute("PRAGMA page_count").fetchone()[0],
+                conn.execute("PRAGMA page_size").fetchone()[0],
+            )
+            if page_count * page_size >= self.segment_max_bytes:
+                conn.close()
+                return None, seq + 1
+            return conn, seq
+        except (OSError, sqlite3.Error):
+            self.dropped += len(batch)
+            if conn is not None:
+                conn.close()
+            return None, seq
+
+    def _open_segment(self, min_seq: int) -> Tuple[sqlite3.Connection, int]:
+        # Otro worker pudo haber rotado ya: se escribe en el segmento más nuevo.
+        os.makedirs(self.directory, exist_ok=True)
+        latest = max((int(self._segment_re.match(os.path.basename(p)).group(1)) for p in self.segments()), default=1)
+        seq = max(latest, min_seq, 1)
+        path = os.path.join(self.directory, f"submissions-{seq:06d}.sqlite3")
+        conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self._schema)
+        conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('questions', ?)", (",".join(q.id for q in QUESTIONS),)
+        )
+        return conn, seq
+
+
+_SUBMISSIONS = _SubmissionLog("", segment_max_bytes=64 * 1024 * 1024, batch_size=500, flush_seconds=1.0, queue_size=10000)
+atexit.register(_SUBMISSIONS.flush)
+
+
+def _interpretation_level(total_pct: int) -> str:
+    if total_pct >= 80:
+        return "Alto"
+    if total_pct >= 60:
+        return "Medio"
+    return "Bajo"
+
+
+# Para puntuar en lote: columna de área de cada pregunta (orden de CATEGORY_ORDER)
+# y nivel por porcentaje, precalculados una vez.
+_CATEGORY_INDEX: List[int] = [CATEGORY_ORDER.index(q.category) for q in QUESTIONS]
+_LEVEL_BY_PCT: List[str] = [_interpretation_level(pct) for pct in range(101)]
+_CATEGORY_ONEHOT = None
+
+
+def _score_matrix(rows: List[List[int]], *, engine: str) -> Tuple[List[int], List[int], List[List[int]]]:
+    # `rows` es una matriz N×25 (respuestas en el orden de QUESTIONS). Devuelve
+    # puntos totales, % global y puntos por área con las mismas reglas que
+    # `_compute_scores`.
+    global _CATEGORY_ONEHOT
+    max_points = len(QUESTIONS) * 5
+    if engine == "numpy":
+        if _CATEGORY_ONEHOT is None:
+            onehot = np.zeros((len(QUESTIONS), len(CATEGORY_ORDER)), dtype=np.int32)
+            onehot[np.arange(len(QUESTIONS)), _CATEGORY_INDEX] = 1
+            _CATEGORY_ONEHOT = onehot
+        matrix = np.asarray(rows, dtype=np.int32).reshape(-1, len(QUESTIONS))
+        totals = matrix.sum(axis=1)
+        # np.rint redondea al par más cercano, igual que `round`.
+        pcts = np.rint(totals / max_points * 100).astype(np.int32)
+        return totals.tolist(), pcts.tolist(), (matrix @ _CATEGORY_ONEHOT).tolist()
+
+    totals: List[int] = []
+    pcts: List[int] = []
+    points: List[List[int]] = []
+    for values in rows:
+        per_category = [0] * len(CATEGORY_ORDER)
+        for column, value in zip(_CATEGORY_INDEX, values):
+            per_category[column] += value
+        total = sum(values)
+        totals.append(total)
+        pcts.append(round((total / max_points) * 100))
+        points.append(per_category)
+    return totals, pcts, points
+
+
+def _bulk_format(stream, fmt: str) -> str:
+    if fmt != "auto":
+        return fmt
+    return "jsonl" if str(getattr(stream, "name", "")).endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def _bulk_rows(stream, *, fmt: str):
+    # (línea, fila) sin cargar el archivo completo; las filas JSONL inválidas
+    # se devuelven como texto de error.
+    if fmt == "jsonl":
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield line_no, "JSON inválido."
+                continue
+            yield line_no, row if isinstance(row, dict) else "Se esperaba un objeto JSON."
+        return
+    for line_no, row in enumerate(csv.DictReader(stream), start=2):
+        yield line_no, row
+
+
+def _interpretation_static(total_pct: int) -> Dict[str, str]:
+    level = _interpretation_level(total_pct)
+    if level == "Alto":
+        message = (
+            "Tu empresa muestra bases sólidas. Prioriza mantener disciplina de seguimiento y mejorar con datos."
+        )
+    elif level == "Medio":
+        message = (
+            "Hay avances, pero existen brechas. Enfócate en 2–3 áreas con menor puntaje para crear un plan trimestral."
+        )
+    else:
+        message = "Hay oportunidades importantes. Empieza por clarificar estrategia, ordenar finanzas y definir procesos mínimos."
+    return {"level": level, "message": message}
+
+
+def _interpretation(
+    total_pct: int,
+    *,
+    by_category: Dict[str, Dict[str, int]] | None = None,
+    api_key: str,
+    base_url: str,
+    model: str,
+    api_mode: str,
+    timeout_seconds: int,
+    deadline: _Deadline | None = None,
+    cache: _AICache,
+    debug: bool,
+) -> Tuple[Dict[str, str], str | None]:
+    static = _interpretation_static(total_pct)
+    if not api_key:
+        return static, None
+
+    by_category = by_category or {}
+    try:
+        msg, err = _maybe_ai_interpretation_message(
+            api_key=api_key,
+            base_url=base_url,
+            model=model,
+            api_mode=api_mode,
+            timeout_seconds=timeout_seconds,
+            deadline=deadline,
+            total_pct=total_pct,
+            level=static["level"],
+            by_category=by_category,
+            cache=cache,
+        )
+    except Exception as e:
+        if debug:
+            return static, f"No se pudo generar interpretación con IA ({type(e).__name__})."
+        return static, None
+
+    if msg:
+        return {"level": static["level"], "message": msg}, None
+    if err and debug:
+        return static, f"No se pudo generar interpretación con IA ({err})."
+    return static, None
+
+
+def _maybe_ai_combined(
+    *,
+    api_key: str,
+    base_url: str,
+    model: str,
+    api_mode: str,
+    timeout_seconds: int,
+    deadline: _Deadline | None = None,
+    total_pct: int,
+    by_category: Dict[str, Dict[str, int]],
+    answers: Dict[str, int],
+    cache: _AICache,
+    debug: bool,
+    payload_mode: str = "full",
+    on_field: Callable[[str, object], None] | None = None,
+) -> Tuple[Tuple[Dict[str, object] | None, str | None, str | None], Tuple[Dict[str, str], str | None]]:
+    # Plan e interpretación en una sola llamada. Devuelve lo mismo que
+    # `_maybe_ai_result` y `_interpretation`; sólo si la salida combinada viene
+    # mal formada se recurre a las dos llamadas separadas.
+    static = _interpretation_static(total_pct)
+    if not api_key:
+        return (None, None, None), (static, None)
+
+    payload = _ai_result_payload(
+        total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=payload_mode
+    )
+    ai_key = _ai_result_cache_key(payload, payload_mode=payload_mode)
+    interp_key = _interpretation_cache_key(
+        _interpretation_payload(total_pct=total_pct, level=static["level"], by_category=by_category)
+    )
+    common = {
+        "api_key": api_key,
+        "base_url": base_url,
+        "model": model,
+        "api_mode": api_mode,
+        "timeout_seconds": timeout_seconds,
+        "deadline": deadline,
+        "by_category": by_category,
+        "cache": cache,
+        "debug": debug,
+    }
+    cached_ai = cache.get(ai_key)
+    cached_msg = cache.get(interp_key)
+    has_ai = isinstance(cached_ai, dict)
+    has_msg = isinstance(cached_msg, str) and bool(cached_msg.strip())
+    if has_ai or has_msg:
+        # Sólo falta una parte: basta con su llamada individual (o ninguna).
+        return (
+            _maybe_ai_result(
+                total_pct=total_pct, answers=answers, payload_mode=payload_mode, on_field=on_field, **common
+            ),
+            _interpretation(total_pct, **common),
+        )
+
+    system, user = _insights_prompt(payload, with_message=True, payload_mode=payload_mode)
+
+    settings = _task_settings("insights", model=model, timeout_seconds=timeout_seconds)
+
+    def generate() -> Tuple[str | None, str | None]:
+        _PROMPT_BUDGET.record("combinado", system, user)
+        return _openai_text(
+            api_key=api_key,
+            base_url=base_url,
+            model=settings.model,
+            api_mode=api_mode,
+            system=system,
+            user=user,
+            timeout_seconds=settings.timeout_seconds,
+            temperature=settings.temperature,
+            max_output_tokens=settings.max_output_tokens,
+            deadline=deadline,
+            on_delta=_JSONFieldStream(on_field).feed if on_field is not None else None,
+        )
+
+    def cached_both() -> Tuple[str, None] | None:
+        # Otro proceso ya completó la llamada combinada: se reconstruye su salida.
+        ai, msg = cache.get(ai_key), cache.get(interp_key)
+        if isinstance(ai, dict) and isinstance(msg, str) and msg.strip():
+            return json.dumps(dict(ai, message=msg), ensure_ascii=False), None
+        return None
+
+    try:
+        raw_text, err = _SINGLE_FLIGHT.do(f"combined:{ai_key}", generate, cached=cached_both, deadline=deadline)
+    except Exception as e:
+        public = "No se pudo generar el plan con IA. Verifica tu configuración e inténtalo de nuevo."
+        detail = f"{type(e).__name__}: {e}"
+        return (None, public, (detail if debug else None)), (static, None)
+    if not raw_text:
+        err = err or "Sin contenido de salida desde OpenAI."
+        return (
+            (None, "No se pudo generar el plan con IA en este momento.", (err if debug else None)),
+            (static, (f"No se pudo generar interpretación con IA ({err})." if debug else None)),
+        )
+
+    parsed = _extract_json_object(raw_text)
+    normalized = _normalize_ai_output(parsed) if isinstance(parsed, dict) else None
+    msg = parsed.get("message") if isinstance(parsed, dict) else None
+    msg = msg.strip() if isinstance(msg, str) else ""
+    if normalized is None or not msg:
+        return (
+            _maybe_ai_result(
+                total_pct=total_pct, answers=answers, payload_mode=payload_mode, on_field=on_field, **common
+            ),
+            _interpretation(total_pct, **common),
+        )
+
+    cache.set(ai_key, normalized)
+    cache.set(interp_key, msg)
+    return (normalized, None, None), ({"level": static["level"], "message": msg}, None)
+
+
+def _band_pct(pct: int, band: int) -> int:
+    # Porcentaje redondeado a la banda más cercana (band <= 1: sin cambios).
+    if band <= 1:
+        return int(pct)
+    return min(100, int(pct / band + 0.5) * band)
+
+
+class _ProfileGranularity(_SQLiteStore):
+    # Granularidad de los payloads de IA y métricas de acierto de caché
+    # simuladas para varias granularidades a la vez. Una granularidad es
+    # "banda:preguntas": banda de redondeo de porcentajes y cuántas preguntas
+    # más débiles/fuertes entran al payload. Por cada envío se calcula la llave
+    # que tendría con cada granularidad y se anota si ya se había visto dentro
+    # del TTL del caché, para comparar antes de cambiar la configuración. Lo
+    # alimenta el hilo escritor de `_SubmissionLog`, fuera del request.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS ai_profile_seen (
+        kind TEXT NOT NULL,
+        granularity TEXT NOT NULL,
+        key TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (kind, granularity, key)
+    );
+    CREATE TABLE IF NOT EXISTS ai_profile_stats (
+        kind TEXT NOT NULL,
+        granularity TEXT NOT NULL,
+        hits INTEGER NOT NULL,
+        misses INTEGER NOT NULL,
+        PRIMARY KEY (kind, granularity)
+    );
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        pct_band: int,
+        top_questions: int,
+        stats_granularities: List[Tuple[int, int]],
+        ttl_seconds: int,
+    ) -> None:
+        super().__init__(path)
+        self.pct_band = pct_band
+        self.top_questions = top_questions
+        self.stats_granularities = stats_granularities
+        self.ttl_seconds = ttl_seconds
+        self._writes = 0
+
+    @property
+    def active(self) -> str:
+        return f"{max(1, self.pct_band)}:{self.top_questions}"
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and bool(self.stats_granularities)
+
+    def add(self, rows: List[Tuple[int, bytes]]) -> None:
+        keys: List[Tuple[str, str, str]] = []
+        for _, packed in rows:
+            answers = dict(zip((q.id for q in QUESTIONS), packed))
+            _, total_pct, by_category = _compute_scores(answers)
+            level = _interpretation_level(total_pct)
+            for band, top in self.stats_granularities:
+                plan_payload = _ai_result_payload(
+                    total_pct=total_pct, by_category=by_category, answers=answers, pct_band=band, top_questions=top
+                )
+                interp_payload = _interpretation_payload(
+                    total_pct=total_pct, level=level, by_category=by_category, pct_band=band
+                )
+                keys.append(("plan", f"{band}:{top}", _ai_result_cache_key(plan_payload)))
+                keys.append(("interpretation", f"{band}:{top}", _interpretation_cache_key(interp_payload)))
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                for kind, granularity, key in keys:
+                    row = conn.execute(
+                        "SELECT expires_at FROM ai_profile_seen WHERE kind = ? AND granularity = ? AND key = ?",
+                        (kind, granularity, key),
+                    ).fetchone()
+                    hit = row is not None and row[0] > now
+                    if not hit:
+                        conn.execute(
+                            "INSERT OR REPLACE INTO ai_profile_seen (kind, granularity, key, expires_at) "
+                            "VALUES (?, ?, ?, ?)",
+                            (kind, granularity, key, now + self.ttl_seconds),
+                        )
+                    conn.execute(
+                        "INSERT INTO ai_profile_stats (kind, granularity, hits, misses) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (kind, granularity) DO UPDATE SET hits = hits + excluded.hits, "
+                        "misses = misses + excluded.misses",
+                        (kind, granularity, int(hit), int(not hit)),
+                    )
+                self._writes += 1
+                if self._writes % 20 == 1:
+                    conn.execute("DELETE FROM ai_profile_seen WHERE expires_at <= ?", (now,))
+        except sqlite3.Error:
+            return
+
+    def stats(self) -> List[Tuple[str, str, int, int]]:
+        return self._conn().execute(
+            "SELECT kind, granularity, hits, misses FROM ai_profile_stats ORDER BY kind, granularity"
+        ).fetchall()
+
+    def reset(self) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM ai_profile_stats")
+        conn.execute("DELETE FROM ai_profile_seen")
+
+
+def _parse_granularities(raw: str) -> List[Tuple[int, int]]:
+    # "1:5,10:3,20" -> [(1, 5), (10, 3), (20, 5)]; preguntas entre 1 y 5.
+    out: List[Tuple[int, int]] = []
+    for item in raw.split(","):
+        band, _, top = item.strip().partition(":")
+        if band.strip():
+            out.append((max(1, int(band)), max(1, min(5, int(top or 5)))))
+    return out
+
+
+_GRANULARITY = _ProfileGranularity("", pct_band=1, top_questions=5, stats_granularities=[], ttl_seconds=7 * 24 * 3600)
+
+
+def _interpretation_payload(
+    *, total_pct: int, level: str, by_category: Dict[str, Dict[str, int]], pct_band: int | None = None
+) -> Dict[str, object]:
+    band = _GRANULARITY.pct_band if pct_band is None else pct_band
+    return {
+        "total_pct": _band_pct(int(total_pct), band),
+        "level": str(level),
+        "by_category": {k: {"pct": _band_pct(int(v.get("pct", 0)), band)} for k, v in by_category.items()},
+    }
+
+
+def _interpretation_cache_key(payload: Dict[str, object]) -> str:
+    return f"ai_interp_v3:{_stable_hash([_INTERPRETATION_PROMPT.digest, payload])}"
+
+
+def _ai_result_payload(
+    *,
+    total_pct: int,
+    by_category: Dict[str, Dict[str, int]],
+    answers: Dict[str, int],
+    pct_band: int | None = None,
+    top_questions: int | None = None,
+    payload_mode: str = "full",
+) -> Dict[str, object]:
+    # Con bandas (`AI_CACHE_PCT_BAND` > 1) los porcentajes se redondean a la
+    # banda y se omiten los puntos exactos; `AI_CACHE_TOP_QUESTIONS` < 5 reduce
+    # las preguntas más débiles/fuertes incluidas. Así perfiles casi iguales
+    # comparten prompt y llave de caché. Los empates se rompen siempre por el
+    # orden del cuestionario para que el payload no dependa del orden de entrada.
+    band = _GRANULARITY.pct_band if pct_band is None else pct_band
+    top = _GRANULARITY.top_questions if top_questions is None else top_questions
+
+    def area(category: str, v: Dict[str, int]) -> Dict[str, int]:
+        if band > 1:
+            return {"pct": _band_pct(int(v["pct"]), band), "max": int(v["max"])}
+        return {"points": int(v["points"]), "pct": int(v["pct"]), "max": int(v["max"])}
+
+    def category_rank(category: str) -> int:
+        return CATEGORY_ORDER.index(category) if category in CATEGORY_ORDER else len(CATEGORY_ORDER)
+
+    categories_ranked = sorted(
+        ({"category": k, **area(k, v)} for k, v in by_category.items()),
+        key=lambda x: (x["pct"], category_rank(x["category"])),
+    )
+
+    questions_payload: List[Dict[str, object]] = []
+    for q in QUESTIONS:
+        questions_payload.append(
+            {
+                "id": q.id,
+                "category": q.category,
+                "text": q.text,
+                "value": int(answers.get(q.id, 0)),
+            }
+        )
+    position = {q.id: i for i, q in enumerate(QUESTIONS)}
+    weakest_questions_full = sorted(questions_payload, key=lambda x: (x["value"], position[x["id"]]))[:top]
+    strongest_questions_full = sorted(questions_payload, key=lambda x: (-x["value"], position[x["id"]]))[:top]
+
+    def drop_value(items: List[Dict[str, object]]) -> List[Dict[str, object]]:
+        out: List[Dict[str, object]] = []
+        for it in items:
+            out.append({"id": it.get("id", ""), "category": it.get("category", ""), "text": it.get("text", "")})
+        return out
+
+    weakest_questions = drop_value(weakest_questions_full)
     strongest_questions = drop_value(strongest_questions_full)
 
+    # Sólo la parte dinámica; los bloques fijos (marca, definiciones, escala)
+    # van precompilados en `_INSIGHTS_PROMPTS` (ver `_scoring_json`).
     payload = {
-        "brand": {
-            "company": "Consilium",
-            "service": "Consilium",
-            "positioning": (
-                "Acompañamiento contable y fiscal para dueños de PyMEs: orden, cumplimiento y claridad para decidir."
-            ),
-        },
-        "total_pct": total_pct,
+        "total_pct": _band_pct(total_pct, band),
         "interpretation": _interpretation_static(total_pct),
-        "by_category": {
-            k: {"points": int(v["points"]), "pct": int(v["pct"]), "max": int(v["max"])}
-            for k, v in by_category.items()
-        },
+        "by_category": {k: area(k, v) for k, v in by_category.items()},
         "categories_ranked_low_to_high": categories_ranked,
         "weakest_areas": categories_ranked[:2],
-        "strongest_areas": sorted(categories_ranked, key=lambda x: x["pct"], reverse=True)[:2],
+        "strongest_areas": sorted(categories_ranked, key=lambda x: (-x["pct"], category_rank(x["category"])))[:2],
         "questions": {
             "weakest_5": weakest_questions,
             "strongest_5": strongest_questions,
         },
-        "category_definitions": {
-            "Dirección y Estrategia": "Claridad de rumbo, objetivos, seguimiento y delegación.",
-            "Finanzas": "Contabilidad al día, costos, márgenes, flujo de efectivo, presupuesto y control.",
-            "Operaciones / Procesos": "Procesos definidos, estándares, medición e iniciativas de mejora.",
-            "Comercial (Ventas / Marketing)": "Prospección, conversión, seguimiento y consistencia comercial.",
-            "RH (Personas y Cultura)": "Roles claros, contratación/inducción, desempeño y clima.",
-        },
-        "scale": {
-            "min": 1,
-            "max": 5,
-            "labels": [{"value": v, "label": lbl} for v, lbl in SCALE],
-            "questions_per_area": 5,
-            "max_points_per_area": 25,
-        },
-        "areas_expected": [
-            "Dirección y Estrategia",
-            "Finanzas",
-            "Operaciones / Procesos",
-            "Comercial (Ventas / Marketing)",
-            "RH (Personas y Cultura)",
+    }
+    return _compact_scoring(payload) if payload_mode == "compact" else payload
+
+
+def _compact_scoring(payload: Dict[str, object]) -> Dict[str, object]:
+    # `AI_PAYLOAD_MODE=compact`: las áreas van una sola vez (ordenadas, sólo
+    # con %; las más débiles/fuertes son los extremos de la lista), la
+    # interpretación sólo con su nivel y las preguntas sin id.
+    return {
+        "total_pct": payload["total_pct"],
+        "level": payload["interpretation"]["level"],
+        "categories_ranked_low_to_high": [
+            {"category": a["category"], "pct": a["pct"]} for a in payload["categories_ranked_low_to_high"]
         ],
+        "questions": {
+            k: [{"category": q["category"], "text": q["text"]} for q in items]
+            for k, items in payload["questions"].items()
+        },
     }
 
-    cache_key = f"ai_v5:{_stable_hash(payload)}"
-    cached = session.get(cache_key)
-    if isinstance(cached, dict):
-        return cached, None, None
 
-    try:
-        ai, err = _generate_ai_insights(
-            api_key=api_key,
-            base_url=base_url,
-            model=model,
-            api_mode=api_mode,
-            timeout_seconds=timeout_seconds,
-            scoring_payload=payload,
-        )
-    except Exception as e:
-        public = "No se pudo generar el plan con IA. Verifica tu configuración e inténtalo de nuevo."
-        detail = f"{type(e).__name__}: {e}"
-        return None, public, (detail if debug else None)
+def _ai_result_cache_key(payload: Dict[str, object], *, payload_mode: str = "full") -> str:
+    # El digest de la plantilla cubre el prompt y los bloques fijos del scoring:
+    # si cambian, cambian las llaves.
+    template = _INSIGHTS_PROMPTS[(payload_mode, False)]
+    return f"ai_v7:{_stable_hash([template.digest, payload])}"
+
+
+def _maybe_ai_interpretation_message(
+    *,
+    api_key: str,
+    base_url: str,
+    model: str,
+    api_mode: str,
+    timeout_seconds: int,
+    deadline: _Deadline | None = None,
+    total_pct: int,
+    level: str,
+    by_category: Dict[str, Dict[str, int]],
+    cache: _AICache,
+) -> Tuple[str | None, str | None]:
+    payload = _interpretation_payload(total_pct=total_pct, level=level, by_category=by_category)
+
+    cache_key = _interpretation_cache_key(payload)
+    cached = cache.get(cache_key)
+    if isinstance(cached, str) and cached.strip():
+        return cached.strip(), None
+
+    system, user = _interpretation_prompt(payload)
+
+    settings = _task_settings("interpretation", model=model, timeout_seconds=timeout_seconds)
+
+    def generate() -> Tuple[str | None, str | None]:
+        _PROMPT_BUDGET.record("interpretación", system, user)
+        raw_text, err = _openai_text(
+            api_key=api_key,
+            base_url=base_url,
+            model=settings.model,
+            api_mode=api_mode,
+            system=system,
+            user=user,
+            timeout_seconds=settings.timeout_seconds,
+            temperature=settings.temperature,
+            max_output_tokens=settings.max_output_tokens,
+            deadline=deadline,
+        )
+        if not raw_text:
+            return None, (err or "Sin contenido de salida desde OpenAI.")
+
+        parsed = _extract_json_object(raw_text)
+        if not isinstance(parsed, dict):
+            return None, "No se pudo parsear JSON desde la respuesta del modelo."
+
+        msg = parsed.get("message")
+        msg = msg.strip() if isinstance(msg, str) else ""
+        if not msg:
+            return None, "La respuesta JSON no incluye 'message'."
+
+        cache.set(cache_key, msg)
+        return msg, None
+
+    def cached_message() -> Tuple[str, None] | None:
+        value = cache.get(cache_key)
+        return (value.strip(), None) if isinstance(value, str) and value.strip() else None
+
+    return _SINGLE_FLIGHT.do(cache_key, generate, cached=cached_message, deadline=deadline)
+
+
+def _maybe_ai_result(
+    *,
+    api_key: str,
+    base_url: str,
+    model: str,
+    api_mode: str,
+    timeout_seconds: int,
+    deadline: _Deadline | None = None,
+    total_pct: int,
+    by_category: Dict[str, Dict[str, int]],
+    answers: Dict[str, int],
+    cache: _AICache,
+    debug: bool,
+    payload_mode: str = "full",
+    on_field: Callable[[str, object], None] | None = None,
+) -> Tuple[Dict[str, object] | None, str | None, str | None]:
+    if not api_key:
+        return None, None, None
+
+    payload = _ai_result_payload(
+        total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=payload_mode
+    )
+
+    cache_key = _ai_result_cache_key(payload, payload_mode=payload_mode)
+    cached = cache.get(cache_key)
+    if isinstance(cached, dict):
+        return cached, None, None
+    def generate() -> Tuple[Dict[str, object] | None, str | None]:
+        ai, err = _generate_ai_insights(
+            api_key=api_key,
+            base_url=base_url,
+            model=model,
+            api_mode=api_mode,
+            timeout_seconds=timeout_seconds,
+            deadline=deadline,
+            scoring_payload=payload,
+            payload_mode=payload_mode,
+            on_field=on_field,
+        )
+        if ai is not None:
+            cache.set(cache_key, ai)
+        return ai, err
+
+    def cached_result() -> Tuple[Dict[str, object], None] | None:
+        value = cache.get(cache_key)
+        return (value, None) if isinstance(value, dict) else None
+
+    try:
+        ai, err = _SINGLE_FLIGHT.do(cache_key, generate, cached=cached_result, deadline=deadline)
+    except Exception as e:
+        public = "No se pudo generar el plan con IA. Verifica tu configuración e inténtalo de nuevo."
+        detail = f"{type(e).__name__}: {e}"
+        return None, public, (detail if debug else None)
+
+    if err:
+        public = "No se pudo generar el plan con IA en este momento."
+        return None, public, (err if debug else None)
+    return ai, None, None
+
+
+@dataclass(frozen=True)
+class _PromptTemplate:
+    # Prompt precompilado al importar: texto fijo más un hueco final para la
+    # parte dinámica. `digest` identifica el contenido fijo (incluidos los
+    # fragmentos JSON estáticos) y forma parte de las llaves de caché.
+    system: str
+    user_prefix: str
+    digest: str
+    static_bytes: int
+
+    @classmethod
+    def compile(cls, system: str, user_prefix: str, *fragments: str) -> _PromptTemplate:
+        # `fragments`: bloques fijos que se insertan dentro de la parte dinámica.
+        h = hashlib.blake2b(digest_size=8)
+        size = 0
+        for part in (system, user_prefix, *fragments):
+            data = part.encode("utf-8")
+            h.update(data)
+            h.update(b"\0")
+            size += len(data)
+        return cls(system=system, user_prefix=user_prefix, digest=h.hexdigest(), static_bytes=size)
+
+    def render(self, dynamic: str) -> Tuple[str, str]:
+        return self.system, self.user_prefix + dynamic
+
+
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def _estimate_tokens(text: str) -> int:
+    # Estimación sin tokenizador: ~4 caracteres por token en cada palabra y un
+    # token por signo. Sirve para comparar prompts, no para facturar.
+    tokens = 0
+    for match in _TOKEN_PIECES.finditer(text):
+        piece = match.group(0)
+        tokens += (len(piece) + 3) // 4 if (piece[0].isalnum() or piece[0] == "_") else 1
+    return tokens
+
+
+class _PromptBudget(_SQLiteStore):
+    # Registro, por tipo de prompt, del tamaño estimado de cada llamada enviada
+    # al modelo y de cuántas excedieron `OPENAI_PROMPT_TOKEN_BUDGET`.
+    _schema = """
+    CREATE TABLE IF NOT EXISTS prompt_sizes (
+        name TEXT PRIMARY KEY,
+        calls INTEGER NOT NULL,
+        tokens_total INTEGER NOT NULL,
+        tokens_max INTEGER NOT NULL,
+        over_budget INTEGER NOT NULL
+    );
+    """
+
+    def __init__(self, path: str, *, budget_tokens: int) -> None:
+        super().__init__(path)
+        self.budget_tokens = budget_tokens
+
+    def record(self, name: str, system: str, user: str) -> int:
+        tokens = _estimate_tokens(system) + _estimate_tokens(user)
+        over = int(0 < self.budget_tokens < tokens)
+        try:
+            self._conn().execute(
+                "INSERT INTO prompt_sizes (name, calls, tokens_total, tokens_max, over_budget) "
+                "VALUES (?, 1, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET calls = calls + 1, "
+                "tokens_total = tokens_total + excluded.tokens_total, "
+                "tokens_max = MAX(tokens_max, excluded.tokens_max), over_budget = over_budget + excluded.over_budget",
+                (name, tokens, tokens, over),
+            )
+        except sqlite3.Error:
+            pass
+        return tokens
+
+    def stats(self) -> List[Tuple[str, int, int, int, int]]:
+        try:
+            return self._conn().execute(
+                "SELECT name, calls, tokens_total, tokens_max, over_budget FROM prompt_sizes ORDER BY name"
+            ).fetchall()
+        except sqlite3.Error:
+            return []
+
+    def reset(self) -> None:
+        self._conn().execute("DELETE FROM prompt_sizes")
+
+
+_PROMPT_BUDGET = _PromptBudget("", budget_tokens=0)
 
-    if ai is not None:
-        session[cache_key] = ai
-    if err:
-        public = "No se pudo generar el plan con IA en este momento."
-        return None, public, (err if debug else None)
-    return ai, None, None
 
+# Bloques fijos del scoring que recibe el modelo, serializados una sola vez.
+# `_scoring_json` los intercala con la parte dinámica en el mismo orden y
+# formato que `json.dumps` del payload completo.
+_SCORING_STATIC: Dict[str, object] = {
+    "brand": {
+        "company": "Consilium",
+        "service": "Consilium",
+        "positioning": (
+            "Acompañamiento contable y fiscal para dueños de PyMEs: orden, cumplimiento y claridad para decidir."
+        ),
+    },
+    "category_definitions": {
+        "Dirección y Estrategia": "Claridad de rumbo, objetivos, seguimiento y delegación.",
+        "Finanzas": "Contabilidad al día, costos, márgenes, flujo de efectivo, presupuesto y control.",
+        "Operaciones / Procesos": "Procesos definidos, estándares, medición e iniciativas de mejora.",
+        "Comercial (Ventas / Marketing)": "Prospección, conversión, seguimiento y consistencia comercial.",
+        "RH (Personas y Cultura)": "Roles claros, contratación/inducción, desempeño y clima.",
+    },
+    "scale": {
+        "min": 1,
+        "max": 5,
+        "labels": [{"value": v, "label": lbl} for v, lbl in SCALE],
+        "questions_per_area": 5,
+        "max_points_per_area": 25,
+    },
+    "areas_expected": [
+        "Dirección y Estrategia",
+        "Finanzas",
+        "Operaciones / Procesos",
+        "Comercial (Ventas / Marketing)",
+        "RH (Personas y Cultura)",
+    ],
+}
 
-def _generate_ai_insights(
-    *,
-    api_key: str,
-    base_url: str,
-    model: str,
-    api_mode: str,
-    timeout_seconds: int,
-    scoring_payload: Dict[str, object],
-) -> Tuple[Dict[str, object] | None, str | None]:
+_SCORING_STATIC_JSON: Dict[str, str] = {
+    k: f"{json.dumps(k)}: {json.dumps(v, ensure_ascii=False)}" for k, v in _SCORING_STATIC.items()
+}
+
+
+# En modo compacto se omiten la escala (no se envían puntajes 1–5) y la lista
+# de áreas esperadas (ya están en el ranking).
+_SCORING_STATIC_KEYS: Dict[str, Tuple[str, ...]] = {
+    "full": ("category_definitions", "scale", "areas_expected"),
+    "compact": ("category_definitions",),
+}
+
+_SCORING_JSON_PARTS: Dict[str, Tuple[str, str]] = {
+    mode: (
+        "{" + _SCORING_STATIC_JSON["brand"] + ", ",
+        ", " + ", ".join(_SCORING_STATIC_JSON[k] for k in keys) + "}",
+    )
+    for mode, keys in _SCORING_STATIC_KEYS.items()
+}
+
+
+def _scoring_json(payload: Dict[str, object], *, payload_mode: str = "full") -> str:
+    # Sólo se serializa la parte dinámica (un solo `json.dumps`, sin llaves) y
+    # se coloca entre la marca y el resto de los bloques fijos.
+    head, tail = _SCORING_JSON_PARTS[payload_mode]
+    return head + json.dumps(payload, ensure_ascii=False)[1:-1] + tail
+
+
+def _interpretation_prompt(payload: Dict[str, object]) -> Tuple[str, str]:
+    return _INTERPRETATION_PROMPT.render(
+        f"- Índice global: {payload['total_pct']}%\n"
+        f"- Nivel: {payload['level']}\n"
+        f"- Porcentaje por área (si existe): {json.dumps(payload['by_category'], ensure_ascii=False)}\n"
+    )
+
+
+def _insights_prompt(
+    scoring_payload: Dict[str, object], *, with_message: bool = False, payload_mode: str = "full"
+) -> Tuple[str, str]:
+    return _INSIGHTS_PROMPTS[(payload_mode, with_message)].render(
+        _scoring_json(scoring_payload, payload_mode=payload_mode)
+    )
+
+
+def _compile_insights_prompt(*, with_message: bool, payload_mode: str) -> _PromptTemplate:
+    # `with_message` pide además la interpretación ejecutiva en el mismo JSON
+    # (modo combinado: una sola llamada por envío).
     system = (
         "Eres un consultor de mejora empresarial y ventas consultivas de Consilium. "
         "Tu prioridad es ser específico: decir qué falta, dónde está el riesgo y cómo lo resolvemos. "
@@ -584,7 +3721,8 @@ def _generate_ai_insights(
         "y cómo Consilium los ayuda. NO des un plan de acción todavía.\n\n"
         "Devuelve SOLO un JSON válido (sin markdown) con esta forma exacta:\n"
         "{\n"
-        '  "titulo": string,\n'
+        + ('  "message": string,\n' if with_message else "")
+        + '  "titulo": string,\n'
         '  "diagnostico_en_una_frase": string,\n'
         '  "problema_principal": string,\n'
         '  "lo_que_te_esta_doliendo": string,\n'
@@ -601,7 +3739,13 @@ def _generate_ai_insights(
         "- NO incluyas puntajes 1–5 ni anotaciones tipo \"(1)\"; solo porcentajes (%).\n"
         "- NO incluyas pasos, cronogramas, ni planes de 30/90 días.\n"
         "- NO uses markdown.\n\n"
-        "Hazlo preciso (obligatorio):\n"
+        + (
+            '- En "message", escribe una interpretación ejecutiva del prediagnóstico (1–2 frases), '
+            "consultiva y concreta, sin alarmismo, sin promesas, sin pasos y sin mencionar 'IA'.\n\n"
+            if with_message
+            else ""
+        )
+        + "Hazlo preciso (obligatorio):\n"
         '- En "problema_principal", menciona explícitamente las 2 áreas más bajas con su % y 1–2 de las preguntas más bajas (usa su texto tal cual o muy cercano).\n'
         '- En "lo_que_te_esta_doliendo", describe 2 consecuencias concretas de esas brechas (ej.: decisiones a ciegas, fugas de efectivo, estrés por cierres/obligaciones, riesgo de recargos), sin alarmismo.\n'
         '- En "como_ayudamos_consilium", conecta directamente esas brechas con 2–3 acciones/entregables concretos (ej.: contabilidad al día y conciliaciones; calendario de obligaciones; reportes mensuales de resultados/flujo; controles mínimos de facturación/gastos). No uses palabras genéricas como "optimizar" o "mejorar" sin explicar qué entregamos.\n'
@@ -613,21 +3757,70 @@ def _generate_ai_insights(
         "Cómo interpretar el scoring:\n"
         "- Las áreas y preguntas más bajas representan fricción, riesgo y decisiones a ciegas.\n"
         "- Conecta el problema con consecuencias reales (estrés, falta de control, multas/recargos, fugas de efectivo) sin alarmismo.\n\n"
-        f"SCORING:\n{json.dumps(scoring_payload, ensure_ascii=False)}"
+        "SCORING:\n"
     )
+    fragments = [_SCORING_STATIC_JSON["brand"], *(_SCORING_STATIC_JSON[k] for k in _SCORING_STATIC_KEYS[payload_mode])]
+    return _PromptTemplate.compile(system, user, *fragments)
+
+
+_INSIGHTS_PROMPTS: Dict[Tuple[str, bool], _PromptTemplate] = {
+    (mode, with_message): _compile_insights_prompt(with_message=with_message, payload_mode=mode)
+    for mode in _SCORING_STATIC_KEYS
+    for with_message in (False, True)
+}
+
+_INTERPRETATION_PROMPT = _PromptTemplate.compile(
+    (
+        "Eres un consultor de Consilium. "
+        "Escribes interpretaciones ejecutivas breves, claras y accionables. "
+        "Responde en español. No inventes datos."
+    ),
+    (
+        "Genera una interpretación ejecutiva (1–2 frases) del prediagnóstico. "
+        "Debe sonar consultiva y concreta, sin alarmismo, sin promesas, y sin pasos. "
+        "No menciones 'IA'.\n\n"
+        "Devuelve SOLO un JSON válido (sin markdown) con esta forma exacta:\n"
+        '{ "message": string }\n\n'
+        "Contexto:\n"
+    ),
+)
+
+
+def _generate_ai_insights(
+    *,
+    api_key: str,
+    base_url: str,
+    model: str,
+    api_mode: str,
+    timeout_seconds: int,
+    deadline: _Deadline | None = None,
+    scoring_payload: Dict[str, object],
+    payload_mode: str = "full",
+    on_field: Callable[[str, object], None] | None = None,
+) -> Tuple[Dict[str, object] | None, str | None]:
+    system, user = _insights_prompt(scoring_payload, payload_mode=payload_mode)
+    _PROMPT_BUDGET.record("plan", system, user)
+    settings = _task_settings("insights", model=model, timeout_seconds=timeout_seconds)
 
     raw_text, err = _openai_text(
         api_key=api_key,
         base_url=base_url,
-        model=model,
+        model=settings.model,
         api_mode=api_mode,
         system=system,
         user=user,
-        timeout_seconds=timeout_seconds,
+        timeout_seconds=settings.timeout_seconds,
+        temperature=settings.temperature,
+        max_output_tokens=settings.max_output_tokens,
+        deadline=deadline,
+        on_delta=_JSONFieldStream(on_field).feed if on_field is not None else None,
     )
     if not raw_text:
         return None, (err or "Sin contenido de salida desde OpenAI.")
+    return _parse_ai_insights(raw_text)
+
 
+def _parse_ai_insights(raw_text: str) -> Tuple[Dict[str, object] | None, str | None]:
     parsed = _extract_json_object(raw_text)
     if parsed is None:
         return None, "No se pudo parsear JSON desde la respuesta del modelo."
@@ -638,6 +3831,23 @@ def _generate_ai_insights(
     return normalized, None
 
 
+@dataclass(frozen=True)
+class _TaskSettings:
+    model: str
+    timeout_seconds: int
+    temperature: float
+    max_output_tokens: int
+
+
+# Ajustes por tarea ("interpretation", "insights"); se llenan en `create_app`.
+# Sin entrada para la tarea se usan el modelo y timeout recibidos, sin tope de salida.
+_OPENAI_TASKS: Dict[str, _TaskSettings] = {}
+
+
+def _task_settings(task: str, *, model: str, timeout_seconds: int) -> _TaskSettings:
+    return _OPENAI_TASKS.get(task) or _TaskSettings(model, timeout_seconds, 0.3, 0)
+
+
 def _openai_text(
     *,
     api_key: str,
@@ -647,33 +3857,70 @@ def _openai_text(
     system: str,
     user: str,
     timeout_seconds: int,
+    deadline: _Deadline | None = None,
+    on_delta: Callable[[str], None] | None = None,
+    temperature: float = 0.3,
+    max_output_tokens: int = 0,
 ) -> Tuple[str | None, str | None]:
     mode = (api_mode or "auto").strip().lower()
     if mode not in {"auto", "responses", "chat_completions"}:
         mode = "auto"
 
-    if mode in {"auto", "responses"}:
-        text, err = _openai_responses_text(
-            api_key=api_key,
-            base_url=base_url,
-            model=model,
-            system=system,
-            user=user,
-            timeout_seconds=timeout_seconds,
+    if deadline is not None and deadline.remaining() < _DEADLINE_MIN_ATTEMPT_SECONDS:
+        return None, _DEADLINE_EXCEEDED
+    if not _BREAKER.allow(_breaker_name(base_url)):
+        return None, "OpenAI no está respondiendo; se omitió la llamada temporalmente (circuit breaker abierto)."
+
+    # En modo auto se recuerda (por base URL y modelo, compartido entre workers)
+    # qué endpoint funciona, para no pagar el intento fallido en cada request.
+    # Al vencer el TTL se vuelve a probar /responses.
+    negotiated = _API_MODES.get(base_url, model) if mode == "auto" else None
+
+    if mode == "responses" or (mode == "auto" and negotiated != "chat_completions"):
+        text, err = _HEDGER.run(
+            f"responses:{base_url}",
+            lambda: _openai_responses_text(
+                api_key=api_key,
+                base_url=base_url,
+                model=model,
+                system=system,
+                user=user,
+                timeout_seconds=timeout_seconds,
+                temperature=temperature,
+                max_output_tokens=max_output_tokens,
+                deadline=deadline,
+                on_delta=on_delta,
+            ),
+            hedge=on_delta is None,
         )
         if text:
+            if mode == "auto" and negotiated != "responses":
+                _API_MODES.set(base_url, model, "responses")
             return text, None
         if mode == "responses" or not _should_fallback_to_chat(err):
             return None, err
+        if deadline is not None and deadline.remaining() < _DEADLINE_MIN_ATTEMPT_SECONDS:
+            return None, err
 
-    return _openai_chat_completions_text(
-        api_key=api_key,
-        base_url=base_url,
-        model=model,
-        system=system,
-        user=user,
-        timeout_seconds=timeout_seconds,
+    text, err = _HEDGER.run(
+        f"chat:{base_url}",
+        lambda: _openai_chat_completions_text(
+            api_key=api_key,
+            base_url=base_url,
+            model=model,
+            system=system,
+            user=user,
+            timeout_seconds=timeout_seconds,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            deadline=deadline,
+            on_delta=on_delta,
+        ),
+        hedge=on_delta is None,
     )
+    if text and mode == "auto" and negotiated != "chat_completions":
+        _API_MODES.set(base_url, model, "chat_completions")
+    return text, err
 
 
 def _should_fallback_to_chat(err: str | None) -> bool:
@@ -695,6 +3942,464 @@ def _should_fallback_to_chat(err: str | None) -> bool:
     )
 
 
+class _SendFailed(Exception):
+    # Falla al enviar la petición (antes de leer cualquier byte de respuesta).
+    def __init__(self, error: BaseException) -> None:
+        super().__init__(str(error))
+        self.error = error
+
+
+class _HTTPPool:
+    # Conexiones keep-alive (http.client) reutilizables, por proceso y por host
+    # (esquema, host, puerto). Si una conexión reutilizada resulta estar cerrada
+    # por el servidor al enviar, se reintenta una vez con una conexión nueva.
+    # Una vez enviada la petición no se reintenta: el servidor pudo haberla
+    # procesado (p. ej. RemoteDisconnected al leer la respuesta de un POST).
+    _stale_errors = (BrokenPipeError, ConnectionResetError, http.client.CannotSendRequest)
+
+    def __init__(self, *, max_idle_per_host: int) -> None:
+        self.max_idle_per_host = max_idle_per_host
+        self._idle: Dict[Tuple[str, str, int], List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def post(
+        self,
+        url: str,
+        *,
+        headers: Dict[str, str],
+        data: bytes,
+        timeout: float,
+        on_line: Callable[[bytes], None] | None = None,
+    ) -> Tuple[int, bytes]:
+        return self.request("POST", url, headers=headers, data=data, timeout=timeout, on_line=on_line)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: Dict[str, str],
+        data: bytes | None,
+        timeout: float,
+        on_line: Callable[[bytes], None] | None = None,
+    ) -> Tuple[int, bytes]:
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in {"http", "https"} or not parts.hostname:
+            raise http.client.InvalidURL(f"URL no soportada: {url}")
+        key = (scheme, parts.hostname, parts.port or (443 if scheme == "https" else 80))
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        # Si el hilo corre un intento cubierto (hedging), el token permite que
+        # el intento ganador cierre esta conexión para cortar al perdedor.
+        token: _CancelToken | None = getattr(_HEDGE_SCOPE, "token", None)
+        conn, reused = self._acquire(key)
+        try:
+            return self._send(conn, key, method, target, headers, data, timeout, on_line, token)
+        except _SendFailed as exc:
+            conn.close()
+            if not reused or (token is not None and token.cancelled):
+                raise exc.error from None
+        except BaseException:
+            conn.close()
+            raise
+
+        conn = self._connect(key)
+        try:
+            return self._send(conn, key, method, target, headers, data, timeout, on_line, token)
+        except _SendFailed as exc:
+            conn.close()
+            raise exc.error from None
+        except BaseException:
+            conn.close()
+            raise
+
+    def _send(
+        self,
+        conn: http.client.HTTPConnection,
+        key: Tuple[str, str, int],
+        method: str,
+        target: str,
+        headers: Dict[str, str],
+        data: bytes | None,
+        timeout: float,
+        on_line: Callable[[bytes], None] | None,
+        token: _CancelToken | None = None,
+    ) -> Tuple[int, bytes]:
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        if token is not None:
+            token.attach(conn)
+        try:
+            try:
+                conn.request(method, target, body=data, headers=headers)
+            except self._stale_errors as exc:
+                raise _SendFailed(exc) from exc
+            if token is not None:
+                # Ya con socket conectado: si se canceló durante el connect, aborta aquí.
+                token.attach(conn)
+            resp = conn.getresponse()
+            status, raw = self._read(resp, on_line)
+        finally:
+            if token is not None:
+                token.detach()
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return status, raw
+
+    @staticmethod
+    def _read(resp: http.client.HTTPResponse, on_line: Callable[[bytes], None] | None) -> Tuple[int, bytes]:
+        # Con `on_line`, una respuesta text/event-stream se entrega línea por
+        # línea conforme llega; cualquier otra respuesta se lee completa.
+        if on_line is not None and resp.status < 400 and "event-stream" in (resp.getheader("Content-Type") or ""):
+            while True:
+                line = resp.readline()
+                if not line:
+                    break
+                on_line(line)
+            raw = b""
+        else:
+            raw = resp.read()
+        return resp.status, raw
+
+    def _acquire(self, key: Tuple[str, str, int]) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Tras un fork no se comparten sockets con el proceso padre.
+                self._idle = {}
+                self._pid = os.getpid()
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _release(self, key: Tuple[str, str, int], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _connect(self, key: Tuple[str, str, int]) -> http.client.HTTPConnection:
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        proxy = getproxies().get(scheme)
+        if proxy and not proxy_bypass(host):
+            proxy_parts = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            conn = cls(proxy_parts.hostname, proxy_parts.port or 80)
+            conn.set_tunnel(host, port)
+            return conn
+        return cls(host, port)
+
+
+_HTTP_POOL = _HTTPPool(max_idle_per_host=4)
+
+
+class _CancelToken:
+    # Permite cortar desde otro hilo una solicitud en curso: `cancel` hace
+    # shutdown del socket y la lectura bloqueada termina con error.
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._conn: http.client.HTTPConnection | None = None
+        self._lock = threading.Lock()
+
+    def attach(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            if self.cancelled:
+                raise ConnectionAbortedError("Solicitud cancelada (otro intento respondió primero).")
+            self._conn = conn
+
+    def detach(self) -> None:
+        with self._lock:
+            self._conn = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            conn = self._conn
+        if conn is not None and conn.sock is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+_HEDGE_SCOPE = threading.local()
+
+
+def _hedge_cancelled() -> bool:
+    token = getattr(_HEDGE_SCOPE, "token", None)
+    return token is not None and token.cancelled
+
+
+class _Hedger:
+    # Hedged requests: si el primer intento no respondió dentro del percentil
+    # configurado de las latencias recientes (por endpoint, en este proceso),
+    # se lanza un segundo intento idéntico y se usa el que termine primero; el
+    # otro se cancela cerrando su conexión. Los intentos extra se limitan a un
+    # porcentaje de las llamadas para no duplicar la carga cuando el proveedor
+    # está lento para todos.
+    # El primer intento corre en el hilo del request; sólo la espera y el
+    # intento extra usan un pool acotado de hilos. Con el pool saturado la
+    # espera arranca tarde y, si el primero ya terminó, no se cubre.
+    _window = 200
+    _min_samples = 20
+    _max_tokens = 10.0
+    _max_workers = 8
+
+    def __init__(self, *, enabled: bool, percentile: float, min_delay_seconds: float, budget_ratio: float) -> None:
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay_seconds = min_delay_seconds
+        self.budget_ratio = budget_ratio
+        self._latencies: Dict[str, deque] = {}
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def run(
+        self,
+        kind: str,
+        call: Callable[[], Tuple[str | None, str | None]],
+        *,
+        hedge: bool = True,
+    ) -> Tuple[str | None, str | None]:
+        if not self.enabled or not hedge:
+            return call()
+        with self._lock:
+            self._tokens = min(self._max_tokens, self._tokens + self.budget_ratio)
+        delay = self._delay(kind)
+
+        primary, extra = _CancelToken(), _CancelToken()
+        state = {"finished": False, "hedged": False}
+        state_lock = threading.Lock()
+        finished = threading.Event()
+        hedged: queue.Queue = queue.Queue()
+
+        def watch() -> None:
+            if finished.wait(delay):
+                return
+            with state_lock:
+                if state["finished"] or not self._spend():
+                    return
+                state["hedged"] = True
+            result, elapsed = self._attempt(call, extra)
+            if result[0]:
+                # El intento extra ganó: corta al primero, que sigue en el hilo del request.
+                primary.cancel()
+            hedged.put((result, elapsed))
+
+        self._pool().submit(watch)
+        result, elapsed = self._attempt(call, primary)
+        with state_lock:
+            state["finished"] = True
+        finished.set()
+        if result[0]:
+            extra.cancel()
+        elif state["hedged"]:
+            # El primero falló (o fue cortado): se usa el intento extra.
+            result, elapsed = hedged.get()
+        if result[0]:
+            self._observe(kind, elapsed)
+        return result
+
+    @staticmethod
+    def _attempt(
+        call: Callable[[], Tuple[str | None, str | None]],
+        token: _CancelToken,
+    ) -> Tuple[Tuple[str | None, str | None], float]:
+        previous = getattr(_HEDGE_SCOPE, "token", None)
+        _HEDGE_SCOPE.token = token
+        started = time.monotonic()
+        try:
+            result = call()
+        except Exception as e:
+            result = (None, f"Error inesperado hacia OpenAI: {e}")
+        finally:
+            _HEDGE_SCOPE.token = previous
+        return result, time.monotonic() - started
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Se crea perezosamente, como `_ai_executor`, para que cada worker tenga el suyo.
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="hedge")
+            return self._executor
+
+    def _delay(self, kind: str) -> float:
+        with self._lock:
+            samples = sorted(self._latencies.get(kind, ()))
+        if len(samples) < self._min_samples:
+            return self.min_delay_seconds
+        idx = min(len(samples) - 1, int(len(samples) * self.percentile / 100.0))
+        return max(self.min_delay_seconds, samples[idx])
+
+    def _observe(self, kind: str, elapsed: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=self._window)).append(elapsed)
+
+    def _spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+
+_HEDGER = _Hedger(enabled=False, percentile=95.0, min_delay_seconds=1.0, budget_ratio=0.1)
+
+
+def _openai_post_json(
+    *,
+    url: str,
+    api_key: str,
+    body: Dict[str, object],
+    timeout_seconds: float,
+    deadline: _Deadline | None = None,
+) -> Tuple[Dict[str, object] | None, str | None]:
+    data = json.dumps(body).encode("utf-8")
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+    timeout = deadline.timeout(timeout_seconds) if deadline is not None else timeout_seconds
+    if timeout <= 0:
+        return None, _DEADLINE_EXCEEDED
+    slot = _LIMITER.acquire()
+    if slot is None:
+        return None, _LIMITER_REJECTED
+    try:
+        status, raw = _HTTP_POOL.post(url, headers=headers, data=data, timeout=timeout)
+    except (OSError, http.client.HTTPException) as e:
+        # Un timeout recortado por el deadline del request no es falla del proveedor.
+        if not _hedge_cancelled() and not (isinstance(e, TimeoutError) and timeout < timeout_seconds):
+            _BREAKER.record(_breaker_name(url), ok=False)
+        return None, f"Error de red/timeout hacia OpenAI: {e}"
+    finally:
+        _LIMITER.release(slot)
+    _BREAKER.record(_breaker_name(url), ok=_upstream_healthy(status))
+    return _openai_parse_json_body(status, raw)
+
+
+def _openai_post_sse(
+    *,
+    url: str,
+    api_key: str,
+    body: Dict[str, object],
+    timeout_seconds: float,
+    deadline: _Deadline | None = None,
+    on_event: Callable[[Dict[str, object]], None],
+) -> Tuple[Dict[str, object] | None, str | None]:
+    # Igual que `_openai_post_json` pero con `stream: true`: cada evento SSE
+    # (`data: {...}`) se entrega a `on_event`. Devuelve `{}` si hubo stream, o
+    # el JSON completo si el servidor ignoró `stream` y respondió normal.
+    def on_line(line: bytes) -> None:
+        text = line.decode("utf-8", errors="replace").strip()
+        if not text.startswith("data:"):
+            return
+        data = text[5:].strip()
+        if not data or data == "[DONE]":
+            return
+        try:
+            event = json.loads(data)
+        except ValueError:
+            return
+        if isinstance(event, dict):
+            on_event(event)
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    timeout = deadline.timeout(timeout_seconds) if deadline is not None else timeout_seconds
+    if timeout <= 0:
+        return None, _DEADLINE_EXCEEDED
+    slot = _LIMITER.acquire()
+    if slot is None:
+        return None, _LIMITER_REJECTED
+    try:
+        status, raw = _HTTP_POOL.post(
+            url,
+            headers=headers,
+            data=json.dumps(dict(body, stream=True)).encode("utf-8"),
+            timeout=timeout,
+            on_line=on_line,
+        )
+    except (OSError, http.client.HTTPException) as e:
+        if not _hedge_cancelled() and not (isinstance(e, TimeoutError) and timeout < timeout_seconds):
+            _BREAKER.record(_breaker_name(url), ok=False)
+        return None, f"Error de red/timeout hacia OpenAI: {e}"
+    finally:
+        _LIMITER.release(slot)
+    _BREAKER.record(_breaker_name(url), ok=_upstream_healthy(status))
+    return _openai_parse_json_body(status, raw) if raw else ({}, None)
+
+
+def _breaker_name(url: str) -> str:
+    parts = urlsplit(url)
+    return f"openai:{parts.scheme}://{parts.netloc}"
+
+
+def _upstream_healthy(status: int) -> bool:
+    # 429 y 5xx cuentan como falla del proveedor; otros 4xx son de configuración.
+    return status < 500 and status != 429
+
+
+def _openai_parse_json_body(status: int, raw: bytes) -> Tuple[Dict[str, object] | None, str | None]:
+    if status >= 400:
+        details = raw.decode("utf-8", errors="replace").strip()
+        if len(details) > 600:
+            details = details[:600] + "…"
+        return None, f"HTTP {status} desde OpenAI. {details}"
+    try:
+        payload = json.loads(raw.decode("utf-8"))
+    except ValueError as e:
+        return None, f"Respuesta inválida (no JSON) desde OpenAI: {e}"
+    if not isinstance(payload, dict):
+        return None, "Respuesta inválida (no JSON) desde OpenAI: se esperaba un objeto."
+    return payload, None
+
+
+def _responses_body(
+    *, model: str, system: str, user: str, temperature: float, max_output_tokens: int
+) -> Dict[str, object]:
+    body: Dict[str, object] = {
+        "model": model,
+        "input": [
+            {"role": "system", "content": [{"type": "input_text", "text": system}]},
+            {"role": "user", "content": [{"type": "input_text", "text": user}]},
+        ],
+        "temperature": temperature,
+    }
+    if max_output_tokens > 0:
+        body["max_output_tokens"] = max_output_tokens
+    return body
+
+
+def _chat_body(
+    *, model: str, system: str, user: str, temperature: float, max_output_tokens: int
+) -> Dict[str, object]:
+    body: Dict[str, object] = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ],
+        "temperature": temperature,
+    }
+    if max_output_tokens > 0:
+        body["max_tokens"] = max_output_tokens
+    return body
+
+
 def _openai_responses_text(
     *,
     api_key: str,
@@ -703,43 +4408,56 @@ def _openai_responses_text(
     system: str,
     user: str,
     timeout_seconds: int,
+    temperature: float = 0.3,
+    max_output_tokens: int = 0,
+    deadline: _Deadline | None = None,
+    on_delta: Callable[[str], None] | None = None,
 ) -> Tuple[str | None, str | None]:
     url = base_url.rstrip("/") + "/responses"
-    body = {
-        "model": model,
-        "input": [
-            {"role": "system", "content": [{"type": "input_text", "text": system}]},
-            {"role": "user", "content": [{"type": "input_text", "text": user}]},
-        ],
-        "temperature": 0.3,
-    }
-    data = json.dumps(body).encode("utf-8")
-    req = Request(
-        url,
-        method="POST",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        data=data,
+    body = _responses_body(
+        model=model, system=system, user=user, temperature=temperature, max_output_tokens=max_output_tokens
     )
-    try:
-        with urlopen(req, timeout=timeout_seconds) as resp:
-            payload = json.loads(resp.read().decode("utf-8"))
-    except HTTPError as e:
-        try:
-            details = e.read().decode("utf-8", errors="replace")
-        except Exception:
-            details = ""
-        details = details.strip()
-        if len(details) > 600:
-            details = details[:600] + "…"
-        return None, f"HTTP {getattr(e, 'code', '?')} desde OpenAI. {details}"
-    except (URLError, TimeoutError) as e:
-        return None, f"Error de red/timeout hacia OpenAI: {e}"
-    except ValueError as e:
-        return None, f"Respuesta inválida (no JSON) desde OpenAI: {e}"
+    if on_delta is None:
+        payload, err = _openai_post_json(
+            url=url, api_key=api_key, body=body, timeout_seconds=timeout_seconds, deadline=deadline
+        )
+        if payload is None:
+            return None, err
+        return _responses_output_text(payload), None
+
+    chunks: List[str] = []
+    failures: List[str] = []
+
+    def on_event(event: Dict[str, object]) -> None:
+        kind = event.get("type")
+        if kind == "response.output_text.delta" and isinstance(event.get("delta"), str):
+            chunks.append(event["delta"])
+            on_delta(event["delta"])
+        elif kind in {"error", "response.failed"}:
+            failures.append(json.dumps(event, ensure_ascii=False)[:600])
+
+    payload, err = _openai_post_sse(
+        url=url,
+        api_key=api_key,
+        body=body,
+        timeout_seconds=timeout_seconds,
+        deadline=deadline,
+        on_event=on_event,
+    )
+    if payload is None:
+        return None, err
+    if failures:
+        return None, f"Error en el stream de OpenAI: {failures[0]}"
+    if payload:
+        final = _responses_output_text(payload)
+        if final:
+            on_delta(final)
+        return final, None
+    final = "".join(chunks).strip()
+    return (final or None), None
+
 
+def _responses_output_text(payload: Dict[str, object]) -> str | None:
     # Responses API: collect text chunks from output content items.
     output = payload.get("output", [])
     texts: List[str] = []
@@ -749,8 +4467,7 @@ def _openai_responses_text(
                 t = content.get("text")
                 if isinstance(t, str) and t.strip():
                     texts.append(t)
-    final = "\n".join(texts).strip() if texts else None
-    return final, None
+    return "\n".join(texts).strip() if texts else None
 
 
 def _openai_chat_completions_text(
@@ -761,43 +4478,57 @@ def _openai_chat_completions_text(
     system: str,
     user: str,
     timeout_seconds: int,
+    temperature: float = 0.3,
+    max_output_tokens: int = 0,
+    deadline: _Deadline | None = None,
+    on_delta: Callable[[str], None] | None = None,
 ) -> Tuple[str | None, str | None]:
     url = base_url.rstrip("/") + "/chat/completions"
-    body = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        "temperature": 0.3,
-    }
-    data = json.dumps(body).encode("utf-8")
-    req = Request(
-        url,
-        method="POST",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        data=data,
+    body = _chat_body(
+        model=model, system=system, user=user, temperature=temperature, max_output_tokens=max_output_tokens
     )
-    try:
-        with urlopen(req, timeout=timeout_seconds) as resp:
-            payload = json.loads(resp.read().decode("utf-8"))
-    except HTTPError as e:
-        try:
-            details = e.read().decode("utf-8", errors="replace")
-        except Exception:
-            details = ""
-        details = details.strip()
-        if len(details) > 600:
-            details = details[:600] + "…"
-        return None, f"HTTP {getattr(e, 'code', '?')} desde OpenAI. {details}"
-    except (URLError, TimeoutError) as e:
-        return None, f"Error de red/timeout hacia OpenAI: {e}"
-    except ValueError as e:
-        return None, f"Respuesta inválida (no JSON) desde OpenAI: {e}"
+    if on_delta is None:
+        payload, err = _openai_post_json(
+            url=url, api_key=api_key, body=body, timeout_seconds=timeout_seconds, deadline=deadline
+        )
+        if payload is None:
+            return None, err
+        return _chat_completion_text(payload)
+
+    chunks: List[str] = []
+
+    def on_event(event: Dict[str, object]) -> None:
+        choices = event.get("choices")
+        if not isinstance(choices, list) or not choices or not isinstance(choices[0], dict):
+            return
+        delta = choices[0].get("delta")
+        piece = delta.get("content") if isinstance(delta, dict) else None
+        if isinstance(piece, str) and piece:
+            chunks.append(piece)
+            on_delta(piece)
+
+    payload, err = _openai_post_sse(
+        url=url,
+        api_key=api_key,
+        body=body,
+        timeout_seconds=timeout_seconds,
+        deadline=deadline,
+        on_event=on_event,
+    )
+    if payload is None:
+        return None, err
+    if payload:
+        text, err = _chat_completion_text(payload)
+        if text:
+            on_delta(text)
+        return text, err
+    final = "".join(chunks).strip()
+    if not final:
+        return None, "Respuesta inesperada desde OpenAI (sin contenido)."
+    return final, None
+
 
+def _chat_completion_text(payload: Dict[str, object]) -> Tuple[str | None, str | None]:
     choices = payload.get("choices")
     if not isinstance(choices, list) or not choices:
         return None, "Respuesta inesperada desde OpenAI (sin choices)."
@@ -808,6 +4539,90 @@ def _openai_chat_completions_text(
     return content.strip(), None
 
 
+class _JSONFieldStream:
+    # Parser incremental: recibe el texto del modelo por pedazos y entrega cada
+    # campo de primer nivel del objeto JSON en cuanto su valor está completo.
+    def __init__(self, on_field: Callable[[str, object], None]) -> None:
+        self._on_field = on_field
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "key"
+        self._key: str | None = None
+        self._key_start = -1
+        self._value_start = -1
+
+    def feed(self, chunk: str) -> None:
+        self._text += chunk
+        text = self._text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key":
+                        self._key = self._decode(text[self._key_start : i + 1])
+                        self._expect = "colon"
+                    elif self._depth == 1 and self._expect == "value":
+                        self._emit(text[self._value_start : i + 1])
+                continue
+
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._expect = "key"
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect == "key":
+                    self._key_start = i
+                elif self._depth == 1 and self._expect == "value" and self._value_start < 0:
+                    self._value_start = i
+            elif ch in "{[":
+                if self._depth == 1 and self._expect == "value" and self._value_start < 0:
+                    self._value_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._value_start >= 0:
+                    self._emit(text[self._value_start : i + 1])
+                elif self._depth == 0 and self._value_start >= 0:
+                    self._emit(text[self._value_start : i])
+            elif self._depth == 1:
+                if ch == ":" and self._expect == "colon":
+                    self._expect = "value"
+                elif ch == ",":
+                    if self._value_start >= 0:
+                        self._emit(text[self._value_start : i])
+                    self._expect = "key"
+                elif not ch.isspace() and self._expect == "value" and self._value_start < 0:
+                    self._value_start = i
+        self._pos = len(text)
+
+    def _emit(self, raw: str) -> None:
+        key = self._key
+        self._key = None
+        self._value_start = -1
+        self._expect = "comma"
+        value = self._decode(raw.strip())
+        if isinstance(key, str) and value is not None:
+            self._on_field(key, value)
+
+    @staticmethod
+    def _decode(raw: str) -> object | None:
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+
 def _extract_json_object(text: str) -> Dict[str, object] | None:
     cleaned = text.strip()
     if cleaned.startswith("```"):
@@ -862,17 +4677,19 @@ def _extract_json_object(text: str) -> Dict[str, object] | None:
     return None
 
 
+_AI_OUTPUT_FIELDS = (
+    "titulo",
+    "diagnostico_en_una_frase",
+    "problema_principal",
+    "lo_que_te_esta_doliendo",
+    "como_ayudamos_consilium",
+    "que_incluye_consilium",
+    "beneficios_para_ti",
+)
+
+
 def _normalize_ai_output(obj: Dict[str, object]) -> Dict[str, object] | None:
-    required = [
-        "titulo",
-        "diagnostico_en_una_frase",
-        "problema_principal",
-        "lo_que_te_esta_doliendo",
-        "como_ayudamos_consilium",
-        "que_incluye_consilium",
-        "beneficios_para_ti",
-    ]
-    if any(k not in obj for k in required):
+    if any(k not in obj for k in _AI_OUTPUT_FIELDS):
         return None
 
     def as_str(v) -> str:
@@ -912,13 +4729,10 @@ def _normalize_ai_output(obj: Dict[str, object]) -> Dict[str, object] | None:
 
 
 def _stable_hash(obj: object) -> str:
-    # Stable, non-crypto hash for cache keys.
-    s = json.dumps(obj, sort_keys=True, ensure_ascii=False)
-    h = 2166136261
-    for ch in s:
-        h ^= ord(ch)
-        h = (h * 16777619) & 0xFFFFFFFF
-    return hex(h)[2:]
+    # Stable hash for cache keys: blake2b (128 bits) over canonical JSON bytes.
+    # Changing the canonical form or the digest requires bumping key prefixes.
+    data = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
 
 
 def _build_radar(by_category: Dict[str, Dict[str, int]]) -> Dict[str, object]:
@@ -0,0 +1,55 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import app as pfiscal  # noqa: E402
+import openai_stub  # noqa: E402
+
+
+@pytest.fixture
+def stub_server():
+    # Stub de OpenAI en un puerto efímero; `stub_server.base_url` va en OPENAI_BASE_URL.
+    server = openai_stub.serve()
+    server.base_url = openai_stub.base_url(server)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_app(monkeypatch, tmp_path):
+    # Todo el estado (cachés, sesiones, colas) en tmp_path; OpenAI apunta a un
+    # puerto cerrado para que ninguna prueba salga a la red.
+    def factory(**env):
+        defaults = {
+            "OPENAI_API_KEY": "",
+            "OPENAI_BASE_URL": "http://127.0.0.1:9/v1",
+            "OPENAI_TIMEOUT_SECONDS": "1",
+            "STATE_DB_PATH": str(tmp_path / "state.sqlite3"),
+            "AI_CACHE_PATH": str(tmp_path / "ai_cache.sqlite3"),
+            "AI_CACHE_SEED_PATH": str(tmp_path / "ai_prewarm.jsonl"),
+            "AI_JOB_DB_PATH": str(tmp_path / "ai_jobs.sqlite3"),
+            "AI_BATCH_STORE_PATH": str(tmp_path / "ai_batch.sqlite3"),
+            "SESSION_DB_PATH": str(tmp_path / "sessions.sqlite3"),
+            "SUBMISSION_LOG_DIR": "",
+        }
+        for name, value in {**defaults, **env}.items():
+            monkeypatch.setenv(name, value)
+        # Los singletons guardan su conexión por hilo: se descartan para que cada
+        # prueba abra los archivos de su propio tmp_path.
+        for store in [*vars(pfiscal).values(), pfiscal._SINGLE_FLIGHT.locks]:
+            if isinstance(store, pfiscal._SQLiteStore):
+                store._local = threading.local()
+        app = pfiscal.create_app()
+        app.config["TESTING"] = True
+        return app
+
+    return factory
+
+
+def form_for(value: int) -> dict:
+    return {q.id: str(value) for q in pfiscal.QUESTIONS}
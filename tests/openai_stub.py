@@ -0,0 +1,199 @@
+# Servidor local que imita la API de OpenAI, para las pruebas y para probar a
+# mano (`python tests/openai_stub.py --port 8099`). No forma parte de la app.
+import argparse
+import json
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class OpenAIStubHandler(BaseHTTPRequestHandler):
+    # Imita /responses y /chat/completions. La salida
+    # se arma a partir del SCORING del prompt (áreas más bajas y preguntas), así
+    # que un payload al que le falten esos datos produce JSON incompleto.
+    # También imita /files y /batches (Batch API) en memoria: un lote queda
+    # `in_progress` durante `batch_seconds` y se resuelve al consultarlo.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path.endswith(("/files", "/batches")):
+            if not getattr(self.server, "batch_api", True):
+                return self._reply(404, {"error": {"message": f"unknown route {self.path}"}})
+            return self._files_upload(raw) if self.path.endswith("/files") else self._batches_create(raw)
+        try:
+            body = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            return self._reply(400, {"error": {"message": "JSON inválido"}})
+        reply = response_body(self.path, body)
+        if reply is None:
+            return self._reply(404, {"error": {"message": f"unknown route {self.path}"}})
+        time.sleep(getattr(self.server, "delay_seconds", 0.0))
+        return self._reply(200, reply)
+
+    def do_GET(self) -> None:
+        state = batch_state(self.server)
+        match = re.search(r"/(batches|files)/([\w-]+)(/content)?$", self.path)
+        with state["lock"]:
+            if match and match.group(1) == "files" and match.group(3) and match.group(2) in state["files"]:
+                data = state["files"][match.group(2)]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            batch = state["batches"].get(match.group(2)) if match and match.group(1) == "batches" else None
+            if batch is None:
+                return self._reply(404, {"error": {"message": f"unknown route {self.path}"}})
+            if batch["status"] == "in_progress" and time.time() >= batch["completes_at"]:
+                lines = []
+                for text in state["files"][batch["input_file_id"]].decode("utf-8").splitlines():
+                    request_line = json.loads(text)
+                    reply = response_body(request_line["url"], request_line["body"])
+                    lines.append(
+                        json.dumps(
+                            {
+                                "id": f"req_{secrets.token_hex(6)}",
+                                "custom_id": request_line["custom_id"],
+                                "response": {"status_code": 200 if reply else 404, "body": reply or {}},
+                                "error": None,
+                            },
+                            ensure_ascii=False,
+                        )
+                    )
+                output_file_id = f"file-{secrets.token_hex(6)}"
+                state["files"][output_file_id] = "\n".join(lines).encode("utf-8")
+                batch.update(status="completed", output_file_id=output_file_id)
+            return self._reply(200, {k: v for k, v in batch.items() if k != "completes_at"})
+
+    def _files_upload(self, raw: bytes) -> None:
+        boundary = self.headers.get_param("boundary") or ""
+        content = None
+        for part in raw.split(b"--" + boundary.encode("utf-8")):
+            head, _, value = part.partition(b"\r\n\r\n")
+            if b'name="file"' in head:
+                content = value[:-2] if value.endswith(b"\r\n") else value
+        if not boundary or content is None:
+            return self._reply(400, {"error": {"message": "Falta el archivo"}})
+        state = batch_state(self.server)
+        file_id = f"file-{secrets.token_hex(6)}"
+        with state["lock"]:
+            state["files"][file_id] = content
+        return self._reply(200, {"id": file_id, "object": "file", "purpose": "batch", "bytes": len(content)})
+
+    def _batches_create(self, raw: bytes) -> None:
+        state = batch_state(self.server)
+        try:
+            body = json.loads(raw.decode("utf-8"))
+        except ValueError:
+            return self._reply(400, {"error": {"message": "JSON inválido"}})
+        with state["lock"]:
+            if body.get("input_file_id") not in state["files"]:
+                return self._reply(400, {"error": {"message": "input_file_id desconocido"}})
+            batch = {
+                "id": f"batch_{secrets.token_hex(6)}",
+                "object": "batch",
+                "endpoint": body.get("endpoint"),
+                "input_file_id": body["input_file_id"],
+                "status": "in_progress",
+                "output_file_id": None,
+                "error_file_id": None,
+                "completes_at": time.time() + getattr(self.server, "batch_seconds", 0.0),
+            }
+            state["batches"][batch["id"]] = batch
+        return self._reply(200, {k: v for k, v in batch.items() if k != "completes_at"})
+
+    def _reply(self, status: int, payload: Dict[str, object]) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def batch_state(server) -> Dict[str, object]:
+    if not hasattr(server, "batch_state"):
+        server.batch_state = {"lock": threading.Lock(), "files": {}, "batches": {}}
+    return server.batch_state
+
+
+def response_body(path: str, body: Dict[str, object]) -> Dict[str, object] | None:
+    if path.endswith("/responses"):
+        parts = [c.get("text", "") for m in body.get("input", []) for c in m.get("content", [])]
+        text = model_output(parts[-1] if parts else "")
+        return {"output": [{"content": [{"type": "output_text", "text": text}]}]}
+    if path.endswith("/chat/completions"):
+        parts = [m.get("content", "") for m in body.get("messages", [])]
+        return {"choices": [{"message": {"content": model_output(parts[-1] if parts else "")}}]}
+    return None
+
+
+def model_output(user: str) -> str:
+    if "SCORING:\n" not in user:
+        return json.dumps({"message": "Interpretación de prueba del prediagnóstico."}, ensure_ascii=False)
+    try:
+        scoring = json.loads(user.split("SCORING:\n", 1)[1])
+    except ValueError:
+        return "{}"
+    ranked = scoring.get("categories_ranked_low_to_high") or []
+    weakest = (scoring.get("questions") or {}).get("weakest_5") or []
+    if len(ranked) < 2 or not weakest:
+        return json.dumps({"titulo": "Scoring incompleto"}, ensure_ascii=False)
+    low = " y ".join(f"{a['category']} ({a['pct']}%)" for a in ranked[:2])
+    out = {
+        "titulo": f"Prioridad: {ranked[0]['category']}",
+        "diagnostico_en_una_frase": f"Índice global de {scoring.get('total_pct')}% con brechas en {low}.",
+        "problema_principal": f"Las áreas más bajas son {low}; por ejemplo: «{weakest[0]['text']}».",
+        "lo_que_te_esta_doliendo": "Decisiones a ciegas y fugas de efectivo.",
+        "como_ayudamos_consilium": "Contabilidad al día, calendario de obligaciones y reportes mensuales.",
+        "que_incluye_consilium": ["Conciliaciones", "Calendario fiscal", "Reporte de flujo"],
+        "beneficios_para_ti": ["Claridad", "Cumplimiento", "Control"],
+    }
+    if '"message": string' in user:
+        out = {"message": "Interpretación de prueba del prediagnóstico.", **out}
+    return json.dumps(out, ensure_ascii=False)
+
+
+def serve(
+    host: str = "127.0.0.1", port: int = 0, *, delay: float = 0.0, batch_delay: float = 0.0, batch_api: bool = True
+) -> ThreadingHTTPServer:
+    # Arranca en un hilo; con `port=0` el sistema elige un puerto libre.
+    server = ThreadingHTTPServer((host, port), OpenAIStubHandler)
+    server.daemon_threads = True
+    server.delay_seconds = delay
+    server.batch_seconds = batch_delay
+    server.batch_api = batch_api
+    batch_state(server)
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub local de /responses, /chat/completions, /files y /batches.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--delay", type=float, default=0.0, help="Segundos de espera por respuesta.")
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="Segundos que tarda cada lote del Batch API.")
+    parser.add_argument("--no-batch-api", action="store_true", help="Responde 404 en /files y /batches.")
+    args = parser.parse_args()
+    server = serve(
+        args.host, args.port, delay=args.delay, batch_delay=args.batch_delay, batch_api=not args.no_batch_api
+    )
+    print(f"Stub de OpenAI en {base_url(server)} (Ctrl+C para salir)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
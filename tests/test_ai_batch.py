@@ -0,0 +1,40 @@
+import json
+
+import app as pfiscal
+from conftest import form_for
+
+
+def _plan_key(answers):
+    _, total_pct, by_category = pfiscal._compute_scores(answers)
+    return pfiscal._ai_ref_entry(total_pct=total_pct, by_category=by_category, answers=answers)["ai"]
+
+
+def test_ai_batch_publishes_plans_to_the_shared_cache(make_app, stub_server, tmp_path):
+    app = make_app(OPENAI_API_KEY="sk-test", OPENAI_BASE_URL=stub_server.base_url)
+    answers = {q_id: int(value) for q_id, value in form_for(2).items()}
+    source = tmp_path / "respuestas.jsonl"
+    source.write_text(json.dumps(answers) + "\n", encoding="utf-8")
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["ai-batch", str(source), "--poll-seconds", "0.05"])
+
+    assert result.exit_code == 0, result.output
+    cache = app.extensions["ai_cache"]
+    key = _plan_key(answers)
+    assert isinstance(cache.get(key), dict)
+
+    # Si el caché lo pierde, la siguiente corrida lo vuelve a publicar sin llamar a OpenAI.
+    cache.delete(key)
+    result = runner.invoke(args=["ai-batch", "--mode", "pool"])
+
+    assert result.exit_code == 0, result.output
+    assert isinstance(cache.get(key), dict)
+
+
+def test_ai_batch_requires_a_shared_cache(make_app, stub_server):
+    app = make_app(OPENAI_API_KEY="sk-test", OPENAI_BASE_URL=stub_server.base_url, AI_CACHE_BACKEND="memory")
+
+    result = app.test_cli_runner().invoke(args=["ai-batch"])
+
+    assert result.exit_code != 0
+    assert "AI_CACHE_BACKEND" in result.output
@@ -0,0 +1,34 @@
+import json
+import os
+
+
+def _write_seed(path, entries, mtime_ns):
+    path.write_text("".join(json.dumps({"key": k, "value": v}) + "\n" for k, v in entries.items()), encoding="utf-8")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_seed_loads_once_per_file_version(make_app, tmp_path):
+    seed = tmp_path / "ai_prewarm.jsonl"
+    _write_seed(seed, {"ai_v7:a": {"resumen": "a"}, "ai_interp_v3:a": "Mensaje a"}, 1_000_000_000)
+
+    cache = make_app().extensions["ai_cache"]
+    assert cache.get("ai_v7:a") == {"resumen": "a"}
+
+    # Mismo archivo: otro arranque no lo vuelve a leer.
+    cache.delete("ai_v7:a")
+    cache = make_app().extensions["ai_cache"]
+    assert cache.get("ai_v7:a") is None
+    assert cache.get("ai_interp_v3:a") == "Mensaje a"
+
+
+def test_new_seed_drops_keys_it_no_longer_has(make_app, tmp_path):
+    seed = tmp_path / "ai_prewarm.jsonl"
+    _write_seed(seed, {"ai_v7:a": {"resumen": "a"}, "ai_v7:b": {"resumen": "b"}}, 1_000_000_000)
+    make_app()
+
+    _write_seed(seed, {"ai_v7:b": {"resumen": "b"}, "ai_v7:c": {"resumen": "c"}}, 2_000_000_000)
+    cache = make_app().extensions["ai_cache"]
+
+    assert cache.get("ai_v7:a") is None
+    assert cache.get("ai_v7:b") == {"resumen": "b"}
+    assert cache.get("ai_v7:c") == {"resumen": "c"}
@@ -0,0 +1,50 @@
+import app as pfiscal
+from conftest import form_for
+
+
+def _queued_kinds():
+    rows = pfiscal._JOBS._conn().execute("SELECT kind FROM ai_jobs ORDER BY id").fetchall()
+    return [kind for (kind,) in rows]
+
+
+def _entry(answers):
+    _, total_pct, by_category = pfiscal._compute_scores(answers)
+    return pfiscal._ai_ref_entry(total_pct=total_pct, by_category=by_category, answers=answers)
+
+
+def test_combined_mode_dispatches_interpretation_when_plan_is_cached(make_app):
+    app = make_app(OPENAI_API_KEY="sk-test", AI_JOB_QUEUE="1", OPENAI_COMBINED_PROMPT="1")
+    form = form_for(2)
+    entry = _entry({k: int(v) for k, v in form.items()})
+    app.extensions["ai_cache"].set(str(entry["ai"]), {"resumen": "Plan en caché."})
+
+    response = app.test_client().post("/resultado", data=form)
+
+    assert response.status_code == 200
+    assert _queued_kinds() == ["interpretation"]
+
+
+def test_combined_mode_dispatches_one_call_when_both_are_missing(make_app):
+    app = make_app(OPENAI_API_KEY="sk-test", AI_JOB_QUEUE="1", OPENAI_COMBINED_PROMPT="1")
+
+    response = app.test_client().post("/resultado", data=form_for(4))
+
+    assert response.status_code == 200
+    assert _queued_kinds() == ["combined"]
+
+
+def test_unavailable_queue_falls_back_to_in_process_jobs(make_app, tmp_path):
+    # Un directorio en lugar de archivo: SQLite no puede abrir la cola.
+    app = make_app(OPENAI_API_KEY="sk-test", AI_JOB_QUEUE="1", AI_JOB_DB_PATH=str(tmp_path))
+
+    response = app.test_client().post("/resultado", data=form_for(3))
+
+    assert response.status_code == 200
+    assert b"ai-pending" in response.data
+
+
+def test_async_mode_is_disabled_without_a_shared_cache(make_app):
+    app = make_app(OPENAI_API_KEY="sk-test", AI_JOB_QUEUE="1", AI_CACHE_BACKEND="memory")
+
+    assert not app.config["AI_ASYNC_RESULTS"]
+    assert not app.config["AI_JOB_QUEUE"]
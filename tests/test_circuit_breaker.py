@@ -0,0 +1,86 @@
+import threading
+
+import app as pfiscal
+
+NAME = "openai:http://upstream"
+
+
+def _breaker(tmp_path, **overrides):
+    settings = dict(
+        enabled=True,
+        failure_rate=0.5,
+        min_calls=3,
+        window_seconds=60.0,
+        cooldown_seconds=0.0,
+        probe_seconds=30.0,
+    )
+    settings.update(overrides)
+    return pfiscal._CircuitBreaker(str(tmp_path / "state.sqlite3"), **settings)
+
+
+def _state(breaker):
+    row = breaker._conn().execute("SELECT state FROM circuit_breakers WHERE name = ?", (NAME,)).fetchone()
+    return row[0] if row else "closed"
+
+
+def _in_thread(fn):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn()))
+    thread.start()
+    thread.join()
+    return result[0] if result else None
+
+
+def test_opens_after_min_calls_with_failures(tmp_path):
+    breaker = _breaker(tmp_path, cooldown_seconds=60.0)
+    breaker.record(NAME, ok=False)
+    breaker.record(NAME, ok=False)
+    assert _state(breaker) == "closed"
+
+    breaker.record(NAME, ok=True)
+
+    assert _state(breaker) == "open"
+    assert not breaker.allow(NAME)
+
+
+def test_half_open_admits_a_single_probe(tmp_path):
+    breaker = _breaker(tmp_path, min_calls=1)
+    breaker.record(NAME, ok=False)
+
+    claims = []
+    threads = [threading.Thread(target=lambda: claims.append(breaker.allow(NAME))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claims) == [False] * 7 + [True]
+    assert _state(breaker) == "half_open"
+
+
+def test_only_the_probe_outcome_leaves_half_open(tmp_path):
+    breaker = _breaker(tmp_path, min_calls=1)
+    breaker.record(NAME, ok=False)
+    assert breaker.allow(NAME)
+
+    # Una llamada que ya estaba en curso (otro hilo, sin la prueba) no decide.
+    _in_thread(lambda: breaker.record(NAME, ok=True))
+    assert _state(breaker) == "half_open"
+    _in_thread(lambda: breaker.record(NAME, ok=False))
+    assert _state(breaker) == "half_open"
+
+    breaker.record(NAME, ok=True)
+    assert _state(breaker) == "closed"
+
+
+def test_failed_probe_reopens(tmp_path):
+    breaker = _breaker(tmp_path, min_calls=1, cooldown_seconds=60.0)
+    breaker.record(NAME, ok=False)
+    breaker.cooldown_seconds = 0.0
+    assert breaker.allow(NAME)
+    breaker.cooldown_seconds = 60.0
+
+    breaker.record(NAME, ok=False)
+
+    assert _state(breaker) == "open"
+    assert not breaker.allow(NAME)
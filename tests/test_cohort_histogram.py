@@ -0,0 +1,63 @@
+import random
+
+import app as pfiscal
+
+
+def _profiles(n, seed=7):
+    rng = random.Random(seed)
+    return [{q.id: rng.randint(1, 5) for q in pfiscal.QUESTIONS} for _ in range(n)]
+
+
+def _rows(profiles):
+    return [(0, bytes(answers[q.id] for q in pfiscal.QUESTIONS)) for answers in profiles]
+
+
+def _expected(values, value):
+    below = sum(1 for v in values if v < value)
+    tied = sum(1 for v in values if v == value)
+    return round(100 * (below + tied / 2) / len(values))
+
+
+def test_percentiles_match_a_brute_force_count(tmp_path):
+    cohort = pfiscal._CohortHistogram(str(tmp_path / "state.sqlite3"), min_samples=1, cache_seconds=0.0)
+    population = _profiles(300)
+    cohort.add(_rows(population[:100]))
+    cohort.add(_rows(population[100:]))
+    scored = [pfiscal._compute_scores(answers) for answers in population]
+
+    for answers in _profiles(20, seed=11) + [{q.id: 1 for q in pfiscal.QUESTIONS}, {q.id: 5 for q in pfiscal.QUESTIONS}]:
+        total, _, by_category = pfiscal._compute_scores(answers)
+        result = cohort.percentiles(total=total, by_category=by_category)
+
+        assert result["samples"] == len(population)
+        assert result["total"] == _expected([t for t, _, _ in scored], total)
+        for key, value in by_category.items():
+            expected = _expected([cats[key]["points"] for _, _, cats in scored], value["points"])
+            assert result["by_category"][key] == expected, key
+
+
+def test_needs_min_samples(tmp_path):
+    cohort = pfiscal._CohortHistogram(str(tmp_path / "state.sqlite3"), min_samples=5, cache_seconds=0.0)
+    profiles = _profiles(5)
+    total, _, by_category = pfiscal._compute_scores(profiles[0])
+
+    cohort.add(_rows(profiles[:4]))
+    assert cohort.percentiles(total=total, by_category=by_category) is None
+
+    cohort.add(_rows(profiles[4:]))
+    assert cohort.percentiles(total=total, by_category=by_category)["samples"] == 5
+
+
+def test_snapshot_is_reused_until_it_expires(tmp_path):
+    cohort = pfiscal._CohortHistogram(str(tmp_path / "state.sqlite3"), min_samples=1, cache_seconds=60.0)
+    profiles = _profiles(4)
+    total, _, by_category = pfiscal._compute_scores(profiles[0])
+    cohort.add(_rows(profiles[:2]))
+    assert cohort.percentiles(total=total, by_category=by_category)["samples"] == 2
+
+    cohort.add(_rows(profiles[2:]))
+    assert cohort.percentiles(total=total, by_category=by_category)["samples"] == 2
+
+    cohort.reset()
+    cohort.add(_rows(profiles))
+    assert cohort.percentiles(total=total, by_category=by_category)["samples"] == 4
@@ -0,0 +1,54 @@
+import random
+
+import app as pfiscal
+
+
+def _profiles(n):
+    rng = random.Random(1)
+    return [{q.id: rng.randint(1, 5) for q in pfiscal.QUESTIONS} for _ in range(n)]
+
+
+def test_compact_payload_is_smaller_and_still_answerable(make_app, stub_server):
+    # Mismos perfiles en modo full y compact contra el stub: el compacto debe
+    # ahorrar tokens sin perder los datos que el modelo necesita.
+    make_app(OPENAI_API_KEY="sk-test", OPENAI_BASE_URL=stub_server.base_url)
+    tokens = {}
+    for mode in pfiscal._SCORING_STATIC_KEYS:
+        tokens[mode] = 0
+        for answers in _profiles(5):
+            _, total_pct, by_category = pfiscal._compute_scores(answers)
+            payload = pfiscal._ai_result_payload(
+                total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=mode
+            )
+            system, user = pfiscal._insights_prompt(payload, payload_mode=mode)
+            tokens[mode] += pfiscal._estimate_tokens(system) + pfiscal._estimate_tokens(user)
+            raw_text, err = pfiscal._openai_text(
+                api_key="sk-test",
+                base_url=stub_server.base_url,
+                model="gpt-test",
+                api_mode="auto",
+                system=system,
+                user=user,
+                timeout_seconds=5,
+            )
+            assert err is None
+            assert pfiscal._normalize_ai_output(pfiscal._extract_json_object(raw_text)) is not None, mode
+
+    assert tokens["compact"] < tokens["full"]
+
+
+def test_payload_mode_comes_from_app_config(make_app, stub_server):
+    app = make_app(OPENAI_API_KEY="sk-test", OPENAI_BASE_URL=stub_server.base_url, AI_PAYLOAD_MODE="compact")
+    answers = _profiles(1)[0]
+
+    response = app.test_client().post("/resultado", data={k: str(v) for k, v in answers.items()})
+
+    assert response.status_code == 200
+    _, total_pct, by_category = pfiscal._compute_scores(answers)
+    keys = {
+        mode: pfiscal._ai_ref_entry(total_pct=total_pct, by_category=by_category, answers=answers, payload_mode=mode)["ai"]
+        for mode in ("full", "compact")
+    }
+    cache = app.extensions["ai_cache"]
+    assert isinstance(cache.get(keys["compact"]), dict)
+    assert cache.get(keys["full"]) is None
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import app as pfiscal
+
+
+def _hedger(*, budget_ratio=1.0):
+    return pfiscal._Hedger(enabled=True, percentile=95.0, min_delay_seconds=0.05, budget_ratio=budget_ratio)
+
+
+def test_primary_runs_inline_without_hedge_when_fast():
+    hedger = _hedger()
+    threads = []
+
+    def call():
+        threads.append(threading.current_thread())
+        return "ok", None
+
+    assert hedger.run("chat:test", call) == ("ok", None)
+    time.sleep(0.1)
+    assert threads == [threading.current_thread()]
+
+
+def test_hedge_wins_and_cancels_the_slow_primary():
+    hedger = _hedger()
+    calls = []
+
+    def call():
+        calls.append(threading.current_thread())
+        if len(calls) == 1:
+            # Primer intento colgado hasta que el intento extra lo cancele.
+            deadline = time.monotonic() + 5
+            while not pfiscal._hedge_cancelled() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            return None, "cancelado" if pfiscal._hedge_cancelled() else "timeout"
+        return "hedged", None
+
+    started = time.monotonic()
+    assert hedger.run("chat:test", call) == ("hedged", None)
+    assert time.monotonic() - started < 2
+    assert calls[0] is threading.current_thread()
+    assert calls[1] is not threading.current_thread()
+    assert not pfiscal._hedge_cancelled()
+
+
+def test_no_hedge_without_budget():
+    hedger = _hedger(budget_ratio=0.0)
+    calls = []
+
+    def call():
+        calls.append(1)
+        time.sleep(0.2)
+        return "slow", None
+
+    assert hedger.run("chat:test", call) == ("slow", None)
+    time.sleep(0.1)
+    assert calls == [1]
+
+
+def test_budget_limits_hedges_to_a_fraction_of_calls():
+    # Con 0.5 por llamada sólo alcanza para cubrir una de cada dos.
+    hedger = _hedger(budget_ratio=0.5)
+    calls = []
+
+    def call():
+        calls.append(1)
+        time.sleep(0.15)
+        return "ok", None
+
+    for _ in range(4):
+        hedger.run("chat:test", call)
+    time.sleep(0.3)
+    assert len(calls) == 6
@@ -0,0 +1,70 @@
+import http.client
+import json
+
+import pytest
+
+import app as pfiscal
+
+
+class _DeadConnection:
+    # Conexión keep-alive reutilizada que falla en la fase indicada.
+    def __init__(self, error, *, on_send):
+        self.error = error
+        self.on_send = on_send
+        self.sock = None
+        self.timeout = None
+        self.closed = False
+
+    def request(self, *args, **kwargs):
+        if self.on_send:
+            raise self.error
+
+    def getresponse(self):
+        raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def _post(pool, base_url):
+    return pool.post(
+        f"{base_url}/chat/completions",
+        headers={"Content-Type": "application/json"},
+        data=json.dumps({"model": "gpt-test", "messages": []}).encode("utf-8"),
+        timeout=5,
+    )
+
+
+def test_reused_connection_failing_on_send_is_retried(monkeypatch, stub_server):
+    pool = pfiscal._HTTPPool(max_idle_per_host=2)
+    dead = _DeadConnection(BrokenPipeError(), on_send=True)
+    monkeypatch.setattr(pool, "_acquire", lambda key: (dead, True))
+
+    status, _ = _post(pool, stub_server.base_url)
+
+    assert status == 200
+    assert dead.closed
+
+
+def test_failure_after_send_is_not_retried(monkeypatch, stub_server):
+    # El servidor pudo procesar el POST: reintentar podría duplicarlo.
+    pool = pfiscal._HTTPPool(max_idle_per_host=2)
+    dead = _DeadConnection(http.client.RemoteDisconnected("closed"), on_send=False)
+    monkeypatch.setattr(pool, "_acquire", lambda key: (dead, True))
+    connects = []
+    monkeypatch.setattr(pool, "_connect", lambda key: connects.append(key))
+
+    with pytest.raises(http.client.RemoteDisconnected):
+        _post(pool, stub_server.base_url)
+
+    assert dead.closed
+    assert connects == []
+
+
+def test_fresh_connection_failing_on_send_is_not_retried(monkeypatch, stub_server):
+    pool = pfiscal._HTTPPool(max_idle_per_host=2)
+    dead = _DeadConnection(ConnectionResetError(), on_send=True)
+    monkeypatch.setattr(pool, "_acquire", lambda key: (dead, False))
+
+    with pytest.raises(ConnectionResetError):
+        _post(pool, stub_server.base_url)
@@ -0,0 +1,17 @@
+import time
+
+import app as pfiscal
+
+
+def test_expired_lease_on_last_attempt_marks_job_failed(tmp_path):
+    jobs = pfiscal._JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=2, retry_seconds=0, lease_seconds=0.01)
+    jobs.enqueue("ai", {"entry": {}}, dedup_key="k")
+
+    claimed = [jobs.claim()]
+    time.sleep(0.05)
+    claimed.append(jobs.claim())
+    time.sleep(0.05)
+
+    assert [c[3] for c in claimed] == [1, 2]
+    assert jobs.claim() is None
+    assert jobs.stats()["failed"][0] == 1
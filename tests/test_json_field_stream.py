@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+import app as pfiscal
+
+DOCUMENT = {
+    "summary": 'Dice "hola" y usa {llaves} y [corchetes] \\ dentro del texto.',
+    "actions": [{"title": "Paso {1}", "detail": "cierra \"}\" sin romper"}, "otra, con coma"],
+    "meta": {"nested": {"deep": ["}", "{"]}, "ok": True},
+    "score": 42,
+    "ratio": -0.5,
+}
+
+
+def _collect(chunks):
+    fields = []
+    stream = pfiscal._JSONFieldStream(lambda key, value: fields.append((key, value)))
+    for chunk in chunks:
+        stream.feed(chunk)
+    return fields
+
+
+def test_emits_every_top_level_field_in_order():
+    text = json.dumps(DOCUMENT, ensure_ascii=False)
+
+    assert _collect([text]) == list(DOCUMENT.items())
+
+
+def test_character_by_character():
+    text = json.dumps(DOCUMENT, ensure_ascii=False)
+
+    assert _collect(list(text)) == list(DOCUMENT.items())
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_any_split_point(indent):
+    # Cortes en medio de escapes, comillas y llaves dentro de strings.
+    text = "Aquí va el JSON:\n" + json.dumps(DOCUMENT, ensure_ascii=False, indent=indent)
+    for cut in range(len(text) + 1):
+        assert _collect([text[:cut], text[cut:]]) == list(DOCUMENT.items()), cut
+
+
+def test_fields_arrive_before_the_object_closes():
+    fields = []
+    stream = pfiscal._JSONFieldStream(lambda key, value: fields.append(key))
+
+    stream.feed('{"summary": "listo", "actions": [{"title": "a')
+    assert fields == ["summary"]
+
+    stream.feed('"}], "score": 1')
+    assert fields == ["summary", "actions"]
+
+    stream.feed("}")
+    assert fields == ["summary", "actions", "score"]
@@ -0,0 +1,19 @@
+import pytest
+
+import app as pfiscal
+
+
+def _row(value):
+    row = {q.id: 3 for q in pfiscal.QUESTIONS}
+    row["q05"] = value
+    return row
+
+
+@pytest.mark.parametrize("value", [4, "4", " 4 "])
+def test_accepts_ints_and_digit_strings(value):
+    assert pfiscal._parse_answers(_row(value))["q05"] == 4
+
+
+@pytest.mark.parametrize("value", [True, 4.7, [3], {"v": 3}, "4.0", "", 6])
+def test_rejects_other_values_without_raising(value):
+    assert isinstance(pfiscal._parse_answers(_row(value)), str)
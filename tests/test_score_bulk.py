@@ -0,0 +1,29 @@
+import json
+import random
+
+import pytest
+
+import app as pfiscal
+
+
+def test_numpy_and_python_engines_agree(make_app, tmp_path):
+    pytest.importorskip("numpy")
+    rng = random.Random(3)
+    source = tmp_path / "respuestas.jsonl"
+    source.write_text(
+        "".join(
+            json.dumps({"id": f"e{i}", **{q.id: rng.randint(1, 5) for q in pfiscal.QUESTIONS}}) + "\n"
+            for i in range(250)
+        ),
+        encoding="utf-8",
+    )
+    runner = make_app().test_cli_runner()
+
+    outputs = {}
+    for engine in ("numpy", "python"):
+        result = runner.invoke(args=["score-bulk", str(source), "--engine", engine, "--batch-size", "64"])
+        assert result.exit_code == 0, result.output
+        outputs[engine] = result.stdout
+
+    assert outputs["numpy"] == outputs["python"]
+    assert outputs["numpy"].count("\n") == 251
@@ -0,0 +1,41 @@
+from conftest import form_for
+
+
+def _post_sizes(client, forms):
+    sizes = []
+    for form in forms:
+        response = client.post("/resultado", data=form)
+        assert response.status_code == 200
+        sizes.append(len(response.headers["Set-Cookie"]))
+    return sizes
+
+
+def test_cookie_size_constant_for_repeated_submissions(make_app):
+    app = make_app(OPENAI_API_KEY="sk-test", AI_ASYNC_RESULTS="1")
+    sizes = _post_sizes(app.test_client(), [form_for(3)] * 10)
+    assert len(set(sizes[1:])) == 1, sizes
+
+
+def test_cookie_keeps_only_the_latest_refs(make_app):
+    app = make_app(OPENAI_API_KEY="sk-test", AI_ASYNC_RESULTS="1", AI_SESSION_MAX_REFS="3")
+    client = app.test_client()
+    forms = []
+    for i in range(10):
+        form = form_for(1 + i % 5)
+        form["q01"] = str(1 + (i // 5) % 5)
+        forms.append(form)
+    sizes = _post_sizes(client, forms)
+    with client.session_transaction() as sess:
+        assert len(sess["ai_refs"]) == 3
+    # Con el tope lleno sólo varía lo que comprime zlib, no el número de referencias.
+    assert max(sizes[3:]) - min(sizes[3:]) < 16, sizes
+    assert max(sizes[3:]) < sizes[2] + 16, sizes
+
+
+def test_sync_mode_keeps_no_refs_in_the_session(make_app):
+    app = make_app(OPENAI_API_KEY="sk-test")
+    client = app.test_client()
+
+    assert client.post("/resultado", data=form_for(3)).status_code == 200
+    with client.session_transaction() as sess:
+        assert "ai_refs" not in sess
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+import app as pfiscal
+
+
+def _flight(tmp_path, mode="shared", wait_seconds=5.0):
+    return pfiscal._SingleFlight(pfiscal._SQLiteLocks(str(tmp_path / "state.sqlite3")), mode=mode, wait_seconds=wait_seconds)
+
+
+def _run_concurrently(fns):
+    results = [None] * len(fns)
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, fns[i]())) for i in range(len(fns))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_callers_in_one_process_share_one_call(tmp_path):
+    flight = _flight(tmp_path, mode="process")
+    calls = []
+
+    def generate():
+        calls.append(1)
+        time.sleep(0.2)
+        return "plan"
+
+    results = _run_concurrently([lambda: flight.do("ai_v7:x", generate, cached=lambda: None)] * 6)
+
+    assert results == ["plan"] * 6
+    assert calls == [1]
+
+
+def test_other_worker_waits_for_the_shared_cache(tmp_path):
+    # Dos instancias con el mismo archivo de candados hacen de dos workers.
+    leader, follower = _flight(tmp_path), _flight(tmp_path)
+    cache = {}
+    calls = []
+
+    def generate():
+        calls.append(threading.current_thread().name)
+        time.sleep(0.3)
+        cache["ai_v7:x"] = "plan"
+        return "plan"
+
+    def follow():
+        time.sleep(0.05)
+        return follower.do("ai_v7:x", generate, cached=lambda: cache.get("ai_v7:x"))
+
+    results = _run_concurrently([lambda: leader.do("ai_v7:x", generate, cached=lambda: cache.get("ai_v7:x")), follow])
+
+    assert results == ["plan", "plan"]
+    assert len(calls) == 1
+
+
+def test_follower_calls_itself_when_the_leader_leaves_nothing(tmp_path):
+    leader, follower = _flight(tmp_path), _flight(tmp_path)
+    calls = []
+
+    def generate():
+        calls.append(1)
+        time.sleep(0.2)
+        return None
+
+    def follow():
+        time.sleep(0.05)
+        return follower.do("ai_v7:x", generate, cached=lambda: None)
+
+    _run_concurrently([lambda: leader.do("ai_v7:x", generate, cached=lambda: None), follow])
+
+    assert len(calls) == 2
+    assert not leader.locks.held("single_flight:ai_v7:x")
+
+
+def test_leader_error_reaches_waiters(tmp_path):
+    flight = _flight(tmp_path, mode="process")
+
+    def generate():
+        time.sleep(0.2)
+        raise RuntimeError("boom")
+
+    def call():
+        with pytest.raises(RuntimeError):
+            flight.do("ai_v7:x", generate, cached=lambda: None)
+        return "raised"
+
+    assert _run_concurrently([call] * 3) == ["raised"] * 3
@@ -0,0 +1,40 @@
+import sqlite3
+
+from conftest import form_for
+
+
+def _locked(*args, **kwargs):
+    raise sqlite3.OperationalError("database is locked")
+
+
+def test_session_round_trip(make_app):
+    app = make_app(SESSION_BACKEND="sqlite")
+    client = app.test_client()
+
+    assert client.post("/resultado", data=form_for(4)).status_code == 200
+    with client.session_transaction() as sess:
+        assert sess["last_answers"]["q01"] == 4
+
+
+def test_failed_save_keeps_the_response(make_app, monkeypatch):
+    app = make_app(SESSION_BACKEND="sqlite")
+    monkeypatch.setattr(app.session_interface.store, "save", _locked)
+
+    response = app.test_client().post("/resultado", data=form_for(4))
+
+    assert response.status_code == 200
+
+
+def test_failed_delete_keeps_the_response(make_app, monkeypatch):
+    app = make_app(SESSION_BACKEND="sqlite")
+    client = app.test_client()
+    client.get("/")
+    with client.session_transaction() as sess:
+        sess["flash_error"] = "x"
+    calls = []
+    monkeypatch.setattr(app.session_interface.store, "delete", lambda sid: calls.append(sid) or _locked())
+
+    response = client.get("/reset")
+
+    assert response.status_code == 302
+    assert len(calls) == 1
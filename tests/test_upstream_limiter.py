@@ -0,0 +1,48 @@
+import time
+
+import app as pfiscal
+
+
+def _limiter(tmp_path, **overrides):
+    settings = dict(max_concurrent=2, rate_per_minute=0.0, burst=10, wait_seconds=0.1, lease_seconds=30.0)
+    settings.update(overrides)
+    return pfiscal._UpstreamLimiter(str(tmp_path / "state.sqlite3"), **settings)
+
+
+def test_without_limits_every_call_passes(tmp_path):
+    limiter = _limiter(tmp_path, max_concurrent=0)
+
+    assert limiter.acquire() == ""
+
+
+def test_blocks_past_capacity_until_a_slot_is_released(tmp_path):
+    limiter = _limiter(tmp_path)
+    first, second = limiter.acquire(), limiter.acquire()
+    assert first and second
+
+    started = time.monotonic()
+    assert limiter.acquire() is None
+    assert time.monotonic() - started >= limiter.wait_seconds
+
+    limiter.release(first)
+    assert limiter.acquire()
+
+
+def test_expired_lease_frees_its_slot(tmp_path):
+    # Un proceso que murió sin liberar su slot no lo retiene más allá del lease.
+    limiter = _limiter(tmp_path, max_concurrent=1, lease_seconds=0.2)
+    assert limiter.acquire()
+    assert limiter.acquire() is None
+
+    time.sleep(0.25)
+
+    assert limiter.acquire()
+
+
+def test_token_bucket_limits_the_burst(tmp_path):
+    limiter = _limiter(tmp_path, max_concurrent=0, rate_per_minute=60.0, burst=3, wait_seconds=0.0)
+    granted = [limiter.acquire() for _ in range(4)]
+    for owner in granted:
+        limiter.release(owner)
+
+    assert [owner is not None for owner in granted] == [True, True, True, False]